@@ -2,32 +2,59 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
+import db_engine
+
+# `app` and the extensions are created here so the other modules can import
+# them, but nothing is connected, registered or imported until create_app()
+# runs. Entry points (main.py, asgi.py, the CLI scripts) call it once; the
+# schema is managed by Alembic (flask --app main db upgrade), never created
+# at startup.
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-migrate = Migrate(app, db)
-csrf = CSRFProtect(app)
-
 # Configure upload folder
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
 
-with app.app_context():
+db = SQLAlchemy(session_options={'class_': db_engine.RoutingSession})
+login_manager = LoginManager()
+login_manager.login_view = 'login'
+csrf = CSRFProtect()
+migrate = None
+
+
+def create_app(config=None):
+    # Sets the app up and returns it. Later calls return it unchanged, so
+    # `config` overrides only apply to the first.
+    global migrate
+    if 'sqlalchemy' in app.extensions:
+        return app
+    if config:
+        app.config.update(config)
+
+    db.init_app(app)
+    db_engine.init_app(app, db)
+    login_manager.init_app(app)
+    csrf.init_app(app)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
     import models
-    db.create_all()
+    import metrics
+    metrics.init_app(app)
+    import counters  # only for the session hooks it registers
+    import user_cache
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        return user_cache.load_user(user_id)
+
+    import routes
 
-@login_manager.user_loader
-def load_user(user_id):
-    return models.User.query.get(int(user_id))
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+    return app
 
-from routes import *
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    create_app().run(host='0.0.0.0', port=5000)
@@ -0,0 +1,266 @@
+import asyncio
+import contextvars
+import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import aiofiles
+from flask import url_for
+from flask_login import current_user
+from app import create_app
+import routes
+import async_generation
+import webhook_client
+from script_generation import STREAM_CLOSED, fail_stream
+
+# ASGI entry point, as an alternative to serving `app` over WSGI:
+#
+#   uvicorn asgi:application --workers 4
+#
+# Streamed script generation runs natively on the event loop, using
+# AsyncOpenAI or an async HTTP client for the webhook, so a generation in
+# flight costs a coroutine rather than a thread. Request bodies are read
+# with async file I/O before anything touches a thread. Every other route
+# is the ordinary Flask view run on a bounded thread pool.
+
+app = create_app()
+_executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+_streaming_routes = {('POST', '/generate_script/stream')}
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def run_sync(func, *args):
+    return asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def read_body(receive):
+    # Small bodies stay in memory; larger ones (voice uploads, photos) are
+    # spooled to a temporary file with non-blocking writes. Reading stops as
+    # soon as the body passes MAX_CONTENT_LENGTH.
+    limit = app.config['MAX_CONTENT_LENGTH']
+    received = 0
+    buffer = io.BytesIO()
+    spool = spool_path = None
+    more_body = True
+    try:
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            received += len(chunk)
+            if limit and received > limit:
+                raise BodyTooLarge()
+            if spool is None and buffer.tell() + len(chunk) > app.config['ASGI_SPOOL_BYTES']:
+                fd, spool_path = tempfile.mkstemp(prefix='asgi_body_')
+                os.close(fd)
+                spool = await aiofiles.open(spool_path, 'wb')
+                await spool.write(buffer.getvalue())
+            if spool is not None:
+                await spool.write(chunk)
+            else:
+                buffer.write(chunk)
+    except BaseException:
+        if spool is not None:
+            await spool.close()
+            os.remove(spool_path)
+        raise
+    if spool is None:
+        buffer.seek(0)
+        return buffer
+    await spool.close()
+    body = open(spool_path, 'rb')
+    os.remove(spool_path)  # the open handle keeps the data until it is closed
+    return body
+
+
+def build_environ(scope, body):
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = f"HTTP_{name.upper().replace('-', '_')}"
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+
+async def call_flask(environ, send):
+    # Runs the WSGI app on the thread pool. Response bodies are pulled one
+    # chunk at a time, so streamed and file responses are not buffered whole.
+    # Each step may land on a different pool thread, so all of them run in
+    # one context: a stream_with_context body still sees the app and request
+    # context the view pushed.
+    start = {}
+    context = contextvars.copy_context()
+
+    def start_response(status, headers, exc_info=None):
+        start['status'] = int(status.split(' ', 1)[0])
+        start['headers'] = headers
+
+    def begin():
+        result = app(environ, start_response)
+        return result, iter(result)
+
+    result, chunks = await run_sync(context.run, begin)
+    done = object()
+    try:
+        await send({'type': 'http.response.start', 'status': start['status'], 'headers': _encode_headers(start['headers'])})
+        while True:
+            chunk = await run_sync(context.run, next, chunks, done)
+            if chunk is done:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await run_sync(context.run, result.close)
+
+
+def _start_generation(environ):
+    # The same checks the WSGI route makes (session, CSRF, form, rate limit),
+    # run through Flask's request handling. Returns (job_id, params, None) or
+    # (None, None, response).
+    with app.request_context(environ):
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                if not current_user.is_authenticated:
+                    rv = app.login_manager.unauthorized()
+                else:
+                    rv = routes.start_streamed_generation()
+                    if isinstance(rv, tuple):
+                        return rv[0], rv[1], None
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        response = app.process_response(app.make_response(rv))
+        return None, None, (response.status_code, list(response.headers.items()), response.get_data())
+
+
+async def stream_generation(scope, receive, body, send):
+    environ = build_environ(scope, body)
+    job_id, params, error = await run_sync(_start_generation, environ)
+    if error is not None:
+        status, headers, data = error
+        await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': data})
+        return
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _encode_headers([
+        ('Content-Type', 'text/event-stream; charset=utf-8'), ('Cache-Control', 'no-store'), ('X-Accel-Buffering', 'no'),
+    ])})
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def emit_event(event, data):
+        if disconnected.is_set():
+            raise ClientDisconnected()
+        await send({'type': 'http.response.body', 'body': routes.sse_event(event, data).encode(), 'more_body': True})
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        script_id = await async_generation.generate_script(app, run_sync, job_id, params,
+                                                           lambda text: emit_event('token', {'text': text}))
+        with app.request_context(environ):
+            redirect = url_for('view_script', script_id=script_id)
+        await emit_event('done', {'script_id': script_id, 'redirect': redirect})
+    except ClientDisconnected:
+        await run_sync(_fail, job_id, STREAM_CLOSED)
+        return
+    except Exception as e:
+        await run_sync(_fail, job_id, str(e))
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': routes.sse_event(
+                'error', {'error': f"Error generating script: {str(e)}"}).encode(), 'more_body': True})
+    finally:
+        watcher.cancel()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def _fail(job_id, error):
+    with app.app_context():
+        fail_stream(job_id, error)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if webhook_client._async_client is not None:
+                await webhook_client._async_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    try:
+        declared = int(dict(scope['headers']).get(b'content-length', 0))
+    except ValueError:
+        declared = 0
+    limit = app.config['MAX_CONTENT_LENGTH']
+    try:
+        if limit and declared > limit:
+            raise BodyTooLarge()
+        body = await read_body(receive)
+    except ClientDisconnected:
+        return
+    except BodyTooLarge:
+        # Let Flask answer (as it would under WSGI) without reading the body.
+        await call_flask(build_environ(scope, io.BytesIO()) | {'CONTENT_LENGTH': str(max(declared, limit + 1))}, send)
+        return
+    try:
+        if (scope['method'], scope['path']) in _streaming_routes:
+            await stream_generation(scope, receive, body, send)
+        else:
+            await call_flask(build_environ(scope, body), send)
+    finally:
+        body.close()
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import time
+from contextlib import AsyncExitStack
+import aiofiles
+import aiofiles.os
+from flask import current_app
+import metrics
+import prompt_cache
+import webhook_client
+from script_generation import PROMPT_FIELDS, build_prompt, finish_stream, parse_webhook_response
+import tts
+
+# Async counterparts of the network-bound parts of generation and TTS. The
+# ASGI entry point streams scripts with these, and render_audio jobs use them
+# when TTS_ASYNC is set, so a single thread can keep many requests in flight.
+
+_openai = None
+
+
+def get_openai():
+    # Bound to the ASGI server's event loop, which lives as long as the process.
+    global _openai
+    if _openai is None:
+        from openai import AsyncOpenAI
+        _openai = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _openai
+
+
+async def stream_openai(prompt):
+    with metrics.timed('openai_chat'):
+        stream = await get_openai().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "text"},
+            stream=True,
+        )
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def stream_webhook(prompt, client):
+    async with AsyncExitStack() as stack:
+        with metrics.timed('webhook'):
+            response = await stack.enter_async_context(client.stream_json({"prompt": prompt, "stream": True}))
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            await response.aread()
+            yield parse_webhook_response(response)
+            return
+        async for text in response.aiter_text():
+            if text:
+                yield text
+
+
+async def generate_script(app, run_sync, job_id, params, emit):
+    # Streams the script for a job started by routes.start_streamed_generation,
+    # calling `emit` with each piece, and returns the saved script's id.
+    # Database work goes through `run_sync` so it stays off the event loop.
+    def in_app(func, *args):
+        def call():
+            with app.app_context():
+                return func(*args)
+        return run_sync(call)
+
+    content = await in_app(prompt_cache.lookup, params, PROMPT_FIELDS, params.get('fresh_variation', False))
+    if content is not None:
+        await emit(content)
+    else:
+        started = time.monotonic()
+        prompt = build_prompt(params)
+        if app.config['SCRIPT_GENERATION_BACKEND'] == 'openai':
+            pieces = stream_openai(prompt)
+        else:
+            with app.app_context():
+                client = webhook_client.get_async_client()
+            pieces = stream_webhook(prompt, client)
+        collected = []
+        async for piece in pieces:
+            collected.append(piece)
+            await emit(piece)
+        content = ''.join(collected)
+        await in_app(prompt_cache.store, params, PROMPT_FIELDS, content, int((time.monotonic() - started) * 1000))
+    return await in_app(finish_stream, job_id, content)
+
+
+async def synthesize_chunk(client, options, path, chunk_bytes):
+    part_path = f"{path}.part"
+    with metrics.timed('openai_tts'):
+        async with client.audio.speech.with_streaming_response.create(**options) as audio_response:
+            async with aiofiles.open(part_path, "wb") as part_file:
+                async for data in audio_response.iter_bytes(chunk_bytes):
+                    await part_file.write(data)
+                    await part_file.flush()
+    await aiofiles.os.replace(part_path, f"{path}.seg")
+
+
+async def render_chunks(script_id, chunks, user_voice_path=None, on_progress=None):
+    # Same contract as tts.render_chunks, with the chunk requests multiplexed
+    # on one event loop instead of a thread each. Runs under asyncio.run() in
+    # the job worker, so the client is scoped to this call.
+    config = current_app.config
+    limit = asyncio.Semaphore(config['TTS_MAX_CONCURRENCY'])
+    done = 0
+
+    from openai import AsyncOpenAI
+    async with AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY")) as client:
+        async def synthesize(index, text):
+            nonlocal done
+            async with limit:
+                await synthesize_chunk(client, tts.speech_options(text, user_voice_path),
+                                       tts.segment_path(script_id, index, 'audio'), config['TTS_STREAM_CHUNK_BYTES'])
+            done += 1
+            if on_progress:
+                on_progress(done / len(chunks))
+
+        await asyncio.gather(*(synthesize(index, chunk) for index, chunk in enumerate(chunks)))
+    return [tts.segment_path(script_id, index, 'audio.seg') for index in range(len(chunks))]
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import subprocess
+from flask import current_app
+from app import db
+from models import Script
+import jobs
+import music_catalog
+import storage
+
+# Mixes a script's voice track with a looping background track into a single
+# file per (voice, background, volume pair, speed). Both inputs are decoded
+# by ffmpeg into raw PCM pipes and mixed block by block as NumPy arrays, so
+# memory use stays at a few blocks no matter how long the session is.
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+MIX_MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+}
+_ENCODER_ARGS = {
+    'mp3': ['-c:a', 'libmp3lame', '-f', 'mp3'],
+    'opus': ['-c:a', 'libopus', '-f', 'ogg'],
+}
+
+
+def _round(value):
+    return f"{float(value):.2f}"
+
+
+def voice_identity(script):
+    if script.audio_blob_key:
+        return script.audio_blob_key
+    return f"{script.audio_file}:{storage.get_storage().size(script.audio_file)}"
+
+
+def background_track(background_music):
+    if not background_music or background_music == 'none':
+        return None
+    return music_catalog.get_catalog().get(background_music)
+
+
+def background_path(background_music):
+    track = background_track(background_music)
+    return track.path if track else None
+
+
+def mix_key(script, background_music, volume, background_volume, speed):
+    track = background_track(background_music)
+    parts = [
+        voice_identity(script),
+        track.digest if track else 'none',
+        _round(volume),
+        _round(background_volume) if track else '-',
+        _round(speed),
+        current_app.config['MIX_FORMAT'],
+        current_app.config['MIX_BITRATE'],
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def mix_filename(key):
+    extension = 'ogg' if current_app.config['MIX_FORMAT'] == 'opus' else 'mp3'
+    return f"mix_{key}.{extension}"
+
+
+def mix_mimetype():
+    return MIX_MIMETYPES[current_app.config['MIX_FORMAT']]
+
+
+def _decoder(path, speed=None, loop=False):
+    ffmpeg = current_app.config['FFMPEG_BINARY']
+    args = [ffmpeg, '-nostdin', '-loglevel', 'error']
+    if loop:
+        args += ['-stream_loop', '-1']
+    args += ['-i', path]
+    if speed is not None and float(speed) != 1.0:
+        # atempo changes speed without shifting pitch; 0.5-2.0 matches the form.
+        args += ['-filter:a', f"atempo={float(speed)}"]
+    args += ['-f', 's16le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-']
+    return subprocess.Popen(args, stdout=subprocess.PIPE)
+
+
+def _encoder(out_path):
+    ffmpeg = current_app.config['FFMPEG_BINARY']
+    fmt = current_app.config['MIX_FORMAT']
+    args = [ffmpeg, '-nostdin', '-loglevel', 'error', '-y',
+            '-f', 's16le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-i', '-',
+            *_ENCODER_ARGS[fmt], '-b:a', current_app.config['MIX_BITRATE'], out_path]
+    return subprocess.Popen(args, stdin=subprocess.PIPE)
+
+
+def _read_block(stream, block_bytes):
+    import numpy as np
+    data = stream.read(block_bytes)
+    if not data:
+        return None
+    usable = len(data) - len(data) % 2
+    return np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32)
+
+
+def render_mix(voice_path, bg_path, volume, background_volume, speed, out_path):
+    # NumPy is only imported once there's something to mix.
+    import numpy as np
+    block_bytes = current_app.config['MIX_BLOCK_FRAMES'] * CHANNELS * 2
+    tmp_path = f"{out_path}.tmp"
+    voice = _decoder(voice_path, speed=speed)
+    background = _decoder(bg_path, loop=True) if bg_path else None
+    encoder = _encoder(tmp_path)
+    try:
+        while True:
+            block = _read_block(voice.stdout, block_bytes)
+            if block is None:
+                break
+            block *= float(volume)
+            if background is not None:
+                bg_block = _read_block(background.stdout, len(block) * 2)
+                if bg_block is not None:
+                    block[:len(bg_block)] += bg_block * float(background_volume)
+            np.clip(block, -32768, 32767, out=block)
+            encoder.stdin.write(block.astype(np.int16).tobytes())
+        encoder.stdin.close()
+        if encoder.wait() != 0 or voice.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed while mixing {voice_path}")
+        if background is not None and background.poll():
+            logging.warning(f"Could not decode background track {bg_path}; mixed without it")
+        os.replace(tmp_path, out_path)
+    finally:
+        for process in (voice, background, encoder):
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@jobs.job_handler('mix_audio')
+def run_mix_job(job, payload):
+    script = db.session.get(Script, payload['script_id'])
+    if script is None or not script.audio_file:
+        raise ValueError(f"Script {payload['script_id']} has no audio to mix")
+
+    backend = storage.get_storage()
+    filename = mix_filename(payload['key'])
+    if not backend.exists(filename):
+        # Another user's job may be mixing the same key; each works in its own
+        # scratch file and the identical results replace one another.
+        out_path = storage.scratch_path(f"job{job.id}_{filename}")
+        logging.info(f"Mixing audio for script {script.id} into {filename}")
+        with backend.local_copy(script.audio_file) as voice_path:
+            render_mix(voice_path, background_path(payload['background_music']), payload['volume'],
+                       payload['background_volume'], payload['playback_speed'], out_path)
+        backend.save_file(filename, out_path)
+    return {'script_id': script.id, 'mix_key': payload['key']}
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+from sqlalchemy import delete, event, select
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import AudioBlob
+import storage
+
+# Renders are stored once per (text, model, voice, voice sample) under a name
+# derived from that hash. Scripts point at a blob through audio_blob_key and
+# the blob's ref_count tracks how many scripts do, so a repeat render is just
+# a new pointer and a file is only removed when nothing refers to it.
+#
+# Files are only deleted once the transaction that dropped the last reference
+# has committed, so a rollback never leaves a row pointing at a missing file.
+# The blob row is removed then too, by a delete that re-checks ref_count
+# under the row lock; an attach that got in first keeps the blob alive, and
+# one that comes after finds it gone and fails rather than pointing a script
+# at a deleted file.
+
+
+def _stored_digest(filename):
+    digest = hashlib.sha256()
+    with storage.get_storage().open(filename) as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def render_key(text, model, voice, user_voice_filename=None):
+    digest = hashlib.sha256()
+    for part in (model, voice, _stored_digest(user_voice_filename) if user_voice_filename else '', text):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def blob_filename(key, extension='mp3'):
+    return f"tts_{key}.{extension}"
+
+
+def lookup(key):
+    blob = db.session.get(AudioBlob, key)
+    if blob is not None and storage.get_storage().exists(blob.filename):
+        return blob
+    return None
+
+
+def store(key, filename):
+    # Registers a file already written to storage under filename.
+    blob = db.session.get(AudioBlob, key)
+    if blob is None:
+        blob = AudioBlob(key=key, filename=filename, size=storage.get_storage().size(filename), ref_count=0)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # Another render stored the same audio first. Only the savepoint
+            # is rolled back, so the caller's transaction carries on.
+            blob = db.session.get(AudioBlob, key)
+    return blob
+
+
+def attach(script, blob):
+    if script.audio_blob_key == blob.key:
+        return
+    release(script)
+    attached = db.session.query(AudioBlob).filter_by(key=blob.key).update({AudioBlob.ref_count: AudioBlob.ref_count + 1})
+    if not attached:
+        raise ValueError('The audio was removed while it was being attached. Please try again.')
+    script.audio_blob_key = blob.key
+    script.audio_file = blob.filename
+
+
+def release(script):
+    # Drops the script's reference to its blob; the caller commits.
+    if not script.audio_blob_key:
+        return
+    key = script.audio_blob_key
+    db.session.query(AudioBlob).filter_by(key=key).update({AudioBlob.ref_count: AudioBlob.ref_count - 1})
+    script.audio_blob_key = None
+    blob = db.session.get(AudioBlob, key, populate_existing=True)
+    if blob is None:
+        return
+    if script.audio_file == blob.filename:
+        script.audio_file = None
+    if blob.ref_count <= 0:
+        db.session.info.setdefault('audio_blobs_released', set()).add(key)
+
+
+def delete_file(filename):
+    # Deletes a file that isn't a blob (legacy audio) once the caller commits.
+    db.session.info.setdefault('audio_files_released', set()).add(filename)
+
+
+def collect(keys):
+    # Deletes the blobs among `keys` that are still unreferenced, and their
+    # files. Runs on its own connection, outside any session.
+    deleted = []
+    with db.engine.begin() as conn:
+        for key in keys:
+            filename = conn.execute(select(AudioBlob.filename).where(AudioBlob.key == key)).scalar()
+            if filename is None:
+                continue
+            if conn.execute(delete(AudioBlob).where(AudioBlob.key == key, AudioBlob.ref_count <= 0)).rowcount:
+                deleted.append(filename)
+    for filename in deleted:
+        logging.info(f"Audio blob {filename} is no longer referenced; deleting it")
+        storage.delete_async(filename)
+    return deleted
+
+
+def _after_commit(session):
+    keys = session.info.pop('audio_blobs_released', None)
+    filenames = session.info.pop('audio_files_released', None)
+    if keys:
+        collect(keys)
+    for filename in filenames or ():
+        storage.delete_async(filename)
+
+
+def _after_rollback(session):
+    session.info.pop('audio_blobs_released', None)
+    session.info.pop('audio_files_released', None)
+
+
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _after_rollback)
@@ -0,0 +1,126 @@
+import argparse
+import time
+from contextlib import ExitStack
+from app import app, create_app, db
+from models import Script, AudioBlob
+import audio_store
+import transcode
+import storage
+
+
+def _report(label, results, elapsed):
+    bytes_in = sum(stats['bytes_in'] for stats in results)
+    bytes_out = sum(stats['bytes_out'] for stats in results)
+    print(f"{label}: {len(results)} files, {bytes_in} -> {bytes_out} bytes "
+          f"(saved {bytes_in - bytes_out} bytes, {100 * (1 - bytes_out / bytes_in) if bytes_in else 0:.1f}%)")
+    if elapsed:
+        print(f"  throughput: {len(results) / elapsed:.2f} files/s, {bytes_in / elapsed / 1e6:.2f} MB/s")
+
+
+def _run_batch(items, fmt, bitrate, mono):
+    # Fans the whole batch of (item, filename, new filename) out over the
+    # process pool, saves each output back to storage and yields
+    # (item, new filename, stats) in order.
+    backend = storage.get_storage()
+    pool = transcode.get_pool()
+    ffmpeg = app.config['FFMPEG_BINARY']
+    with ExitStack() as stack:
+        futures = []
+        for item, filename, new_filename in items:
+            src = stack.enter_context(backend.local_copy(filename))
+            dst = storage.scratch_path(new_filename)
+            futures.append((item, new_filename, dst, pool.submit(transcode.transcode_file, ffmpeg, src, dst, fmt, bitrate, mono)))
+        for item, new_filename, dst, future in futures:
+            try:
+                stats = future.result()
+                backend.save_file(new_filename, dst)
+            except Exception as e:
+                print(f"  failed: {item}: {str(e)}")
+                continue
+            yield item, new_filename, stats
+
+
+def backfill_voice_uploads(dry_run):
+    fmt = app.config['VOICE_UPLOAD_FORMAT']
+    filenames = sorted(key for key in storage.get_storage().keys('user_voice_') if key.endswith('.wav'))
+    print(f"Voice uploads to transcode to {fmt}: {len(filenames)}")
+    if dry_run or not filenames or fmt == 'wav':
+        return
+    started = time.monotonic()
+    results = []
+    for filename, new_filename, stats in _run_batch([(filename, filename, transcode.transcoded_filename(filename, fmt))
+                                                     for filename in filenames], fmt,
+                                                    app.config['VOICE_UPLOAD_BITRATE'], True):
+        Script.query.filter_by(audio_file=filename).update({Script.audio_file: new_filename})
+        db.session.commit()
+        storage.get_storage().delete(filename)
+        results.append(stats)
+    _report('Voice uploads', results, time.monotonic() - started)
+
+
+def backfill_tts_renders(dry_run):
+    fmt = app.config['TTS_OUTPUT_FORMAT']
+    extension = transcode.FORMATS[fmt]['extension']
+    blobs = [blob for blob in AudioBlob.query.all() if not blob.filename.endswith(f".{extension}")]
+    print(f"TTS renders to transcode to {fmt}: {len(blobs)}")
+    if dry_run or not blobs:
+        return
+    started = time.monotonic()
+    results = []
+    items = [(blob.key, blob.filename, transcode.transcoded_filename(blob.filename, fmt)) for blob in blobs]
+    for key, new_filename, stats in _run_batch(items, fmt, app.config['TTS_OUTPUT_BITRATE'], False):
+        blob = db.session.get(AudioBlob, key)
+        old_filename = blob.filename
+        blob.filename = new_filename
+        blob.size = stats['bytes_out']
+        Script.query.filter_by(audio_blob_key=key).update({Script.audio_file: blob.filename})
+        db.session.commit()
+        storage.get_storage().delete(old_filename)
+        results.append(stats)
+    _report('TTS renders', results, time.monotonic() - started)
+
+
+def backfill_legacy_renders(dry_run):
+    # Renders from before blobs existed are plain audio_{script id} files with
+    # no AudioBlob behind them. Each becomes a blob keyed by its contents,
+    # transcoded first unless it is already in the configured format, and
+    # every script pointing at the file is attached to it.
+    fmt = app.config['TTS_OUTPUT_FORMAT']
+    extension = transcode.FORMATS[fmt]['extension']
+    backend = storage.get_storage()
+    filenames = sorted({filename for (filename,) in db.session.query(Script.audio_file).filter(
+        Script.audio_blob_key.is_(None), Script.audio_file.like('audio\\_%', escape='\\'))
+        if backend.exists(filename)})
+    print(f"Legacy TTS renders to move to {fmt} blobs: {len(filenames)}")
+    if dry_run or not filenames:
+        return
+    keys = {filename: audio_store._stored_digest(filename) for filename in filenames}
+    current = [filename for filename in filenames if filename.endswith(f".{extension}")]
+    for filename in current:
+        _attach_legacy(filename, audio_store.store(keys[filename], filename))
+        db.session.commit()
+    started = time.monotonic()
+    results = []
+    items = [(filename, filename, audio_store.blob_filename(keys[filename], extension))
+             for filename in filenames if filename not in current]
+    for filename, new_filename, stats in _run_batch(items, fmt, app.config['TTS_OUTPUT_BITRATE'], False):
+        _attach_legacy(filename, audio_store.store(keys[filename], new_filename))
+        audio_store.delete_file(filename)
+        db.session.commit()
+        results.append(stats)
+    _report('Legacy TTS renders', results, time.monotonic() - started)
+
+
+def _attach_legacy(filename, blob):
+    for script in Script.query.filter_by(audio_file=filename, audio_blob_key=None).all():
+        audio_store.attach(script, blob)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Transcode existing voice uploads and TTS renders to the configured compact formats.')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be transcoded')
+    args = parser.parse_args()
+    with create_app().app_context():
+        backfill_voice_uploads(args.dry_run)
+        backfill_tts_renders(args.dry_run)
+        backfill_legacy_renders(args.dry_run)
@@ -0,0 +1,424 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+from flask import current_app
+from app import app, create_app, db
+from models import BatchScript, Script, User
+from forms import ScriptGenerationForm
+import jobs
+import prompt_cache
+from script_generation import PROMPT_FIELDS, build_prompt, generate_content
+
+# Bulk script generation for scheduled content, e.g. a daily script for every
+# subscriber. Each item is a ScriptGenerationForm-style parameter set plus the
+# user it is for. Items that would build the same prompt share one
+# generation; the generations fan out through a BATCH_BACKEND ('concurrent'
+# calls the configured backend with bounded concurrency, 'openai_batch' goes
+# through the OpenAI Batch API, 'stub_batch' is a local stand-in for it); the
+# Script rows are inserted together in one transaction at the end.
+#
+# Progress is appended to a JSON-lines checkpoint file as it happens, so
+# running the same batch again with the same checkpoint only generates what
+# is still missing. Which scripts were saved is recorded in BatchScript rows,
+# in the transaction that inserts them, so they are never inserted twice.
+#
+#   python batch_generation.py items.jsonl --checkpoint items.checkpoint --report report.json
+
+
+def validate_item(item):
+    # Returns (params, None) or (None, errors).
+    form = ScriptGenerationForm(formdata=None, data=item, meta={'csrf': False})
+    if not form.validate():
+        return None, {field: errors for field, errors in form.errors.items() if field in PROMPT_FIELDS}
+    params = {field: getattr(form, field).data for field in PROMPT_FIELDS}
+    params['fresh_variation'] = bool(item.get('fresh_variation'))
+    return params, None
+
+
+def prompt_key(params, index):
+    # Items asking for a fresh variation always get their own generation.
+    key = prompt_cache.cache_key(params, PROMPT_FIELDS)
+    return f"{key}:{index}" if params.get('fresh_variation') else key
+
+
+def batch_digest(items):
+    encoded = json.dumps(items, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class Checkpoint:
+    # Append-only JSON lines. A missing path keeps the state in memory only.
+    # The file names a run id, under which the saved scripts are recorded in
+    # the database.
+    def __init__(self, path, digest):
+        self.path = path
+        self.run_id = None
+        self.generated = {}
+        self.failed = {}
+        self.batch_id = None
+        self.committed = {}
+        self._file = None
+        if path and os.path.exists(path):
+            self._load(digest)
+        if path:
+            self._file = open(path, 'a', encoding='utf-8')
+            if os.path.getsize(path) == 0:
+                self.run_id = uuid.uuid4().hex
+                self._write({'digest': digest, 'run_id': self.run_id})
+            elif self.run_id is None:
+                # Written before run ids existed.
+                self.run_id = uuid.uuid4().hex
+                self._write({'run_id': self.run_id})
+        else:
+            self.run_id = uuid.uuid4().hex
+        self.committed.update(db.session.query(BatchScript.item_index, BatchScript.script_id).filter_by(
+            run_id=self.run_id))
+
+    def _load(self, digest):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash.
+                    continue
+                if 'digest' in entry and entry['digest'] != digest:
+                    raise ValueError(f"Checkpoint {self.path} belongs to a different batch")
+                if 'run_id' in entry:
+                    self.run_id = entry['run_id']
+                if entry.get('status') == 'done':
+                    self.generated[entry['key']] = entry['content']
+                    self.failed.pop(entry['key'], None)
+                elif entry.get('status') == 'failed':
+                    self.failed[entry['key']] = entry['error']
+                elif 'batch_id' in entry:
+                    self.batch_id = entry['batch_id']
+                elif 'committed' in entry:
+                    # Written by older versions, after the scripts were saved.
+                    self.committed.update({int(index): script_id for index, script_id in entry['committed']})
+        logging.info(f"Resuming batch from {self.path}: {len(self.generated)} prompts generated")
+
+    def _write(self, entry):
+        if self._file is not None:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def record(self, key, content=None, error=None):
+        if error is None:
+            self.generated[key] = content
+            self._write({'key': key, 'status': 'done', 'content': content})
+        else:
+            self.failed[key] = error
+            self._write({'key': key, 'status': 'failed', 'error': error})
+
+    def record_batch(self, batch_id):
+        self.batch_id = batch_id
+        self._write({'batch_id': batch_id})
+
+    def record_commit(self, script_ids):
+        # Goes into the caller's transaction, alongside the scripts.
+        db.session.add_all(BatchScript(run_id=self.run_id, item_index=index, script_id=script_id)
+                           for index, script_id in script_ids.items())
+        self.committed.update(script_ids)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ConcurrentBackend:
+    # One request per prompt through the configured generation backend, at
+    # most `concurrency` at a time.
+    def __init__(self, config):
+        self.concurrency = config['BATCH_MAX_CONCURRENCY']
+
+    def run(self, prompts, on_result, checkpoint):
+        flask_app = current_app._get_current_object()
+
+        def generate(key, prompt):
+            with flask_app.app_context():
+                started = time.monotonic()
+                try:
+                    content = generate_content(prompt)
+                    if not content or not content.strip():
+                        raise ValueError("Empty script content received")
+                except Exception as e:
+                    return {'key': key, 'error': str(e)}
+                finally:
+                    db.session.remove()
+                return {'key': key, 'content': content, 'latency_ms': int((time.monotonic() - started) * 1000)}
+
+        # Results are reported from this thread, which owns the checkpoint
+        # and the caller's session.
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch') as pool:
+            for future in as_completed([pool.submit(generate, key, prompt) for key, prompt in prompts.items()]):
+                on_result(**future.result())
+
+
+class OpenAIBatchBackend:
+    # Submits every prompt as one OpenAI Batch API job and polls it until it
+    # ends. The batch id goes into the checkpoint straight away, so an
+    # interrupted run picks up the same batch instead of submitting again.
+    TERMINAL = ('completed', 'failed', 'expired', 'cancelled')
+
+    def __init__(self, config, client=None):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.client = client
+        self.model = config['BATCH_OPENAI_MODEL']
+        self.poll_interval = config['BATCH_POLL_INTERVAL']
+
+    def _submit(self, prompts):
+        lines = [json.dumps({
+            'custom_id': key,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {'model': self.model, 'messages': [{'role': 'user', 'content': prompt}],
+                     'response_format': {'type': 'text'}},
+        }) for key, prompt in prompts.items()]
+        upload = self.client.files.create(file=('batch.jsonl', '\n'.join(lines).encode('utf-8')), purpose='batch')
+        batch = self.client.batches.create(input_file_id=upload.id, endpoint='/v1/chat/completions',
+                                           completion_window='24h')
+        logging.info(f"Submitted OpenAI batch {batch.id} with {len(lines)} requests")
+        return batch.id
+
+    def _wait(self, batch_id):
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in self.TERMINAL:
+                return batch
+            logging.info(f"OpenAI batch {batch_id} is {batch.status}")
+            time.sleep(self.poll_interval)
+
+    def _read(self, file_id):
+        if not file_id:
+            return []
+        return [json.loads(line) for line in self.client.files.content(file_id).text.splitlines() if line.strip()]
+
+    def run(self, prompts, on_result, checkpoint):
+        batch_id = checkpoint.batch_id
+        if batch_id is None:
+            batch_id = self._submit(prompts)
+            checkpoint.record_batch(batch_id)
+        batch = self._wait(batch_id)
+        answered = set()
+        for line in self._read(batch.output_file_id) + self._read(getattr(batch, 'error_file_id', None)):
+            key = line.get('custom_id')
+            if key not in prompts or key in answered:
+                continue
+            answered.add(key)
+            response = line.get('response') or {}
+            if line.get('error') or response.get('status_code') != 200:
+                error = line.get('error') or response.get('body', {}).get('error') or f"HTTP {response.get('status_code')}"
+                on_result(key, error=str(error.get('message', error) if isinstance(error, dict) else error))
+                continue
+            content = response['body']['choices'][0]['message']['content']
+            if not content or not content.strip():
+                on_result(key, error="Empty script content received")
+            else:
+                on_result(key, content)
+        for key in prompts.keys() - answered:
+            on_result(key, error=f"No result for this request in OpenAI batch {batch_id} ({batch.status})")
+        # Consumed; a later run retrying the failures submits a new batch.
+        checkpoint.record_batch(None)
+
+
+class LocalBatchAPI:
+    # Just enough of the OpenAI client's files/batches surface for
+    # OpenAIBatchBackend, answering each request with generate_content, for
+    # development and tests without Batch API access.
+    def __init__(self):
+        self._files = {}
+        self._batches = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._batches.__getitem__)
+
+    def _create_file(self, file, purpose):
+        file_id = f"file-local-{len(self._files) + 1}"
+        self._files[file_id] = file[1].decode('utf-8') if isinstance(file, tuple) else file.read().decode('utf-8')
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id):
+        return SimpleNamespace(text=self._files[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        output = []
+        for line in self._files[input_file_id].splitlines():
+            request = json.loads(line)
+            try:
+                content = generate_content(request['body']['messages'][-1]['content'])
+                body = {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]}
+                output.append({'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': body}})
+            except Exception as e:
+                output.append({'custom_id': request['custom_id'], 'response': None,
+                               'error': {'code': 'generation_failed', 'message': str(e)}})
+        output_file = self._create_file(('output.jsonl', '\n'.join(json.dumps(line) for line in output).encode('utf-8')),
+                                        'batch_output')
+        batch_id = f"batch-local-{len(self._batches) + 1}"
+        self._batches[batch_id] = SimpleNamespace(id=batch_id, status='completed', output_file_id=output_file.id,
+                                                  error_file_id=None)
+        return self._batches[batch_id]
+
+
+BACKENDS = {
+    'concurrent': ConcurrentBackend,
+    'openai_batch': OpenAIBatchBackend,
+    'stub_batch': lambda config: OpenAIBatchBackend(config, client=LocalBatchAPI()),
+}
+
+
+def run_batch(items, backend=None, checkpoint_path=None, on_progress=None):
+    # Returns a report with one status entry per input item, in input order:
+    # 'created' (with script_id), 'duplicate' (same user and prompt as an
+    # earlier item), 'invalid' or 'failed'. Running a batch again with its
+    # checkpoint retries only the failed items.
+    config = current_app.config
+    if len(items) > config['BATCH_MAX_ITEMS']:
+        raise ValueError(f"A batch can have at most {config['BATCH_MAX_ITEMS']} items")
+    backend_name = backend or config['BATCH_BACKEND']
+    checkpoint = Checkpoint(checkpoint_path, batch_digest(items))
+    try:
+        return _run(items, backend_name, checkpoint, on_progress)
+    finally:
+        checkpoint.close()
+
+
+def _run(items, backend_name, checkpoint, on_progress):
+    started = time.monotonic()
+    results = [{'index': index, 'ref': item.get('ref') if isinstance(item, dict) else None}
+               for index, item in enumerate(items)]
+    user_ids = {item.get('user_id') for item in items if isinstance(item, dict)}
+    known_users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(
+        [user_id for user_id in user_ids if isinstance(user_id, int)]))}
+
+    wanted = {}  # index -> (user_id, prompt key)
+    prompts = {}
+    params_by_key = {}
+    seen = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index].update(status='invalid', errors={'item': ['Expected an object.']})
+            continue
+        params, errors = validate_item(item)
+        if item.get('user_id') not in known_users:
+            errors = dict(errors or {}, user_id=['Unknown user.'])
+        if errors:
+            results[index].update(status='invalid', errors=errors)
+            continue
+        key = prompt_key(params, index)
+        if (item['user_id'], key) in seen:
+            results[index].update(status='duplicate', duplicate_of=seen[(item['user_id'], key)])
+            continue
+        seen[(item['user_id'], key)] = index
+        wanted[index] = (item['user_id'], key)
+        prompts.setdefault(key, build_prompt(params))
+        params_by_key.setdefault(key, params)
+
+    # Items saved by an earlier run of this batch are done; anything else is
+    # generated unless the checkpoint or the prompt cache already has it.
+    outstanding = {index: wanted_item for index, wanted_item in wanted.items() if index not in checkpoint.committed}
+    needed = {key for _, key in outstanding.values()}
+    stats = {'items': len(items), 'prompts': len(prompts), 'from_checkpoint': 0, 'from_cache': 0, 'generated': 0,
+             'failed': 0}
+    pending = {}
+    for key in needed:
+        if key in checkpoint.generated:
+            stats['from_checkpoint'] += 1
+            continue
+        params = params_by_key[key]
+        content = prompt_cache.lookup(params, PROMPT_FIELDS, params['fresh_variation'])
+        if content is not None:
+            stats['from_cache'] += 1
+            checkpoint.record(key, content)
+        else:
+            pending[key] = prompts[key]
+    # The generations can take minutes; end the transaction so the
+    # connection goes back to the pool meanwhile.
+    db.session.commit()
+
+    latencies = {}
+
+    def on_result(key, content=None, error=None, latency_ms=None):
+        checkpoint.record(key, content, error)
+        stats['generated' if error is None else 'failed'] += 1
+        latencies[key] = latency_ms
+        if error is not None:
+            logging.warning(f"Batch generation failed for prompt {key[:12]}: {error}")
+        if on_progress:
+            on_progress(len(latencies) / len(pending))
+
+    if pending:
+        BACKENDS[backend_name](current_app.config).run(pending, on_result, checkpoint)
+        for key, latency_ms in latencies.items():
+            if key in checkpoint.generated:
+                prompt_cache.store(params_by_key[key], PROMPT_FIELDS, checkpoint.generated[key], latency_ms)
+
+    rows = {index: Script(content=checkpoint.generated[key], user_id=user_id)
+            for index, (user_id, key) in outstanding.items() if key in checkpoint.generated}
+    if rows:
+        db.session.add_all(rows.values())
+        db.session.flush()
+        script_ids = {index: script.id for index, script in rows.items()}
+        checkpoint.record_commit(script_ids)
+        db.session.commit()
+
+    for index, (user_id, key) in wanted.items():
+        if index in checkpoint.committed:
+            results[index].update(status='created', user_id=user_id, script_id=checkpoint.committed[index])
+        else:
+            results[index].update(status='failed', user_id=user_id,
+                                  error=checkpoint.failed.get(key, "Not generated"))
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'backend': backend_name, 'counts': counts, 'stats': stats,
+            'seconds': round(time.monotonic() - started, 3), 'items': results}
+
+
+@jobs.job_handler('generate_batch')
+def run_batch_job(job, payload):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'batches', f"batch_{job.id}.jsonl")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    report = run_batch(payload['items'], payload.get('backend'), path,
+                       on_progress=lambda progress: jobs.set_progress(job, progress))
+    logging.info(f"Batch job {job.id}: {report['counts']} in {report['seconds']}s")
+    return report
+
+
+def load_items(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate scripts in bulk from a JSON or JSON-lines file of items.')
+    parser.add_argument('items', help="File of items: goal, focus, duration, tone, visualization, affirmation_style, "
+                                      "user_id, and optionally fresh_variation and ref")
+    parser.add_argument('--checkpoint', help='Checkpoint file to resume from and record progress in '
+                                             '(default: <items>.checkpoint)')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), help='Overrides BATCH_BACKEND')
+    parser.add_argument('--concurrency', type=int, help='Overrides BATCH_MAX_CONCURRENCY')
+    parser.add_argument('--report', help='Write the per-item report to this file')
+    args = parser.parse_args()
+    with create_app().app_context():
+        if args.concurrency:
+            app.config['BATCH_MAX_CONCURRENCY'] = args.concurrency
+        report = run_batch(load_items(args.items), args.backend, args.checkpoint or f"{args.items}.checkpoint",
+                           on_progress=lambda progress: print(f"  {progress:.0%}", end='\r', flush=True))
+    print(f"{report['stats']['items']} items, {report['stats']['prompts']} distinct prompts "
+          f"({report['stats']['from_checkpoint']} from checkpoint, {report['stats']['from_cache']} cached, "
+          f"{report['stats']['generated']} generated, {report['stats']['failed']} failed) in {report['seconds']}s")
+    print(', '.join(f"{status}: {count}" for status, count in sorted(report['counts'].items())))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
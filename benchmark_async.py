@@ -0,0 +1,254 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# Measures how many streamed generations one server process keeps in flight,
+# served over WSGI on a fixed thread pool (as gunicorn's gthread worker does)
+# or over ASGI (asgi.py under uvicorn). A local stub stands in for the script
+# webhook / OpenAI and streams tokens with a fixed delay, so every generation
+# spends its time waiting on the network.
+#
+#   python benchmark_async.py --mode wsgi --threads 16 --concurrency 100
+#   python benchmark_async.py --mode asgi --concurrency 100 --backend openai
+#   python benchmark_async.py --mode both --concurrency 200 --tokens 40 --token-delay 0.05
+
+
+class StreamingStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    tokens = 20
+    token_delay = 0.05
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        openai = self.path.endswith('/chat/completions')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if openai else 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for index in range(self.tokens):
+                time.sleep(self.token_delay)
+                token = f"breathe{index} "
+                if openai:
+                    event = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                             'model': payload.get('model'),
+                             'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                    self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+                else:
+                    self._chunk(token.encode())
+            if openai:
+                self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(tokens, token_delay):
+    StreamingStub.tokens = tokens
+    StreamingStub.token_delay = token_delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StreamingStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_wsgi(app, threads):
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        # Requests beyond `threads` wait in the pool's queue, like a gthread worker.
+        multithread = True
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = PooledWSGIServer('127.0.0.1', 0, app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def serve_asgi():
+    import uvicorn
+    import asgi
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi.application, host='127.0.0.1', port=port, log_level='warning',
+                                           lifespan='on'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return f"http://127.0.0.1:{port}", stop
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def drive(base_url, cookies, count, concurrency, timeout):
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+    first_token, total, failures = [], [], []
+
+    def generate(index):
+        nonlocal in_flight, peak
+        session = requests.Session()
+        session.cookies.update(cookies)
+        data = {'goal': f'benchmark goal {index}', 'focus': 'career', 'duration': '5', 'tone': 'calm',
+                'visualization': 'guided', 'affirmation_style': 'present', 'fresh_variation': 'y'}
+        started = time.perf_counter()
+        streaming = False
+        try:
+            with session.post(base_url + '/generate_script/stream', data=data, stream=True, timeout=timeout) as response:
+                if response.status_code != 200:
+                    failures.append(f"HTTP {response.status_code}")
+                    return
+                body = b''
+                for chunk in response.iter_content(None):
+                    if not streaming:
+                        first_token.append(time.perf_counter() - started)
+                        streaming = True
+                        with lock:
+                            in_flight += 1
+                            peak = max(peak, in_flight)
+                    body += chunk
+                if b'event: done' not in body:
+                    failures.append('no done event')
+                    return
+                total.append(time.perf_counter() - started)
+        except requests.RequestException as e:
+            failures.append(type(e).__name__)
+        finally:
+            if streaming:
+                with lock:
+                    in_flight -= 1
+            session.close()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(generate, range(count)))
+    elapsed = time.monotonic() - started
+    return {
+        'requests': count,
+        'concurrency': concurrency,
+        'completed': len(total),
+        'failed': len(failures),
+        'failure_reasons': sorted(set(failures)),
+        'wall_seconds': elapsed,
+        'generations_per_second': len(total) / elapsed,
+        'peak_in_flight': peak,
+        'ttft_p50_ms': _percentile(first_token, 0.50) * 1000,
+        'ttft_p95_ms': _percentile(first_token, 0.95) * 1000,
+        'total_p50_ms': _percentile(total, 0.50) * 1000,
+        'total_p95_ms': _percentile(total, 0.95) * 1000,
+        'total_mean_ms': statistics.fmean(total) * 1000 if total else 0.0,
+    }
+
+
+def run(args):
+    stub_url = start_stub(args.tokens, args.token_delay)
+    upload_folder = tempfile.mkdtemp(prefix='benchmark_async_uploads_')
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['SCRIPT_GENERATION_WEBHOOK_URL'] = stub_url + '/webhook'
+    os.environ['SCRIPT_GENERATION_BACKEND'] = args.backend
+    os.environ['OPENAI_BASE_URL'] = stub_url + '/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    os.environ['WEBHOOK_POOL_SIZE'] = str(args.concurrency)
+    os.environ['ASGI_THREADS'] = str(args.threads)
+
+    from app import create_app, db
+    from models import User
+    app = create_app({'WTF_CSRF_ENABLED': False, 'UPLOAD_FOLDER': upload_folder})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', profile_photo='default.jpg')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+
+    modes = ('wsgi', 'asgi') if args.mode == 'both' else (args.mode,)
+    expected = args.tokens * args.token_delay
+    print(f"{args.requests} generations, {args.concurrency} concurrent, {args.threads} threads, "
+          f"{args.backend} stub streaming {args.tokens} tokens over {expected:.1f}s")
+    print(f"{'mode':<6}{'done':>6}{'failed':>8}{'wall s':>8}{'gen/s':>8}{'peak':>6}"
+          f"{'ttft p50':>10}{'ttft p95':>10}{'total p50':>11}{'total p95':>11}")
+    report = {}
+    for mode in modes:
+        base_url, stop = serve_wsgi(app, args.threads) if mode == 'wsgi' else serve_asgi()
+        session = requests.Session()
+        session.post(base_url + '/login', data={'username': 'bench', 'password': 'benchmark'}, allow_redirects=False)
+        row = drive(base_url, session.cookies, args.requests, args.concurrency, args.timeout)
+        stop()
+        report[mode] = row
+        print(f"{mode:<6}{row['completed']:>6}{row['failed']:>8}{row['wall_seconds']:>8.1f}"
+              f"{row['generations_per_second']:>8.1f}{row['peak_in_flight']:>6}"
+              f"{row['ttft_p50_ms']:>10.0f}{row['ttft_p95_ms']:>10.0f}{row['total_p50_ms']:>11.0f}{row['total_p95_ms']:>11.0f}")
+        if row['failure_reasons']:
+            print(f"      failures: {', '.join(row['failure_reasons'])}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    shutil.rmtree(upload_folder, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare in-flight streamed generations under WSGI and ASGI.')
+    parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'), default='both')
+    parser.add_argument('--concurrency', type=int, default=100, help='Generations started at once')
+    parser.add_argument('--requests', type=int, help='Total generations (default: the concurrency)')
+    parser.add_argument('--threads', type=int, default=16, help='WSGI worker threads, and the ASGI pool for sync work')
+    parser.add_argument('--backend', choices=('webhook', 'openai'), default='webhook', help='Script generation backend')
+    parser.add_argument('--tokens', type=int, default=20, help='Tokens the stub streams per generation')
+    parser.add_argument('--token-delay', type=float, default=0.05, help='Seconds between streamed tokens')
+    parser.add_argument('--database-url', default='sqlite:///benchmark_async.db', help='Throwaway database to run against')
+    parser.add_argument('--timeout', type=float, default=300, help='Per-request timeout in seconds')
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args()
+    args.requests = args.requests or args.concurrency
+    run(args)
@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+# Seed into a throwaway database unless one is given explicitly.
+os.environ.setdefault('DATABASE_URL', 'sqlite:///benchmark_queries.db')
+
+from sqlalchemy import insert, text
+from app import app, create_app, db
+from models import User, Script, Post, Comment, Job
+import counters
+
+HOT_INDEXES = [
+    index
+    for model in (Script, Post, Comment, Job)
+    for index in model.__table__.indexes
+    if index.name in (
+        'ix_script_user_id_created_at',
+        'ix_script_user_id_created_at_with_audio',
+        'ix_post_created_at_id',
+        'ix_comment_post_id_created_at',
+        'ix_job_user_id_kind_status',
+    )
+]
+
+
+def seed(users, scripts_per_user, posts, comments_per_post):
+    db.drop_all()
+    db.create_all()
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': 'x', 'profile_photo': 'default.jpg'}
+        for i in range(1, users + 1)
+    ])
+    db.session.execute(insert(Script), [
+        {'content': 'Breathe in... and relax...', 'user_id': user_id,
+         'created_at': now - timedelta(minutes=random.randint(0, 100000)),
+         'audio_file': f'audio_{user_id}_{n}.mp3' if n % 3 == 0 else None}
+        for user_id in range(1, users + 1) for n in range(scripts_per_user)
+    ])
+    db.session.execute(insert(Post), [
+        {'id': i, 'title': f'Post {i}', 'content': 'I manifested it!', 'user_id': random.randint(1, users),
+         'created_at': now - timedelta(minutes=i)}
+        for i in range(1, posts + 1)
+    ])
+    db.session.execute(insert(Comment), [
+        {'content': 'Congrats!', 'user_id': random.randint(1, users), 'post_id': post_id,
+         'created_at': now - timedelta(minutes=random.randint(0, 100000))}
+        for post_id in range(1, posts + 1) for _ in range(comments_per_post)
+    ])
+    db.session.execute(insert(Job), [
+        {'kind': 'render_audio', 'status': 'done', 'user_id': random.randint(1, users), 'payload': '{}'}
+        for _ in range(users * 5)
+    ])
+    db.session.commit()
+    # The bulk inserts bypass the ORM, so fill in the denormalized counters.
+    counters.reconcile()
+
+
+def hot_queries(user_id, post_ids):
+    return {
+        'profile scripts': Script.query.filter_by(user_id=user_id).order_by(Script.created_at.desc()).limit(app.config['SCRIPTS_PAGE_SIZE']),
+        'scripts with audio': Script.query.filter_by(user_id=user_id).filter(Script.audio_file.isnot(None)).order_by(Script.created_at.desc()).limit(app.config['SCRIPTS_PAGE_SIZE']),
+        'community page': Post.query.order_by(Post.created_at.desc(), Post.id.desc()).limit(21),
+        'comments for page': Comment.query.filter(Comment.post_id.in_(post_ids)).order_by(Comment.post_id, Comment.created_at),
+        'active render jobs': Job.query.filter_by(kind='render_audio', user_id=user_id).filter(Job.status.in_(['queued', 'running'])),
+    }
+
+
+def explain(query):
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    return [' '.join(str(col) for col in row) for row in db.session.execute(text(prefix + sql))]
+
+
+def run(label, repeat):
+    print(f"\n=== {label} ===")
+    for name, query in hot_queries(user_id=1, post_ids=list(range(1, 21))).items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            query.all()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+        print(f"{name}: {elapsed_ms:.2f} ms")
+        for line in explain(query):
+            print(f"    {line}")
+
+
+def benchmark(args):
+    with create_app().app_context():
+        seed(args.users, args.scripts_per_user, args.posts, args.comments_per_post)
+        for index in HOT_INDEXES:
+            index.drop(db.engine, checkfirst=True)
+        db.session.execute(text('ANALYZE'))
+        run('without indexes', args.repeat)
+        for index in HOT_INDEXES:
+            index.create(db.engine, checkfirst=True)
+        db.session.execute(text('ANALYZE'))
+        run('with indexes', args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Seed a database and compare hot query plans and timings with and without indexes.')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--scripts-per-user', type=int, default=40)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--comments-per-post', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    benchmark(parser.parse_args())
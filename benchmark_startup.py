@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measures how long a fresh process takes to import the app, set it up and
+# serve its first request, which is what every worker boot and CLI command
+# pays. Each run is a new interpreter against a throwaway SQLite database.
+# With --ref the same probe also runs against a checkout of that revision, so
+# a change can be compared with what came before it.
+#
+#   python benchmark_startup.py --runs 10
+#   python benchmark_startup.py --runs 10 --ref HEAD~1
+
+# Trees from before create_app() set everything up on import.
+PROBE = """
+import json, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+create_app = getattr(app_module, 'create_app', None)
+flask_app = create_app() if create_app else app_module.app
+booted = time.perf_counter()
+status = flask_app.test_client().get('/login').status_code
+served = time.perf_counter()
+print(json.dumps({'import': imported - started, 'boot': booted - imported, 'first_request': served - booted,
+                  'status': status}))
+"""
+
+STAGES = ('import', 'boot', 'first_request', 'process')
+
+
+def probe(tree, runs):
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix='benchmark_startup_')
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}")
+        env.setdefault('OPENAI_API_KEY', 'benchmark')
+        try:
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=env, capture_output=True, text=True,
+                                    check=True).stdout
+            elapsed = time.perf_counter() - started
+        except subprocess.CalledProcessError as e:
+            raise SystemExit(f"Startup probe failed in {tree}:\n{e.stderr}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        result = json.loads(output.strip().splitlines()[-1])
+        if result['status'] != 200:
+            raise SystemExit(f"GET /login returned {result['status']} in {tree}")
+        for stage in STAGES[:-1]:
+            timings[stage].append(result[stage])
+        timings['process'].append(elapsed)
+    return timings
+
+
+def report(label, timings):
+    print(label)
+    for stage in STAGES:
+        values = timings[stage]
+        print(f"  {stage:<14} median {statistics.median(values) * 1000:8.1f} ms   min {min(values) * 1000:8.1f} ms")
+
+
+def checkout(ref):
+    tree = tempfile.mkdtemp(prefix='benchmark_startup_ref_')
+    subprocess.run(['git', 'worktree', 'add', '--detach', tree, ref], check=True, capture_output=True)
+    return tree
+
+
+def benchmark(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    current = probe(here, args.runs)
+    if args.ref:
+        tree = checkout(args.ref)
+        try:
+            before = probe(tree, args.runs)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', tree], check=True, capture_output=True)
+        report(f"{args.ref}:", before)
+        report('working tree:', current)
+        speedup = statistics.median(before['process']) / statistics.median(current['process'])
+        print(f"process startup is {speedup:.2f}x {'faster' if speedup >= 1 else 'slower'} than {args.ref}")
+    else:
+        report('working tree:', current)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time importing the app, setting it up and serving the first request '
+                                                 'in fresh processes.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--ref', help='Also time this git revision, e.g. HEAD~1, for a before/after comparison')
+    benchmark(parser.parse_args())
@@ -1,16 +1,43 @@
 import os
-from openai import OpenAI
+import threading
+import metrics
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+
+# One client per process, shared by script generation and TTS. It's built on
+# first use since importing the SDK is a noticeable part of startup.
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(api_key=OPENAI_API_KEY)
+        return _client
 
 def send_openai_request(prompt: str) -> str:
-    response = openai_client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        response_format={"type": "text"},
-    )
+    with metrics.timed('openai_chat'):
+        response = get_client().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "text"},
+        )
     content = response.choices[0].message.content
     if not content:
         raise ValueError("OpenAI returned an empty response.")
     return content
+
+def stream_openai_request(prompt: str):
+    with metrics.timed('openai_chat'):
+        stream = get_client().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "text"},
+            stream=True,
+        )
+    with stream:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
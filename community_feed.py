@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Post, Comment
+
+
+def encode_cursor(post):
+    raw = json.dumps([post.created_at.isoformat(), post.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid feed cursor")
+
+
+def load_page(cursor=None, page_size=None):
+    posts, next_cursor = load_posts(cursor, page_size)
+    comments_by_post = load_comments([post.id for post in posts])
+    comment_counts = {post.id: post.comment_count for post in posts}
+    return posts, comments_by_post, comment_counts, next_cursor
+
+
+def load_posts(cursor=None, page_size=None):
+    page_size = page_size or current_app.config['COMMUNITY_PAGE_SIZE']
+    query = Post.query.options(joinedload(Post.author)).order_by(Post.created_at.desc(), Post.id.desc())
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        query = query.filter(or_(Post.created_at < created_at,
+                                 and_(Post.created_at == created_at, Post.id < post_id)))
+    posts = query.limit(page_size + 1).all()
+    next_cursor = None
+    if len(posts) > page_size:
+        posts = posts[:page_size]
+        next_cursor = encode_cursor(posts[-1])
+    return posts, next_cursor
+
+
+def load_comments(post_ids, per_post=None):
+    # One query for the first `per_post` comments of every post on the page,
+    # with their authors. Totals come from post.comment_count.
+    per_post = per_post or current_app.config['COMMUNITY_COMMENTS_PER_POST']
+    comments_by_post = {post_id: [] for post_id in post_ids}
+    if not post_ids:
+        return comments_by_post
+
+    position = func.row_number().over(partition_by=Comment.post_id,
+                                      order_by=(Comment.created_at.asc(), Comment.id.asc())).label('position')
+    ranked = db.session.query(Comment.id, position).filter(Comment.post_id.in_(post_ids)).subquery()
+    comments = (Comment.query.options(joinedload(Comment.author))
+                .join(ranked, ranked.c.id == Comment.id)
+                .filter(ranked.c.position <= per_post)
+                .order_by(Comment.post_id, ranked.c.position)
+                .all())
+    for comment in comments:
+        comments_by_post[comment.post_id].append(comment)
+    return comments_by_post
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'author': comment.author.username,
+        'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M'),
+    }
+
+
+def serialize_post(post, comments, comment_count):
+    return {
+        'id': post.id,
+        'title': post.title,
+        'content': post.content,
+        'author': post.author.username,
+        'created_at': post.created_at.strftime('%Y-%m-%d %H:%M'),
+        'comments': [serialize_comment(comment) for comment in comments],
+        'comment_count': comment_count,
+    }
@@ -1,10 +1,117 @@
 import os
+import db_engine
 
 class Config:
     SECRET_KEY = os.environ.get('FLASK_SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'auto')
+    DB_POOL_SETTINGS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'false').lower() in ('1', 'true', 'yes'),
+        'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        'statement_timeout_ms': int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)),
     }
+    SQLALCHEMY_ENGINE_OPTIONS = db_engine.engine_options(SQLALCHEMY_DATABASE_URI, DB_PROFILE, DB_POOL_SETTINGS)
+    SQLALCHEMY_BINDS = db_engine.replica_binds(DATABASE_REPLICA_URL, DB_PROFILE, DB_POOL_SETTINGS)
+    DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 10))
     UPLOADED_PHOTOS_DEST = os.path.join('static', 'uploads')
+    SCRIPT_GENERATION_BACKEND = os.environ.get('SCRIPT_GENERATION_BACKEND', 'webhook')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+    JOB_EAGER = os.environ.get('JOB_EAGER', '').lower() in ('1', 'true', 'yes')
+    JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 30))
+    JOB_STALE_AFTER = float(os.environ.get('JOB_STALE_AFTER', 120))
+    PROMPT_CACHE_BACKEND = os.environ.get('PROMPT_CACHE_BACKEND', 'memory')
+    PROMPT_CACHE_TTL = int(os.environ.get('PROMPT_CACHE_TTL', 7 * 24 * 3600))
+    PROMPT_CACHE_MAX_ENTRIES = int(os.environ.get('PROMPT_CACHE_MAX_ENTRIES', 1000))
+    TTS_MODEL = os.environ.get('TTS_MODEL', 'tts-1')
+    TTS_VOICE = os.environ.get('TTS_VOICE', 'alloy')
+    TTS_CHUNK_CHARS = int(os.environ.get('TTS_CHUNK_CHARS', 1500))
+    TTS_MAX_CONCURRENCY = int(os.environ.get('TTS_MAX_CONCURRENCY', 4))
+    TTS_STREAM_CHUNK_BYTES = int(os.environ.get('TTS_STREAM_CHUNK_BYTES', 16 * 1024))
+    TTS_STREAM_POLL_INTERVAL = float(os.environ.get('TTS_STREAM_POLL_INTERVAL', 0.25))
+    AUDIO_SENDFILE_MODE = os.environ.get('AUDIO_SENDFILE_MODE', '')
+    AUDIO_ACCEL_PREFIX = os.environ.get('AUDIO_ACCEL_PREFIX', '/protected')
+    BACKGROUND_MUSIC_MAX_AGE = int(os.environ.get('BACKGROUND_MUSIC_MAX_AGE', 24 * 3600))
+    BACKGROUND_MUSIC_FOLDER = os.environ.get('BACKGROUND_MUSIC_FOLDER')
+    BACKGROUND_MUSIC_CHECK_INTERVAL = float(os.environ.get('BACKGROUND_MUSIC_CHECK_INTERVAL', 10))
+    COMMUNITY_PAGE_SIZE = int(os.environ.get('COMMUNITY_PAGE_SIZE', 20))
+    COMMUNITY_COMMENTS_PER_POST = int(os.environ.get('COMMUNITY_COMMENTS_PER_POST', 5))
+    COMMUNITY_QUERY_BUDGET = int(os.environ.get('COMMUNITY_QUERY_BUDGET', 6))
+    SCRIPTS_PAGE_SIZE = int(os.environ.get('SCRIPTS_PAGE_SIZE', 20))
+    RENDER_CACHE_BACKEND = os.environ.get('RENDER_CACHE_BACKEND', 'memory')
+    RENDER_CACHE_MAX_ENTRIES = int(os.environ.get('RENDER_CACHE_MAX_ENTRIES', 2000))
+    RENDER_CACHE_TTL = int(os.environ.get('RENDER_CACHE_TTL', 3600))
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND', 'memory')
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 10))
+    USER_CACHE_REDIS_URL = os.environ.get('USER_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_CONCURRENCY_RETRY_AFTER = int(os.environ.get('RATE_LIMIT_CONCURRENCY_RETRY_AFTER', 10))
+    RATE_LIMITS = {
+        'llm': {
+            'user': os.environ.get('RATE_LIMIT_LLM_USER', '5/60'),
+            'global': os.environ.get('RATE_LIMIT_LLM_GLOBAL', '120/60'),
+            'user_concurrency': int(os.environ.get('RATE_LIMIT_LLM_USER_CONCURRENCY', 2)),
+            'global_concurrency': int(os.environ.get('RATE_LIMIT_LLM_GLOBAL_CONCURRENCY', 50)),
+        },
+        'tts': {
+            'user': os.environ.get('RATE_LIMIT_TTS_USER', '3/60'),
+            'global': os.environ.get('RATE_LIMIT_TTS_GLOBAL', '60/60'),
+            'user_concurrency': int(os.environ.get('RATE_LIMIT_TTS_USER_CONCURRENCY', 1)),
+            'global_concurrency': int(os.environ.get('RATE_LIMIT_TTS_GLOBAL_CONCURRENCY', 20)),
+        },
+        'mix': {
+            'user': os.environ.get('RATE_LIMIT_MIX_USER', '10/60'),
+            'global': os.environ.get('RATE_LIMIT_MIX_GLOBAL', '120/60'),
+            'user_concurrency': int(os.environ.get('RATE_LIMIT_MIX_USER_CONCURRENCY', 1)),
+            'global_concurrency': int(os.environ.get('RATE_LIMIT_MIX_GLOBAL_CONCURRENCY', 8)),
+        },
+    }
+    SCRIPT_GENERATION_WEBHOOK_URL = os.environ.get('SCRIPT_GENERATION_WEBHOOK_URL')
+    WEBHOOK_CONNECT_TIMEOUT = float(os.environ.get('WEBHOOK_CONNECT_TIMEOUT', 3.05))
+    WEBHOOK_READ_TIMEOUT = float(os.environ.get('WEBHOOK_READ_TIMEOUT', 120))
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 3))
+    WEBHOOK_BACKOFF_BASE = float(os.environ.get('WEBHOOK_BACKOFF_BASE', 0.5))
+    WEBHOOK_BACKOFF_MAX = float(os.environ.get('WEBHOOK_BACKOFF_MAX', 8))
+    WEBHOOK_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('WEBHOOK_CIRCUIT_FAILURE_THRESHOLD', 5))
+    WEBHOOK_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('WEBHOOK_CIRCUIT_RESET_TIMEOUT', 30))
+    WEBHOOK_POOL_SIZE = int(os.environ.get('WEBHOOK_POOL_SIZE', 10))
+    FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+    MIX_FORMAT = os.environ.get('MIX_FORMAT', 'mp3')
+    MIX_BITRATE = os.environ.get('MIX_BITRATE', '128k')
+    MIX_BLOCK_FRAMES = int(os.environ.get('MIX_BLOCK_FRAMES', 16384))
+    TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', 2))
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 32 * 1024 * 1024))
+    VOICE_UPLOAD_MAX_BYTES = int(os.environ.get('VOICE_UPLOAD_MAX_BYTES', 25 * 1024 * 1024))
+    VOICE_UPLOAD_MAX_SECONDS = int(os.environ.get('VOICE_UPLOAD_MAX_SECONDS', 15 * 60))
+    VOICE_UPLOAD_CHUNK_BYTES = int(os.environ.get('VOICE_UPLOAD_CHUNK_BYTES', 1024 * 1024))
+    VOICE_UPLOAD_EXPIRY = int(os.environ.get('VOICE_UPLOAD_EXPIRY', 24 * 3600))
+    VOICE_LOUDNESS_TARGET = float(os.environ.get('VOICE_LOUDNESS_TARGET', -16))
+    VOICE_UPLOAD_FORMAT = os.environ.get('VOICE_UPLOAD_FORMAT', 'opus')
+    VOICE_UPLOAD_BITRATE = os.environ.get('VOICE_UPLOAD_BITRATE', '32k')
+    TTS_OUTPUT_FORMAT = os.environ.get('TTS_OUTPUT_FORMAT', 'mp3')
+    TTS_OUTPUT_BITRATE = os.environ.get('TTS_OUTPUT_BITRATE', '48k')
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    STORAGE_CHUNK_SIZE = int(os.environ.get('STORAGE_CHUNK_SIZE', 64 * 1024))
+    STORAGE_URL_EXPIRES = int(os.environ.get('STORAGE_URL_EXPIRES', 3600))
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_MULTIPART_CHUNK_SIZE = int(os.environ.get('S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024))
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    TTS_ASYNC = os.environ.get('TTS_ASYNC', 'false').lower() == 'true'
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    ASGI_SPOOL_BYTES = int(os.environ.get('ASGI_SPOOL_BYTES', 1024 * 1024))
+    BATCH_BACKEND = os.environ.get('BATCH_BACKEND', 'concurrent')
+    BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 5000))
+    BATCH_OPENAI_MODEL = os.environ.get('BATCH_OPENAI_MODEL', 'gpt-4o')
+    BATCH_POLL_INTERVAL = float(os.environ.get('BATCH_POLL_INTERVAL', 30))
+    BATCH_API_TOKEN = os.environ.get('BATCH_API_TOKEN')
@@ -0,0 +1,123 @@
+import argparse
+import logging
+from collections import defaultdict
+from sqlalchemy import case, event, func, inspect, select
+from app import create_app, db
+from models import User, Script, Post, Comment
+
+# Denormalized counts read by the profile, audio and community pages:
+#
+#   user.script_count       scripts the user currently has
+#   user.audio_count        of those, scripts with audio
+#   user.scripts_generated  scripts ever generated (never decremented)
+#   post.comment_count      comments on the post
+#
+# plus two versions that render_cache keys its pages and fragments on:
+#
+#   user.content_version    bumped whenever one of the user's scripts, or the
+#                           name, email or photo shown on their pages, changes
+#   post.version            bumped whenever the post's comments change
+#
+# They are adjusted in the same transaction as the rows they count, by an
+# after_flush hook that looks at what the flush inserted, deleted or changed,
+# so every code path that adds, changes or removes scripts and comments
+# through the session keeps them right. Bulk query.update()/delete() calls
+# bypass it; `python counters.py` recomputes everything from the tables and
+# repairs any drift.
+
+
+def _stored_value(obj, attr):
+    # The value the row held before this flush.
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+
+def _after_flush(session, flush_context):
+    users = defaultdict(lambda: defaultdict(int))
+    posts = defaultdict(lambda: defaultdict(int))
+    for obj in session.new:
+        if isinstance(obj, Script):
+            users[obj.user_id]['script_count'] += 1
+            users[obj.user_id]['scripts_generated'] += 1
+            users[obj.user_id]['content_version'] += 1
+            if obj.audio_file:
+                users[obj.user_id]['audio_count'] += 1
+        elif isinstance(obj, Comment):
+            posts[obj.post_id]['comment_count'] += 1
+            posts[obj.post_id]['version'] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Script):
+            users[obj.user_id]['script_count'] -= 1
+            users[obj.user_id]['content_version'] += 1
+            if _stored_value(obj, 'audio_file'):
+                users[obj.user_id]['audio_count'] -= 1
+        elif isinstance(obj, Comment):
+            posts[obj.post_id]['comment_count'] -= 1
+            posts[obj.post_id]['version'] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Script) and obj not in session.deleted and session.is_modified(obj, include_collections=False):
+            users[obj.user_id]['content_version'] += 1
+            history = inspect(obj).attrs.audio_file.history
+            if history.has_changes():
+                had_audio = bool(history.deleted and history.deleted[0])
+                users[obj.user_id]['audio_count'] += bool(obj.audio_file) - had_audio
+        elif isinstance(obj, User) and any(inspect(obj).attrs[attr].history.has_changes()
+                                           for attr in ('username', 'email', 'profile_photo')):
+            users[obj.id]['content_version'] += 1
+
+    connection = session.connection()
+    for table, rows in ((User.__table__, users), (Post.__table__, posts)):
+        for row_id, deltas in rows.items():
+            values = {name: func.coalesce(table.c[name], 0) + delta for name, delta in deltas.items() if delta}
+            if values:
+                connection.execute(table.update().where(table.c.id == row_id).values(values))
+
+
+event.listen(db.session, 'after_flush', _after_flush)
+
+
+def _actual_counts():
+    scripts = select(func.count(Script.id)).where(Script.user_id == User.id).scalar_subquery()
+    audio = (select(func.count(Script.id)).where(Script.user_id == User.id, Script.audio_file.isnot(None))
+             .scalar_subquery())
+    comments = select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    return scripts, audio, comments
+
+
+def reconcile(dry_run=False):
+    # Returns {counter: number of rows that had drifted}.
+    scripts, audio, comments = _actual_counts()
+    # scripts_generated can't be recomputed once scripts are deleted; it is
+    # only raised to at least the number of scripts that still exist.
+    generated = case((func.coalesce(User.scripts_generated, 0) < scripts, scripts), else_=User.scripts_generated)
+    checks = [
+        ('user.script_count', User, User.script_count, scripts, User.content_version),
+        ('user.audio_count', User, User.audio_count, audio, User.content_version),
+        ('user.scripts_generated', User, User.scripts_generated, generated, User.content_version),
+        ('post.comment_count', Post, Post.comment_count, comments, Post.version),
+    ]
+    drift = {}
+    for name, model, column, actual, version in checks:
+        drifted = model.query.filter(func.coalesce(column, -1) != actual)
+        drift[name] = drifted.count()
+        if drift[name]:
+            logging.warning(f"{name}: {drift[name]} rows drifted")
+            if not dry_run:
+                # Bumping the version drops pages cached with the wrong count.
+                drifted.update({column: actual, version: version + 1}, synchronize_session=False)
+    if not dry_run:
+        db.session.commit()
+    return drift
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recompute the denormalized script, audio and comment counters.')
+    parser.add_argument('--dry-run', action='store_true', help='Only report how many rows have drifted')
+    args = parser.parse_args()
+    with create_app().app_context():
+        for name, count in reconcile(args.dry_run).items():
+            print(f"{name}: {count} {'drifted' if args.dry_run else 'repaired'}")
@@ -1,8 +1,8 @@
-from app import app, db
+from app import create_app, db
 from models import User
 
 def create_test_user():
-    with app.app_context():
+    with create_app().app_context():
         # Check if the test user already exists
         existing_user = User.query.filter_by(username='testuser').first()
         if existing_user:
@@ -0,0 +1,140 @@
+import functools
+import time
+from flask import g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Engine and pool settings per deployment profile (DB_PROFILE):
+#
+#   dev        SQLite or a local database; SQLAlchemy's default pool.
+#   prod       Postgres reached directly: a bounded pool sized by the
+#              DB_POOL_* settings, with connect and statement timeouts.
+#   pgbouncer  Postgres behind PgBouncer in transaction mode: PgBouncer does
+#              the pooling, so each checkout opens a fresh (cheap) client
+#              connection and nothing is held between requests.
+#   auto       dev for SQLite URLs, prod otherwise.
+#
+# Connections are recycled on a timer rather than pinged on every checkout;
+# set DB_POOL_PRE_PING if the network drops idle connections sooner.
+#
+# With DATABASE_REPLICA_URL set, GET requests to views wrapped in
+# @read_replica read from the replica. A user who has just written something
+# is kept on the primary for DB_REPLICA_STICKY_SECONDS so they see their own
+# change despite replica lag.
+
+PROFILES = ('dev', 'prod', 'pgbouncer')
+
+_wait_listeners = []
+
+
+class _TimedCheckout:
+    # Times how long a checkout waits for a connection (or, without a pool,
+    # to open one) and reports it to on_wait() listeners.
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            for listener in _wait_listeners:
+                listener(self.logging_name or 'primary', time.perf_counter() - started, timed_out)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def on_wait(listener):
+    _wait_listeners.append(listener)
+
+
+def resolve_profile(url, profile):
+    if profile == 'auto':
+        return 'dev' if not url or url.startswith('sqlite') else 'prod'
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE {profile!r}; expected one of {', '.join(PROFILES)} or auto")
+    return profile
+
+
+def engine_options(url, profile, settings, name='primary'):
+    profile = resolve_profile(url, profile)
+    options = {'pool_logging_name': name, 'pool_pre_ping': settings['pool_pre_ping']}
+    if profile == 'dev':
+        return options
+    options['connect_args'] = {'connect_timeout': settings['connect_timeout']}
+    if profile == 'pgbouncer':
+        # Startup parameters like statement_timeout aren't passed through by
+        # PgBouncer; set them on the database or role instead.
+        options['poolclass'] = TimedNullPool
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=settings['pool_size'],
+        max_overflow=settings['max_overflow'],
+        pool_timeout=settings['pool_timeout'],
+        pool_recycle=settings['pool_recycle'],
+        # Reuse the most recent connections so surplus ones idle out.
+        pool_use_lifo=True,
+    )
+    if settings['statement_timeout_ms']:
+        options['connect_args']['options'] = f"-c statement_timeout={settings['statement_timeout_ms']}"
+    return options
+
+
+def replica_binds(url, profile, settings):
+    if not url:
+        return {}
+    return {'replica': {'url': url, **engine_options(url, profile, settings, name='replica')}}
+
+
+class RoutingSession(Session):
+    # Reads go to the replica while the current view is marked read-only;
+    # flushes, and everything outside such views, use the primary.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context() and g.get('read_replica')
+                and 'replica' in self._db.engines):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and time.time() >= session.get('db_primary_until', 0):
+            g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def release_connection(db_session):
+    # Ends the session's transaction so its connection goes back to the pool
+    # while we wait on an external service. Loaded objects stay attached and
+    # reload on next access. Only call it with nothing pending.
+    db_session.commit()
+
+
+def init_app(app, db):
+    if not app.config['DATABASE_REPLICA_URL']:
+        return
+
+    def after_flush(db_session, flush_context):
+        db_session.info['wrote'] = True
+
+    def after_commit(db_session):
+        if db_session.info.pop('wrote', False) and has_request_context():
+            session['db_primary_until'] = time.time() + app.config['DB_REPLICA_STICKY_SECONDS']
+
+    def after_rollback(db_session):
+        db_session.info.pop('wrote', None)
+
+    event.listen(db.session, 'after_flush', after_flush)
+    event.listen(db.session, 'after_commit', after_commit)
+    event.listen(db.session, 'after_rollback', after_rollback)
@@ -0,0 +1,92 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import current_app, request, redirect, Response
+from werkzeug.utils import send_file
+import storage
+import metrics
+
+# Content digests are memoised per (path, mtime, size) so a conditional GET
+# only costs a stat() after the first hit on a file.
+_digests = {}
+_digests_lock = threading.Lock()
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+AUDIO_MIMETYPES = {
+    '.mp3': 'audio/mpeg',
+    '.ogg': 'audio/ogg',
+    '.m4a': 'audio/mp4',
+    '.wav': 'audio/wav',
+}
+
+
+def audio_mimetype(path):
+    extension = os.path.splitext(path)[1].lower()
+    return AUDIO_MIMETYPES.get(extension) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def content_digest(path):
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        cached = _digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    digest = digest.hexdigest()
+    with _digests_lock:
+        _digests[path] = (signature, digest)
+    return digest
+
+
+def _accel_response(path, mimetype, etag, as_attachment):
+    stat = os.stat(path)
+    internal = os.path.relpath(path, current_app.root_path).replace(os.sep, '/')
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = f"{current_app.config['AUDIO_ACCEL_PREFIX'].rstrip('/')}/{internal}"
+    if as_attachment:
+        response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(path)}"'
+    response.set_etag(etag)
+    response.last_modified = int(stat.st_mtime)
+    return response.make_conditional(request)
+
+
+def send_audio(path, immutable=False, max_age=None, as_attachment=True, mimetype='audio/mpeg'):
+    # Range requests, If-None-Match and If-Modified-Since are answered by
+    # Werkzeug's conditional handling against a strong content ETag. With
+    # AUDIO_SENDFILE_MODE set, the bytes are handed off to the front server.
+    etag = content_digest(path)
+    mode = current_app.config['AUDIO_SENDFILE_MODE']
+    if mode == 'x-accel-redirect':
+        response = _accel_response(path, mimetype, etag, as_attachment)
+    else:
+        response = send_file(path, request.environ, mimetype=mimetype, as_attachment=as_attachment,
+                             conditional=True, etag=etag, use_x_sendfile=(mode == 'x-sendfile'),
+                             response_class=current_app.response_class)
+    if response.status_code in (200, 206):
+        metrics.add_bytes_served(response.content_length if response.content_length is not None else os.path.getsize(path))
+    response.cache_control.private = True
+    response.cache_control.no_cache = None
+    if immutable:
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    elif max_age is not None:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def send_stored(key, immutable=False, max_age=None, as_attachment=True, mimetype=None):
+    # Local files go through send_audio; remote backends redirect the client
+    # to a short-lived presigned URL so the bytes never pass through the app.
+    backend = storage.get_storage()
+    path = backend.path(key)
+    if path is None:
+        return redirect(backend.url(key, expires=current_app.config['STORAGE_URL_EXPIRES']))
+    return send_audio(path, immutable=immutable, max_age=max_age, as_attachment=as_attachment,
+                      mimetype=mimetype or audio_mimetype(path))
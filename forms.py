@@ -1,9 +1,9 @@
-import os
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, SelectField, FloatField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, NumberRange
 from flask_wtf.file import FileField, FileRequired, FileAllowed
 from models import User
+import music_catalog
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
@@ -37,6 +37,7 @@ class ScriptGenerationForm(FlaskForm):
     visualization = SelectField('Visualization Type', choices=[('guided', 'Guided Imagery'), ('future_self', 'Future Self'), ('vision_board', 'Mental Vision Board')], validators=[DataRequired()])
     affirmation_style = SelectField('Affirmation Style', choices=[('present', 'Present Tense'), ('future', 'Future Tense'), ('gratitude', 'Gratitude-based')], validators=[DataRequired()])
     generate_audio = BooleanField('Generate Audio')
+    fresh_variation = BooleanField('Fresh Variation')
     submit = SubmitField('Generate Script')
 
 class PostForm(FlaskForm):
@@ -58,6 +59,4 @@ class AudioCustomizationForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(AudioCustomizationForm, self).__init__(*args, **kwargs)
-        audio_folder = os.path.join('static', 'audio')
-        audio_files = [f for f in os.listdir(audio_folder) if f.endswith('.mp3')]
-        self.background_music.choices = [('none', 'No Background Music')] + [(f, f) for f in audio_files]
+        self.background_music.choices = music_catalog.get_catalog().choices()
@@ -0,0 +1,220 @@
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, update
+from app import app, db
+from models import Job
+
+# In-process job queue. Job state lives in the `job` table, so any backend
+# SQLAlchemy supports (SQLite locally, Postgres in production) works; the
+# queue itself only carries job ids between the web thread and the workers.
+#
+# Since the queue dies with its process, every process touches heartbeat_at
+# on the jobs it holds (queued, running, or run inline by a request) every
+# JOB_HEARTBEAT_INTERVAL seconds. Jobs nobody has touched for JOB_STALE_AFTER
+# seconds were lost to a restart or crash: queued ones are taken over and run
+# here, running ones are marked failed, since their handler may have got
+# part way and running it again could repeat its side effects.
+ACTIVE_STATUSES = ('queued', 'running')
+INTERRUPTED = 'Interrupted by a server restart'
+
+_handlers = {}
+_queue = queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+_held = set()
+_held_lock = threading.Lock()
+
+
+def job_handler(kind):
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload, user_id=None):
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+    job = Job(kind=kind, user_id=user_id, payload=json.dumps(payload), status='queued',
+              queue_depth=_queue.qsize(), heartbeat_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    if app.config.get('JOB_EAGER'):
+        run_job(job.id)
+    else:
+        _start_workers()
+        _hold(job.id)
+        _queue.put(job.id)
+    logging.info(f"Enqueued {kind} job {job.id} (queue depth {job.queue_depth})")
+    return job
+
+
+def set_progress(job, progress):
+    job.progress = progress
+    db.session.commit()
+
+
+def run_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        logging.error(f"Job {job_id} disappeared before it could run")
+        return
+    job.status = 'running'
+    job.started_at = job.heartbeat_at = datetime.utcnow()
+    job.wait_ms = int((job.started_at - job.enqueued_at).total_seconds() * 1000)
+    db.session.commit()
+    try:
+        result = _handlers[job.kind](job, json.loads(job.payload or '{}'))
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+        complete(job, error=str(e))
+    else:
+        complete(job, result)
+
+
+def begin(kind, payload, user_id=None):
+    # Records work done inline by a request (e.g. a streamed generation) as a
+    # running job, so it shows up in job history and concurrency limits.
+    now = datetime.utcnow()
+    job = Job(kind=kind, user_id=user_id, payload=json.dumps(payload), status='running',
+              queue_depth=0, enqueued_at=now, started_at=now, heartbeat_at=now, wait_ms=0)
+    db.session.add(job)
+    db.session.commit()
+    if not app.config.get('JOB_EAGER'):
+        _start_workers()
+        _hold(job.id)
+    return job
+
+
+def complete(job, result=None, error=None):
+    if error is None:
+        job.result = json.dumps(result)
+        job.status = 'done'
+        job.progress = 1.0
+    else:
+        job.status = 'failed'
+        job.error = error
+    job.finished_at = datetime.utcnow()
+    job.run_ms = int((job.finished_at - job.started_at).total_seconds() * 1000)
+    db.session.commit()
+    _release(job.id)
+
+
+def job_payload(job):
+    return json.loads(job.payload) if job.payload else {}
+
+
+def job_result(job):
+    return json.loads(job.result) if job.result else None
+
+
+def stale_cutoff():
+    return datetime.utcnow() - timedelta(seconds=app.config['JOB_STALE_AFTER'])
+
+
+def is_alive():
+    # SQL condition for queued/running jobs some process still holds.
+    return func.coalesce(Job.heartbeat_at, Job.enqueued_at) >= stale_cutoff()
+
+
+def _hold(job_id):
+    with _held_lock:
+        _held.add(job_id)
+
+
+def _release(job_id):
+    with _held_lock:
+        _held.discard(job_id)
+
+
+def beat():
+    with _held_lock:
+        job_ids = list(_held)
+    if job_ids:
+        db.session.execute(update(Job).where(Job.id.in_(job_ids), Job.status.in_(ACTIVE_STATUSES))
+                           .values(heartbeat_at=datetime.utcnow()))
+        db.session.commit()
+
+
+def recover_stale():
+    # Takes over queued jobs and fails running ones whose process has
+    # stopped heartbeating. Each row is claimed with a conditional update,
+    # so with several processes only one of them acts on it.
+    # Returns (requeued, failed).
+    cutoff = stale_cutoff()
+    stale = (Job.query.with_entities(Job.id, Job.status, Job.kind)
+             .filter(Job.status.in_(ACTIVE_STATUSES), ~is_alive()).all())
+    requeued, failed = [], []
+    for job_id, status, kind in stale:
+        claim = update(Job).where(Job.id == job_id, Job.status == status,
+                                  func.coalesce(Job.heartbeat_at, Job.enqueued_at) < cutoff)
+        now = datetime.utcnow()
+        if status == 'queued' and kind in _handlers:
+            claimed = db.session.execute(claim.values(heartbeat_at=now)).rowcount
+            target = requeued
+        else:
+            claimed = db.session.execute(claim.values(status='failed', error=INTERRUPTED, finished_at=now)).rowcount
+            target = failed
+        db.session.commit()
+        if claimed:
+            target.append(job_id)
+    for job_id in requeued:
+        if app.config.get('JOB_EAGER'):
+            run_job(job_id)
+        else:
+            _hold(job_id)
+            _queue.put(job_id)
+    if requeued or failed:
+        logging.warning(f"Recovered stale jobs: requeued {requeued}, failed {failed}")
+    return requeued, failed
+
+
+def _worker():
+    while True:
+        job_id = _queue.get()
+        try:
+            with app.app_context():
+                run_job(job_id)
+                db.session.remove()
+        except Exception as e:
+            logging.error(f"Job worker crashed on job {job_id}: {str(e)}")
+        finally:
+            _release(job_id)
+            _queue.task_done()
+
+
+def _heartbeat():
+    # Recovery runs on the first pass too, so jobs lost to a restart are
+    # picked up as soon as this process starts its workers.
+    while True:
+        try:
+            with app.app_context():
+                beat()
+                recover_stale()
+                db.session.remove()
+        except Exception as e:
+            logging.error(f"Job heartbeat failed: {str(e)}")
+        time.sleep(app.config['JOB_HEARTBEAT_INTERVAL'])
+
+
+def _start_workers():
+    with _workers_lock:
+        if not _workers:
+            threading.Thread(target=_heartbeat, name='job-heartbeat', daemon=True).start()
+        while len(_workers) < app.config['JOB_WORKERS']:
+            worker = threading.Thread(target=_worker, name=f"job-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+@app.before_request
+def _start_on_first_request():
+    # Serving processes start their workers (and so recover lost jobs)
+    # without waiting for the first enqueue; CLI scripts never do.
+    if not _workers and not app.config.get('JOB_EAGER'):
+        _start_workers()
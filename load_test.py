@@ -0,0 +1,327 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# Drives a mix of realistic user flows against the app over HTTP, with local
+# stub servers standing in for the script webhook and the OpenAI API, and
+# reports throughput, latency percentiles and SQL statements per request.
+#
+#   python load_test.py --users 20 --duration 60 --llm-latency 1.5 --tts-latency 0.3
+#   python load_test.py --database-url postgresql://localhost/manifest_bench --json report.json
+
+SCENARIOS = {
+    'browse_community': 5,
+    'comment': 2,
+    'generate_script': 2,
+    'render_audio': 1,
+    'manifestation_session': 1,
+    'profile': 3,
+}
+
+# A silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz); enough of them make a
+# file ffmpeg can decode for the mixing flow.
+SILENT_MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latencies = {'webhook': 0.0, 'chat': 0.0, 'tts': 0.0}
+
+    def _reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.endswith('/audio/speech'):
+            time.sleep(self.latencies['tts'])
+            frames = max(40, len(payload.get('input', '')) // 2)
+            self._reply(SILENT_MP3_FRAME * frames, 'audio/mpeg')
+        elif self.path.endswith('/chat/completions'):
+            time.sleep(self.latencies['chat'])
+            body = {'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': payload.get('model'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': _script_text(payload['messages'][-1]['content'])}}]}
+            self._reply(json.dumps(body).encode(), 'application/json')
+        else:
+            time.sleep(self.latencies['webhook'])
+            self._reply(json.dumps({'content': _script_text(payload.get('prompt', ''))}).encode(), 'application/json')
+
+    def log_message(self, *args):
+        pass
+
+
+def _script_text(prompt):
+    return ' '.join(["Breathe in slowly... and let it go..."] * 8 + [f"You are already living it. ({prompt[:40]})"])
+
+
+def start_stubs(latencies):
+    StubHandler.latencies = latencies
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.samples[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, password, recorder, job_timeout, post_count):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.recorder = recorder
+        self.job_timeout = job_timeout
+        self.username = username
+        self.password = password
+        self.post_count = post_count
+        self.script_ids = []
+        self.rendered = set()
+
+    def request(self, name, method, path, expect=(200, 302), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, timeout=120, **kwargs)
+            ok = response.status_code in expect
+        except Exception:
+            response, ok = None, False
+        self.recorder.record(name, time.perf_counter() - started, ok)
+        return response
+
+    def wait(self, name, path, done):
+        deadline = time.monotonic() + self.job_timeout
+        while time.monotonic() < deadline:
+            response = self.request(name, 'GET', path, expect=(200, 302))
+            if response is None or done(response):
+                return response
+            time.sleep(0.2)
+        self.recorder.record(f"{name} (timed out)", self.job_timeout, False)
+        return None
+
+    def login(self):
+        self.request('login', 'POST', '/login', data={'username': self.username, 'password': self.password})
+
+    def browse_community(self):
+        response = self.request('community', 'GET', '/community')
+        if response is not None and response.status_code == 200:
+            self.request('community_feed', 'GET', '/community/feed')
+
+    def comment(self):
+        post_id = random.randint(1, self.post_count)
+        self.request('add_comment', 'POST', f'/add_comment/{post_id}', data={'content': 'This worked for me too!'})
+        self.request('post_comments', 'GET', f'/community/posts/{post_id}/comments')
+
+    def generate_script(self):
+        data = {'goal': random.choice(['a new job', 'better sleep', 'more confidence', 'a calm morning']),
+                'focus': random.choice(['health', 'wealth', 'relationships', 'career']), 'duration': '5',
+                'tone': 'calm', 'visualization': 'guided', 'affirmation_style': 'present'}
+        response = self.request('generate_script', 'POST', '/generate_script', data=data)
+        if response is None or 'job_status' not in response.headers.get('Location', ''):
+            return
+        job_id = response.headers['Location'].rstrip('/').rsplit('/', 1)[1]
+        progress = self.wait('job_progress', f'/job_progress/{job_id}',
+                             lambda r: r.status_code != 200 or r.json()['status'] in ('done', 'failed'))
+        if progress is not None and progress.status_code == 200 and progress.json().get('redirect'):
+            redirect = progress.json()['redirect']
+            self.script_ids.append(int(redirect.rsplit('/', 1)[1]))
+            self.request('view_script', 'GET', redirect)
+
+    def render_audio(self):
+        if not self.script_ids:
+            return self.generate_script()
+        script_id = random.choice(self.script_ids)
+        self.request('request_audio', 'POST', f'/view_script/{script_id}', data={'generate_audio': '1'})
+        response = self.wait('get_audio', f'/get_audio/{script_id}', lambda r: r.status_code == 200)
+        if response is not None and response.status_code == 200:
+            self.rendered.add(script_id)
+
+    def manifestation_session(self):
+        self.request('manifestation_session', 'GET', '/manifestation_session')
+        if not self.rendered:
+            return self.render_audio()
+        data = {'script': str(random.choice(sorted(self.rendered))), 'background_music': 'none',
+                'volume': '0.8', 'background_volume': '0.4', 'playback_speed': random.choice(['1.0', '1.25'])}
+        response = self.request('customize_session', 'POST', '/manifestation_session', data=data,
+                                headers={'Accept': 'application/json'})
+        if response is None or response.status_code != 200:
+            return
+        mix = response.json()
+        if 'progress_url' in mix:
+            self.wait('job_progress', mix['progress_url'], lambda r: r.status_code != 200 or r.json()['status'] in ('done', 'failed'))
+        self.request('mixed_audio', 'GET', mix['mix_url'])
+
+    def profile(self):
+        self.request('profile', 'GET', '/profile')
+        self.request('my_audio_files', 'GET', '/my_audio_files')
+
+
+def seed(users, posts, comments_per_post):
+    from sqlalchemy import insert
+    from app import db
+    from models import User, Post, Comment
+    import counters
+    db.drop_all()
+    db.create_all()
+    password_hash = User(username='x', email='x@example.com')
+    password_hash.set_password('loadtest')
+    db.session.execute(insert(User), [
+        {'username': f'load{i}', 'email': f'load{i}@example.com', 'password_hash': password_hash.password_hash,
+         'profile_photo': 'default.jpg'}
+        for i in range(users)
+    ])
+    db.session.flush()
+    user_ids = [user.id for user in User.query.all()]
+    db.session.execute(insert(Post), [
+        {'title': f'Post {i}', 'content': 'It happened!', 'user_id': random.choice(user_ids)} for i in range(posts)
+    ])
+    db.session.flush()
+    db.session.execute(insert(Comment), [
+        {'content': 'Congrats!', 'user_id': random.choice(user_ids), 'post_id': post.id}
+        for post in Post.query.all() for _ in range(comments_per_post)
+    ])
+    db.session.commit()
+    counters.reconcile()
+
+
+def run(args):
+    stub_url = start_stubs({'webhook': args.webhook_latency, 'chat': args.llm_latency, 'tts': args.tts_latency})
+    upload_folder = tempfile.mkdtemp(prefix='load_test_uploads_')
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['SCRIPT_GENERATION_WEBHOOK_URL'] = stub_url + '/webhook'
+    os.environ['SCRIPT_GENERATION_BACKEND'] = args.backend
+    os.environ['OPENAI_BASE_URL'] = stub_url + '/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'load-test')
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    os.environ['TTS_OUTPUT_FORMAT'] = 'mp3'
+
+    from werkzeug.serving import make_server
+    from app import create_app
+    import metrics
+    app = create_app({'WTF_CSRF_ENABLED': False, 'UPLOAD_FOLDER': upload_folder})
+    if args.ffmpeg:
+        app.config['FFMPEG_BINARY'] = args.ffmpeg
+
+    with app.app_context():
+        seed(args.users, args.posts, args.comments_per_post)
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    recorder = Recorder()
+    weights = dict(SCENARIOS)
+    for override in args.mix or []:
+        name, weight = override.split('=')
+        weights[name] = int(weight)
+    names = [name for name in weights if weights[name] > 0]
+    stop_at = time.monotonic() + args.duration
+    queries_before = metrics.db_queries.snapshot()
+    requests_before = defaultdict(int)
+    for labels, value in metrics.request_latency.snapshot().items():
+        requests_before[labels[0]] += value['count']
+
+    def user_loop(index):
+        user = VirtualUser(base_url, f'load{index}', 'loadtest', recorder, args.job_timeout, args.posts)
+        user.login()
+        while time.monotonic() < stop_at:
+            scenario = random.choices(names, weights=[weights[name] for name in names])[0]
+            getattr(user, scenario)()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=user_loop, args=(i,)) for i in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    queries = defaultdict(int)
+    for labels, count in metrics.db_queries.snapshot().items():
+        queries[labels[0]] += count - queries_before.get(labels, 0)
+    served = defaultdict(int)
+    for labels, value in metrics.request_latency.snapshot().items():
+        served[labels[0]] += value['count']
+    for endpoint, count in requests_before.items():
+        served[endpoint] -= count
+
+    report = {'duration_seconds': elapsed, 'users': args.users, 'requests': {}, 'endpoints': {}}
+    total = 0
+    for name, samples in sorted(recorder.samples.items()):
+        total += len(samples)
+        report['requests'][name] = {
+            'count': len(samples),
+            'errors': recorder.errors.get(name, 0),
+            'throughput_rps': len(samples) / elapsed,
+            'p50_ms': _percentile(samples, 0.50) * 1000,
+            'p95_ms': _percentile(samples, 0.95) * 1000,
+            'p99_ms': _percentile(samples, 0.99) * 1000,
+            'mean_ms': statistics.fmean(samples) * 1000,
+        }
+    for endpoint, count in sorted(served.items()):
+        if count > 0:
+            report['endpoints'][endpoint] = {'requests': count, 'db_queries_per_request': queries[endpoint] / count}
+    report['throughput_rps'] = total / elapsed
+
+    print(f"{args.users} users for {elapsed:.1f}s: {total} requests, {total / elapsed:.1f} req/s")
+    print(f"{'request':<28}{'count':>7}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, row in report['requests'].items():
+        print(f"{name:<28}{row['count']:>7}{row['errors']:>8}{row['throughput_rps']:>8.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+    print(f"\n{'endpoint':<28}{'requests':>9}{'queries/req':>13}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<28}{row['requests']:>9}{row['db_queries_per_request']:>13.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    shutil.rmtree(upload_folder, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load-test the app against stubbed webhook and OpenAI services.')
+    parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--database-url', default='sqlite:///load_test.db', help='Throwaway database to seed and run against')
+    parser.add_argument('--backend', choices=('webhook', 'openai'), default='webhook', help='Script generation backend')
+    parser.add_argument('--webhook-latency', type=float, default=0.5, help='Seconds the webhook stub waits before answering')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds the chat completions stub waits')
+    parser.add_argument('--tts-latency', type=float, default=0.2, help='Seconds the speech stub waits per chunk')
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--comments-per-post', type=int, default=5)
+    parser.add_argument('--job-timeout', type=float, default=60, help='Seconds to wait for a background job')
+    parser.add_argument('--mix', action='append', metavar='SCENARIO=WEIGHT', help=f"Override a scenario weight ({', '.join(SCENARIOS)})")
+    parser.add_argument('--ffmpeg', help='ffmpeg binary to use for mixing')
+    parser.add_argument('--json', help='Also write the report to this file')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    run(args)
@@ -0,0 +1,210 @@
+import bisect
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+import db_engine
+import query_budget
+
+# Process-local request and dependency metrics, rendered in the Prometheus
+# text format by /metrics. Each process keeps its own numbers; run one
+# scrape target per worker process.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            entry = self._data.setdefault(labels, {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0})
+            entry['counts'][bisect.bisect_left(self.buckets, seconds)] += 1
+            entry['sum'] += seconds
+            entry['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for labels, entry in self._data.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets + (float('inf'),), entry['counts']):
+                    cumulative += count
+                    buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+                snapshot[labels] = {'buckets': buckets, 'sum': entry['sum'], 'count': entry['count']}
+            return snapshot
+
+
+class Counter:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._data[labels] = self._data.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._data)
+
+
+class PoolGauge:
+    # Current value of a QueuePool statistic (checkedout, overflow, size) per
+    # engine; pools without one (NullPool) report nothing.
+    def __init__(self, statistic):
+        self.statistic = statistic
+        self.engines = {}
+
+    def snapshot(self):
+        values = {}
+        for name, engine in self.engines.items():
+            read = getattr(engine.pool, self.statistic, None)
+            if read is not None:
+                values[(name,)] = max(0, read())
+        return values
+
+
+request_latency = LatencyHistogram()
+external_latency = LatencyHistogram()
+db_queries = Counter()
+db_seconds = Counter()
+bytes_served = Counter()
+render_cache_lookups = Counter()
+render_cache_saved = Counter()
+user_cache_lookups = Counter()
+db_pool_checkouts = Counter()
+db_pool_connects = Counter()
+db_pool_timeouts = Counter()
+db_pool_wait = LatencyHistogram(POOL_WAIT_BUCKETS)
+db_pool_checked_out = PoolGauge('checkedout')
+db_pool_overflow = PoolGauge('overflow')
+db_pool_size = PoolGauge('size')
+
+# name, type, help, label names, collector
+_METRICS = (
+    ('http_request_duration_seconds', 'histogram', 'Request latency by endpoint.', ('endpoint', 'method', 'status'), request_latency),
+    ('external_call_duration_seconds', 'histogram', 'Latency of calls to external services.', ('service', 'outcome'), external_latency),
+    ('db_queries_total', 'counter', 'SQL statements issued while handling requests.', ('endpoint',), db_queries),
+    ('db_query_duration_seconds_total', 'counter', 'Time spent in SQL statements while handling requests.', ('endpoint',), db_seconds),
+    ('file_bytes_served_total', 'counter', 'Bytes of stored files sent to clients.', ('endpoint',), bytes_served),
+    ('render_cache_lookups_total', 'counter', 'Render cache lookups by page or fragment.', ('cache', 'result'), render_cache_lookups),
+    ('render_cache_saved_seconds_total', 'counter', 'Render time saved by render cache hits.', ('cache',), render_cache_saved),
+    ('db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.', ('engine',), db_pool_checkouts),
+    ('db_pool_connections_opened_total', 'counter', 'New database connections opened.', ('engine',), db_pool_connects),
+    ('db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a connection.', ('engine',), db_pool_timeouts),
+    ('db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pooled connection.', ('engine',), db_pool_wait),
+    ('db_pool_checked_out', 'gauge', 'Connections currently checked out.', ('engine',), db_pool_checked_out),
+    ('db_pool_overflow', 'gauge', 'Connections open beyond pool_size.', ('engine',), db_pool_overflow),
+    ('db_pool_size', 'gauge', 'Configured pool size.', ('engine',), db_pool_size),
+    ('user_cache_lookups_total', 'counter', 'Logged-in user lookups served from the user cache or the database.', ('result',), user_cache_lookups),
+)
+
+
+def _endpoint():
+    return (request.endpoint or 'unmatched') if has_request_context() else 'background'
+
+
+@contextmanager
+def timed(service):
+    # Times a call to an external service. Inside a request the time is also
+    # added to that request's Server-Timing entry for the service.
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        elapsed = time.perf_counter() - started
+        external_latency.observe((service, outcome), elapsed)
+        if has_request_context() and 'timings' in g:
+            g.timings[service] = g.timings.get(service, 0.0) + elapsed
+
+
+def add_bytes_served(count):
+    if count:
+        bytes_served.inc((_endpoint(),), count)
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.timings = {}
+    g.metrics_stack = ExitStack()
+    g.query_counter = g.metrics_stack.enter_context(query_budget.track_queries())
+
+
+def _after_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = _endpoint()
+    queries = g.query_counter
+    request_latency.observe((endpoint, request.method, str(response.status_code)), elapsed)
+    db_queries.inc((endpoint,), queries['count'])
+    db_seconds.inc((endpoint,), queries['seconds'])
+    if current_app.config['SERVER_TIMING'] or current_app.debug:
+        entries = [f'db;dur={queries["seconds"] * 1000:.1f};desc="{queries["count"]} queries"']
+        entries += [f"{service};dur={seconds * 1000:.1f}" for service, seconds in g.timings.items()]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers.add('Server-Timing', ', '.join(entries))
+    return response
+
+
+def _teardown_request(exc):
+    stack = g.pop('metrics_stack', None)
+    if stack is not None:
+        stack.close()
+
+
+def _observe_pool_wait(engine, seconds, timed_out):
+    db_pool_wait.observe((engine,), seconds)
+    if timed_out:
+        db_pool_timeouts.inc((engine,))
+
+
+def _instrument_engine(name, engine):
+    event.listen(engine, 'checkout', lambda *args: db_pool_checkouts.inc((name,)))
+    event.listen(engine, 'connect', lambda *args: db_pool_connects.inc((name,)))
+    for gauge in (db_pool_checked_out, db_pool_overflow, db_pool_size):
+        gauge.engines[name] = engine
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    db_engine.on_wait(_observe_pool_wait)
+    with app.app_context():
+        for bind_key, engine in app.extensions['sqlalchemy'].engines.items():
+            _instrument_engine(bind_key or 'primary', engine)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render():
+    lines = []
+    for name, kind, help_text, label_names, collector in _METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(collector.snapshot().items()):
+            if kind == 'histogram':
+                for bound, count in value['buckets'].items():
+                    lines.append(f"{name}_bucket{_labels(label_names, labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_sum{_labels(label_names, labels)} {value['sum']}")
+                lines.append(f"{name}_count{_labels(label_names, labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(label_names, labels)} {value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,48 @@
+"""Add indexes for hot query paths
+
+Revision ID: 5d9e2b7f4a61
+Revises: c7e35a9b14d2
+Create Date: 2026-10-18 13:05:44.872019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9e2b7f4a61'
+down_revision = 'c7e35a9b14d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('script', schema=None) as batch_op:
+        batch_op.create_index('ix_script_user_id_created_at', ['user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_script_user_id_created_at_with_audio', ['user_id', 'created_at'], unique=False,
+                              postgresql_where=sa.text('audio_file IS NOT NULL'),
+                              sqlite_where=sa.text('audio_file IS NOT NULL'))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_created_at_id', ['created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_id_created_at', ['post_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index('ix_job_user_id_kind_status', ['user_id', 'kind', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_user_id_kind_status')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_post_id_created_at')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_created_at_id')
+
+    with op.batch_alter_table('script', schema=None) as batch_op:
+        batch_op.drop_index('ix_script_user_id_created_at_with_audio')
+        batch_op.drop_index('ix_script_user_id_created_at')
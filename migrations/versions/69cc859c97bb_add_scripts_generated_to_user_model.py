@@ -1,7 +1,7 @@
 """Add scripts_generated to User model
 
 Revision ID: 69cc859c97bb
-Revises: 
+Revises: 4e8a1c6f2b90
 Create Date: 2024-10-17 11:22:49.787407
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = '69cc859c97bb'
-down_revision = None
+down_revision = '4e8a1c6f2b90'
 branch_labels = None
 depends_on = None
 
@@ -0,0 +1,29 @@
+"""Add batch script table
+
+Revision ID: 7c4e1a9d3b52
+Revises: f3b8d2a61c47
+Create Date: 2026-10-19 16:42:08.913557
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e1a9d3b52'
+down_revision = 'f3b8d2a61c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('batch_script',
+        sa.Column('run_id', sa.String(length=32), nullable=False),
+        sa.Column('item_index', sa.Integer(), nullable=False),
+        sa.Column('script_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('run_id', 'item_index')
+    )
+
+
+def downgrade():
+    op.drop_table('batch_script')
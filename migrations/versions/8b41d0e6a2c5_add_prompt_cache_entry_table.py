@@ -0,0 +1,37 @@
+"""Add prompt_cache_entry table
+
+Revision ID: 8b41d0e6a2c5
+Revises: 3f2a9c1d7e10
+Create Date: 2026-10-18 10:02:17.530911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d0e6a2c5'
+down_revision = '3f2a9c1d7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('prompt_cache_entry',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('latency_ms', sa.Integer(), nullable=True),
+        sa.Column('hit_count', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('prompt_cache_entry', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_prompt_cache_entry_last_used_at'), ['last_used_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('prompt_cache_entry', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_prompt_cache_entry_last_used_at'))
+
+    op.drop_table('prompt_cache_entry')
@@ -0,0 +1,32 @@
+"""Add audio customization columns to Script model
+
+Revision ID: a3f8c2e5d917
+Revises: e94c61f0b3a8
+Create Date: 2026-10-18 15:40:22.091376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f8c2e5d917'
+down_revision = 'e94c61f0b3a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('script', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('background_music', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('volume', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('background_volume', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('playback_speed', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('script', schema=None) as batch_op:
+        batch_op.drop_column('playback_speed')
+        batch_op.drop_column('background_volume')
+        batch_op.drop_column('volume')
+        batch_op.drop_column('background_music')
@@ -0,0 +1,41 @@
+"""Add denormalized script, audio and comment counters
+
+Revision ID: b6d1f4a8c273
+Revises: a3f8c2e5d917
+Create Date: 2026-10-18 17:05:41.512093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4a8c273'
+down_revision = 'a3f8c2e5d917'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('script_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('audio_count', sa.Integer(), nullable=False, server_default='0'))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute('UPDATE "user" SET script_count = (SELECT COUNT(*) FROM script WHERE script.user_id = "user".id)')
+    op.execute('UPDATE "user" SET audio_count = (SELECT COUNT(*) FROM script '
+               'WHERE script.user_id = "user".id AND script.audio_file IS NOT NULL)')
+    op.execute('UPDATE "user" SET scripts_generated = script_count '
+               'WHERE scripts_generated IS NULL OR scripts_generated < script_count')
+    op.execute('UPDATE post SET comment_count = (SELECT COUNT(*) FROM comment WHERE comment.post_id = post.id)')
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('audio_count')
+        batch_op.drop_column('script_count')
@@ -0,0 +1,38 @@
+"""Add audio_blob table and Script.audio_blob_key
+
+Revision ID: c7e35a9b14d2
+Revises: 8b41d0e6a2c5
+Create Date: 2026-10-18 11:26:53.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e35a9b14d2'
+down_revision = '8b41d0e6a2c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audio_blob',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('script', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('audio_blob_key', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_script_audio_blob_key', 'audio_blob', ['audio_blob_key'], ['key'])
+
+
+def downgrade():
+    with op.batch_alter_table('script', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_script_audio_blob_key', type_='foreignkey')
+        batch_op.drop_column('audio_blob_key')
+
+    op.drop_table('audio_blob')
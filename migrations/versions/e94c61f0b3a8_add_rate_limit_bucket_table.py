@@ -0,0 +1,29 @@
+"""Add rate_limit_bucket table
+
+Revision ID: e94c61f0b3a8
+Revises: 5d9e2b7f4a61
+Create Date: 2026-10-18 14:18:09.663152
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e94c61f0b3a8'
+down_revision = '5d9e2b7f4a61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_bucket',
+        sa.Column('key', sa.String(length=128), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limit_bucket')
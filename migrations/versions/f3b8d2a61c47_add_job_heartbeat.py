@@ -0,0 +1,28 @@
+"""Add job heartbeat
+
+Revision ID: f3b8d2a61c47
+Revises: d2a7c9e4b158
+Create Date: 2026-10-19 09:14:36.502118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d2a61c47'
+down_revision = 'd2a7c9e4b158'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_job_status_heartbeat_at', ['status', 'heartbeat_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_status_heartbeat_at')
+        batch_op.drop_column('heartbeat_at')
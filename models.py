@@ -9,6 +9,10 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     profile_photo = db.Column(db.String(255), nullable=False)
+    scripts_generated = db.Column(db.Integer, default=0)
+    script_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    audio_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    content_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     scripts = db.relationship('Script', backref='author', lazy='dynamic')
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
@@ -25,6 +29,18 @@ class Script(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     audio_file = db.Column(db.String(255))
+    audio_blob_key = db.Column(db.String(64), db.ForeignKey('audio_blob.key'))
+    background_music = db.Column(db.String(255))
+    volume = db.Column(db.Float)
+    background_volume = db.Column(db.Float)
+    playback_speed = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_script_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_script_user_id_created_at_with_audio', 'user_id', 'created_at',
+                 postgresql_where=db.text('audio_file IS NOT NULL'),
+                 sqlite_where=db.text('audio_file IS NOT NULL')),
+    )
 
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -32,11 +48,70 @@ class Post(db.Model):
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+    )
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_comment_post_id_created_at', 'post_id', 'created_at'),
+    )
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    payload = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    progress = db.Column(db.Float, default=0.0)
+    queue_depth = db.Column(db.Integer)
+    enqueued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    wait_ms = db.Column(db.Integer)
+    run_ms = db.Column(db.Integer)
+    heartbeat_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_user_id_kind_status', 'user_id', 'kind', 'status'),
+        db.Index('ix_job_status_heartbeat_at', 'status', 'heartbeat_at'),
+    )
+
+class PromptCacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    latency_ms = db.Column(db.Integer)
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class AudioBlob(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RateLimitBucket(db.Model):
+    key = db.Column(db.String(128), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+class BatchScript(db.Model):
+    # Which script a batch run saved for each of its items. Written in the
+    # same transaction as the scripts, so a resumed run never inserts twice.
+    run_id = db.Column(db.String(32), primary_key=True)
+    item_index = db.Column(db.Integer, primary_key=True)
+    script_id = db.Column(db.Integer, nullable=False)
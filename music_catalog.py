@@ -0,0 +1,111 @@
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+import file_serving
+
+# In-memory index of the background tracks. The folder is scanned once and
+# re-stat'ed at most every BACKGROUND_MUSIC_CHECK_INTERVAL seconds; only files
+# whose mtime or size changed are hashed and probed again. Lookups are plain
+# dict hits on the file name, so a request can never name a path outside the
+# catalog.
+
+Track = namedtuple('Track', ['name', 'path', 'size', 'duration', 'digest', 'mtime_ns'])
+
+_DURATION_RE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def probe_duration(ffmpeg, path):
+    try:
+        result = subprocess.run([ffmpeg, '-nostdin', '-hide_banner', '-i', path], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning(f"Could not probe {path}: {str(e)}")
+        return None
+    match = _DURATION_RE.search(result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class MusicCatalog:
+    def __init__(self, folder, check_interval, ffmpeg='ffmpeg', extensions=('.mp3',)):
+        self.folder = folder
+        self.check_interval = check_interval
+        self.ffmpeg = ffmpeg
+        self.extensions = extensions
+        self._tracks = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        tracks = {}
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            logging.warning(f"Background music folder {self.folder} does not exist")
+            entries = []
+        for entry in entries:
+            if not entry.is_file() or not entry.name.lower().endswith(self.extensions):
+                continue
+            stat = entry.stat()
+            known = self._tracks.get(entry.name)
+            if known and known.mtime_ns == stat.st_mtime_ns and known.size == stat.st_size:
+                tracks[entry.name] = known
+                continue
+            tracks[entry.name] = Track(entry.name, entry.path, stat.st_size, probe_duration(self.ffmpeg, entry.path),
+                                       file_serving.content_digest(entry.path), stat.st_mtime_ns)
+        if tracks.keys() != self._tracks.keys():
+            logging.info(f"Background music catalog: {len(tracks)} tracks in {self.folder}")
+        return tracks
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            self._tracks = self._scan()
+            self._checked_at = time.monotonic()
+
+    def tracks(self):
+        self.refresh()
+        return sorted(self._tracks.values(), key=lambda track: track.name)
+
+    def get(self, name):
+        self.refresh()
+        if not name:
+            return None
+        # Older clients requested "<name>.mp3.mp3".
+        if name.endswith('.mp3.mp3'):
+            name = name[:-4]
+        return self._tracks.get(name)
+
+    def choices(self):
+        choices = [('none', 'No Background Music')]
+        for track in self.tracks():
+            label = track.name
+            if track.duration:
+                minutes, seconds = divmod(int(round(track.duration)), 60)
+                label = f"{track.name} ({minutes}:{seconds:02d})"
+            choices.append((track.name, label))
+        return choices
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    global _catalog
+    folder = current_app.config['BACKGROUND_MUSIC_FOLDER'] or os.path.join(current_app.static_folder, 'audio')
+    with _catalog_lock:
+        if _catalog is None or _catalog.folder != folder:
+            _catalog = MusicCatalog(folder, current_app.config['BACKGROUND_MUSIC_CHECK_INTERVAL'],
+                                    ffmpeg=current_app.config['FFMPEG_BINARY'])
+        return _catalog
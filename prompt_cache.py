@@ -0,0 +1,194 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import PromptCacheEntry
+
+
+def normalize_params(params, fields):
+    normalized = {}
+    for field in fields:
+        value = params.get(field)
+        if isinstance(value, str):
+            value = ' '.join(value.split()).lower()
+        normalized[field] = value
+    return normalized
+
+
+def cache_key(params, fields):
+    encoded = json.dumps(normalize_params(params, fields), sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            content, latency_ms, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return content, latency_ms
+
+    def set(self, key, content, latency_ms):
+        with self._lock:
+            self._entries[key] = (content, latency_ms, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shares entries across workers through the prompt_cache_entry table.
+class DatabaseBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        entry = db.session.get(PromptCacheEntry, key)
+        if entry is None:
+            return None
+        if self.ttl and entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+            db.session.delete(entry)
+            db.session.commit()
+            return None
+        entry.last_used_at = datetime.utcnow()
+        entry.hit_count = (entry.hit_count or 0) + 1
+        db.session.commit()
+        return entry.content, entry.latency_ms
+
+    def set(self, key, content, latency_ms):
+        now = datetime.utcnow()
+        entry = db.session.get(PromptCacheEntry, key)
+        if entry is None:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(PromptCacheEntry(key=key, hit_count=0, content=content, latency_ms=latency_ms,
+                                                    created_at=now, last_used_at=now))
+            except IntegrityError:
+                # Another worker generated the same prompt and stored it
+                # first; its entry is as good as ours.
+                pass
+        else:
+            entry.content = content
+            entry.latency_ms = latency_ms
+            entry.created_at = now
+            entry.last_used_at = now
+        db.session.commit()
+        self._evict()
+
+    def _evict(self):
+        excess = PromptCacheEntry.query.count() - self.max_entries
+        if excess > 0:
+            stale = PromptCacheEntry.query.order_by(PromptCacheEntry.last_used_at.asc()).limit(excess).all()
+            for entry in stale:
+                db.session.delete(entry)
+            db.session.commit()
+
+    def __len__(self):
+        return PromptCacheEntry.query.count()
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'database': DatabaseBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'saved_ms': 0}
+
+
+def get_backend():
+    global _backend
+    name = current_app.config['PROMPT_CACHE_BACKEND']
+    if name == 'none':
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[name](current_app.config['PROMPT_CACHE_MAX_ENTRIES'],
+                                      current_app.config['PROMPT_CACHE_TTL'])
+        return _backend
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        stats[name] += amount
+
+
+def lookup(params, fields, fresh=False):
+    # Returns cached content, or None when the caller has to generate it.
+    backend = get_backend()
+    if backend is None:
+        return None
+    if fresh:
+        _count('bypassed')
+        return None
+    cached = backend.get(cache_key(params, fields))
+    if cached is None:
+        _count('misses')
+        return None
+    content, latency_ms = cached
+    _count('hits')
+    _count('saved_ms', latency_ms or 0)
+    return content
+
+
+def store(params, fields, content, latency_ms):
+    backend = get_backend()
+    if backend is not None and content:
+        backend.set(cache_key(params, fields), content, latency_ms)
+
+
+def get_or_generate(params, fields, generate, fresh=False):
+    content = lookup(params, fields, fresh)
+    if content is not None:
+        return content
+    started = time.monotonic()
+    content = generate()
+    store(params, fields, content, int((time.monotonic() - started) * 1000))
+    return content
+
+
+def stream_or_generate(params, fields, stream, fresh=False):
+    # Streaming counterpart of get_or_generate: a hit is yielded as a single
+    # piece, a miss is relayed piece by piece and cached once complete.
+    content = lookup(params, fields, fresh)
+    if content is not None:
+        yield content
+        return
+    started = time.monotonic()
+    pieces = []
+    for piece in stream():
+        pieces.append(piece)
+        yield piece
+    store(params, fields, ''.join(pieces), int((time.monotonic() - started) * 1000))
+
+
+def get_stats():
+    backend = get_backend()
+    with _stats_lock:
+        snapshot = dict(stats)
+    lookups = snapshot['hits'] + snapshot['misses']
+    snapshot['hit_rate'] = snapshot['hits'] / lookups if lookups else 0.0
+    snapshot['backend'] = current_app.config['PROMPT_CACHE_BACKEND']
+    snapshot['entries'] = len(backend) if backend is not None else 0
+    return snapshot
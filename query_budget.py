@@ -0,0 +1,66 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+
+_local = threading.local()
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    counters = getattr(_local, 'counters', None)
+    if counters:
+        for counter in counters:
+            counter['count'] += 1
+        conn.info['query_started'] = time.perf_counter()
+
+
+def _on_executed(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    counters = getattr(_local, 'counters', None)
+    if started is not None and counters:
+        elapsed = time.perf_counter() - started
+        for counter in counters:
+            counter['seconds'] += elapsed
+
+
+_listening_engines = set()
+
+
+def _listen(engine):
+    if engine not in _listening_engines:
+        event.listen(engine, 'before_cursor_execute', _on_execute)
+        event.listen(engine, 'after_cursor_execute', _on_executed)
+        _listening_engines.add(engine)
+
+
+@contextmanager
+def track_queries():
+    for engine in db.engines.values():
+        _listen(engine)
+    counter = {'count': 0, 'seconds': 0.0}
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(limit):
+    # Logs views that issue more SQL statements than their budget, so an
+    # N+1 that slips past tests/test_query_budget.py shows up in the logs.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with track_queries() as counter:
+                response = view(*args, **kwargs)
+            if counter['count'] > limit:
+                logging.warning(f"{view.__name__} issued {counter['count']} queries (budget {limit})")
+            return response
+        return wrapper
+    return decorator
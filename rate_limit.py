@@ -0,0 +1,144 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Job, RateLimitBucket
+import jobs
+
+# Admission control for the upstream LLM and TTS calls and for the ffmpeg
+# session mixes, which are CPU-heavy. Each resource has a
+# per-user and a global token bucket ("capacity/period seconds") plus caps on
+# how many of its jobs may be queued or running at once. Concurrency is read
+# from the job table (counting only jobs whose process is still alive, see
+# jobs.py) and bucket state lives in RATE_LIMIT_BACKEND, so with the
+# 'database' backend the limits hold across every worker process.
+
+RESOURCE_JOB_KINDS = {
+    'llm': 'generate_script',
+    'tts': 'render_audio',
+    'mix': 'mix_audio',
+}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def parse_rate(rate):
+    capacity, period = rate.split('/')
+    return float(capacity), float(period)
+
+
+def _refill(tokens, updated_at, now, capacity, period):
+    return min(capacity, tokens + (now - updated_at) * capacity / period)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated_at, now, capacity, period)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) * period / capacity
+
+    def refund(self, key, capacity, period, cost=1):
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, time.time()))
+            self._buckets[key] = (min(capacity, tokens + cost), updated_at)
+
+
+class DatabaseBackend:
+    # Buckets are updated in a short transaction on a connection of their
+    # own, so taking a token never commits (or rolls back) the request's work.
+    def take(self, key, capacity, period, cost=1):
+        now = time.time()
+        with db.engine.begin() as conn:
+            tokens, updated_at = self._locked_bucket(conn, key, capacity, now)
+            tokens = _refill(tokens, updated_at, now, capacity, period)
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) * period / capacity
+            self._save(conn, key, tokens, now)
+        return wait
+
+    def refund(self, key, capacity, period, cost=1):
+        with db.engine.begin() as conn:
+            tokens, updated_at = self._locked_bucket(conn, key, capacity, time.time())
+            self._save(conn, key, min(capacity, tokens + cost), updated_at)
+
+    def _locked_bucket(self, conn, key, capacity, now):
+        table = RateLimitBucket.__table__
+        query = select(table.c.tokens, table.c.updated_at).where(table.c.key == key).with_for_update()
+        row = conn.execute(query).first()
+        if row is None:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(table).values(key=key, tokens=capacity, updated_at=now))
+            except IntegrityError:
+                pass
+            row = conn.execute(query).first()
+        return row
+
+    def _save(self, conn, key, tokens, updated_at):
+        table = RateLimitBucket.__table__
+        conn.execute(update(table).where(table.c.key == key).values(tokens=tokens, updated_at=updated_at))
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'database': DatabaseBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[current_app.config['RATE_LIMIT_BACKEND']]()
+        return _backend
+
+
+def _check_concurrency(resource, user_id, limits):
+    active = (Job.query.filter_by(kind=RESOURCE_JOB_KINDS[resource])
+              .filter(Job.status.in_(jobs.ACTIVE_STATUSES), jobs.is_alive()))
+    if active.filter_by(user_id=user_id).count() >= limits['user_concurrency']:
+        raise RateLimitExceeded('You already have requests in progress. Please wait for them to finish.',
+                                current_app.config['RATE_LIMIT_CONCURRENCY_RETRY_AFTER'])
+    if active.count() >= limits['global_concurrency']:
+        raise RateLimitExceeded('The service is busy right now. Please try again shortly.',
+                                current_app.config['RATE_LIMIT_CONCURRENCY_RETRY_AFTER'])
+
+
+def admit(resource, user_id, cost=1):
+    if not current_app.config['RATE_LIMIT_ENABLED']:
+        return
+    limits = current_app.config['RATE_LIMITS'][resource]
+    _check_concurrency(resource, user_id, limits)
+
+    backend = get_backend()
+    user_key = (f"{resource}:user:{user_id}",) + parse_rate(limits['user'])
+    wait = backend.take(*user_key, cost=cost)
+    if wait:
+        raise RateLimitExceeded('You are making requests too quickly. Please slow down.', wait)
+    global_key = (f"{resource}:global",) + parse_rate(limits['global'])
+    wait = backend.take(*global_key, cost=cost)
+    if wait:
+        backend.refund(*user_key, cost=cost)
+        raise RateLimitExceeded('The service is busy right now. Please try again shortly.', wait)
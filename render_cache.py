@@ -0,0 +1,142 @@
+import threading
+import time
+from flask import current_app, render_template, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from sqlalchemy import select
+from app import db
+import metrics
+from models import User
+from prompt_cache import MemoryBackend
+
+# Cache of rendered HTML, for whole pages and for fragments such as a
+# community post with its comments. Entries are keyed by name, scope and the
+# version of what they show (user.content_version, post.version, ...), so a
+# write makes the old entries unreachable instead of having to find and
+# delete them; see counters.py for where the versions are bumped. Since the
+# versions are read from the database, every worker process sees a write at
+# once, even though each keeps its own cache. That includes the user's own
+# version: current_user may come from another worker's user cache (see
+# user_cache.py), so pages keyed on it use fresh_user() instead.
+#
+# 'user' scoped entries are only served to the user they were rendered for;
+# 'shared' ones to everybody. CSRF tokens are stored as a placeholder and
+# filled in for each response, so cached HTML never carries another
+# session's token.
+
+CSRF_PLACEHOLDER = '__render_cache_csrf_token__'
+
+BACKENDS = {
+    'memory': MemoryBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats_lock = threading.Lock()
+stats = {}
+
+
+def get_backend():
+    global _backend
+    name = current_app.config['RENDER_CACHE_BACKEND']
+    if name == 'none':
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[name](current_app.config['RENDER_CACHE_MAX_ENTRIES'],
+                                      current_app.config['RENDER_CACHE_TTL'])
+        return _backend
+
+
+def _count(name, result, render_ms=0, saved_ms=0):
+    with _stats_lock:
+        entry = stats.setdefault(name, {'hits': 0, 'misses': 0, 'bypassed': 0, 'render_ms': 0.0, 'saved_ms': 0.0})
+        entry[result] += 1
+        entry['render_ms'] += render_ms
+        entry['saved_ms'] += saved_ms
+    metrics.render_cache_lookups.inc((name, result))
+    if saved_ms:
+        metrics.render_cache_saved.inc((name,), saved_ms / 1000)
+
+
+def fresh_user():
+    # The logged-in user's version and the counters their pages show,
+    # straight from the database.
+    return db.session.execute(select(User.content_version, User.script_count, User.audio_count,
+                                     User.scripts_generated)
+                              .where(User.id == current_user.id)).one()
+
+
+def cache_key(name, version, scope='shared'):
+    owner = current_user.get_id() if scope == 'user' else '*'
+    return '|'.join([name, scope, str(owner)] + [str(part) for part in version])
+
+
+def _render(template, context):
+    started = time.perf_counter()
+    html = render_template(template, csrf_token=lambda: CSRF_PLACEHOLDER, **context)
+    return html, (time.perf_counter() - started) * 1000
+
+
+def _finish(html):
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, generate_csrf())
+    return Markup(html)
+
+
+def render_many(name, template, versions, load_contexts, scope='shared'):
+    # Renders `template` once per item, for {item_id: version}. Only the
+    # misses are rendered; load_contexts(missing_ids) returns their
+    # {item_id: context}, so whatever they need is loaded in one go.
+    backend = get_backend()
+    rendered = {}
+    missing = []
+    for item_id, version in versions.items():
+        cached = backend.get(cache_key(name, version, scope)) if backend is not None else None
+        if cached is None:
+            missing.append(item_id)
+            continue
+        html, render_ms = cached
+        rendered[item_id] = html
+        _count(name, 'hits', saved_ms=render_ms)
+    if missing:
+        contexts = load_contexts(missing)
+        for item_id in missing:
+            html, render_ms = _render(template, contexts[item_id])
+            rendered[item_id] = html
+            if backend is None:
+                _count(name, 'bypassed', render_ms=render_ms)
+            else:
+                backend.set(cache_key(name, versions[item_id], scope), html, render_ms)
+                _count(name, 'misses', render_ms=render_ms)
+    return {item_id: _finish(html) for item_id, html in rendered.items()}
+
+
+def render(name, template, version, load_context, scope='shared'):
+    return render_many(name, template, {None: version}, lambda ids: {None: load_context()}, scope)[None]
+
+
+def page(name, template, version, load_context, scope='shared'):
+    # A whole page. Pages with flashed messages waiting to be shown are
+    # rendered fresh and not stored.
+    if '_flashes' in session:
+        html, render_ms = _render(template, load_context())
+        _count(name, 'bypassed', render_ms=render_ms)
+        return _finish(html)
+    return render(name, template, version, load_context, scope)
+
+
+def get_stats():
+    backend = get_backend()
+    with _stats_lock:
+        snapshot = {name: dict(entry) for name, entry in stats.items()}
+    for entry in snapshot.values():
+        lookups = entry['hits'] + entry['misses']
+        entry['hit_rate'] = entry['hits'] / lookups if lookups else 0.0
+    return {
+        'backend': current_app.config['RENDER_CACHE_BACKEND'],
+        'entries': len(backend) if backend is not None else 0,
+        'saved_ms': sum(entry['saved_ms'] for entry in snapshot.values()),
+        'caches': snapshot,
+    }
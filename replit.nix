@@ -2,5 +2,6 @@
   deps = [
     pkgs.openssl
     pkgs.postgresql
+    pkgs.ffmpeg
   ];
 }
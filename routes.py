@@ -1,22 +1,57 @@
-import os
-import requests
-from flask import jsonify, render_template, redirect, url_for, flash, request, send_file, current_app
+from flask import jsonify, render_template, redirect, url_for, flash, request, abort, Response, stream_with_context
 from flask_login import login_required, current_user, login_user, logout_user
-from app import app, db
-from models import User, Script, Post, Comment
+from app import app, db, csrf
+from models import User, Script, Post, Comment, Job
 from forms import LoginForm, RegistrationForm, ScriptGenerationForm, PostForm, CommentForm, AudioCustomizationForm
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+import hmac
+import json
 import logging
-from openai import OpenAI
 from urllib.parse import urlparse
+import jobs
+import prompt_cache
+import rate_limit
+import webhook_client
+from script_generation import form_params, stream_script
+import tts
+import audio_store
+import file_serving
+import community_feed
+import audio_mixer
+import transcode
+import batch_generation
+import storage
+import music_catalog
+import metrics
+import render_cache
+import voice_upload
+from query_budget import query_budget
+from db_engine import read_replica, release_connection
+from sqlalchemy.orm import joinedload
 
-openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+@app.errorhandler(rate_limit.RateLimitExceeded)
+def rate_limited(e):
+    headers = {'Retry-After': str(e.retry_after)}
+    if request.accept_mimetypes.best == 'application/json' or request.is_json:
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, headers
+    return render_template('rate_limited.html', title='Too Many Requests', message=str(e), retry_after=e.retry_after), 429, headers
+
+@app.errorhandler(voice_upload.VoiceUploadError)
+def voice_upload_failed(e):
+    logging.error(f"Voice upload rejected: {str(e)}")
+    return jsonify({'error': str(e), **e.details}), e.status
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    if request.path.startswith('/record_voice') or request.is_json or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': 'Upload is too large'}), 413
+    return e
 
 @app.route('/')
 @app.route('/index')
 def index():
-    return render_template('index.html', title='Home')
+    return render_cache.page('index', 'index.html', (current_user.is_authenticated,), lambda: {'title': 'Home'})
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -50,7 +85,7 @@ def register():
         user.set_password(form.password.data)
         if form.profile_photo.data:
             filename = secure_filename(form.profile_photo.data.filename)
-            form.profile_photo.data.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            storage.get_storage().save(filename, form.profile_photo.data.stream)
             user.profile_photo = filename
         db.session.add(user)
         db.session.commit()
@@ -58,17 +93,46 @@ def register():
         return redirect(url_for('login'))
     return render_template('register.html', title='Register', form=form)
 
+def _page(total):
+    # Page number, page count and page size for a list whose length is one
+    # of the denormalized counters, so no COUNT query is needed.
+    per_page = app.config['SCRIPTS_PAGE_SIZE']
+    pages = max(1, -(-total // per_page))
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    return page, pages, per_page
+
 @app.route('/profile')
 @login_required
+@read_replica
 def profile():
-    scripts = Script.query.filter_by(user_id=current_user.id).order_by(Script.created_at.desc()).all()
-    form = ScriptGenerationForm()
-    return render_template('profile.html', user=current_user, scripts=scripts, form=form)
+    user = render_cache.fresh_user()
+    page, pages, per_page = _page(user.script_count)
+
+    def load_context():
+        scripts = (Script.query.filter_by(user_id=current_user.id).order_by(Script.created_at.desc())
+                   .offset((page - 1) * per_page).limit(per_page).all())
+        return {'user': current_user, 'counts': user, 'scripts': scripts, 'page': page, 'pages': pages}
+    return render_cache.page('profile', 'profile.html', (user.content_version, page, per_page), load_context,
+                             scope='user')
+
+@app.route('/profile_photo')
+@login_required
+def profile_photo():
+    filename = current_user.profile_photo
+    if not filename or not storage.get_storage().exists(filename):
+        abort(404)
+    return file_serving.send_stored(filename, max_age=300, as_attachment=False)
+
+def _voice_job_response(filename, job):
+    return jsonify({'success': True, 'filename': filename, 'job_id': job.id,
+                    'status_url': url_for('job_progress', job_id=job.id)}), 202
 
 @app.route('/record_voice', methods=['POST'])
 @login_required
 def record_voice():
     logging.info(f"Received voice recording request from user {current_user.id}")
+    # Refuse oversized bodies before the form parser spools them.
+    voice_upload.check_size(request.content_length)
     if 'audio' not in request.files:
         logging.error("No audio file provided in the request")
         return jsonify({'error': 'No audio file provided'}), 400
@@ -80,78 +144,199 @@ def record_voice():
         logging.error("Empty filename provided for audio file")
         return jsonify({'error': 'No selected file'}), 400
     
-    if audio_file and script_id:
-        try:
-            script = Script.query.get(script_id)
-            if script and script.user_id == current_user.id:
-                filename = secure_filename(f"user_voice_{current_user.id}_{script_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.wav")
-                upload_folder = current_app.config['UPLOAD_FOLDER']
-                
-                if not os.path.exists(upload_folder):
-                    os.makedirs(upload_folder)
-                    logging.info(f"Created UPLOAD_FOLDER: {upload_folder}")
-                
-                audio_path = os.path.join(upload_folder, filename)
-                audio_file.save(audio_path)
-                logging.info(f"Saved audio file: {audio_path}")
-                
-                script.audio_file = filename
-                db.session.commit()
-                logging.info(f"Updated script {script_id} with new audio file: {filename}")
-                
-                return jsonify({'success': True, 'filename': filename}), 200
-            else:
-                logging.error(f"Invalid script or unauthorized access: script_id={script_id}, user_id={current_user.id}")
-                return jsonify({'error': 'Invalid script or unauthorized access'}), 403
-        except Exception as e:
-            logging.error(f"Error saving audio file: {str(e)}")
-            return jsonify({'error': f'Failed to save audio file: {str(e)}'}), 500
-    
-    logging.error("Invalid request: missing audio file or script_id")
-    return jsonify({'error': 'Invalid request'}), 400
+    if not script_id:
+        logging.error("Invalid request: missing audio file or script_id")
+        return jsonify({'error': 'Invalid request'}), 400
+    filename, job = voice_upload.save_single(audio_file.stream, request.content_length, script_id, current_user.id)
+    return _voice_job_response(filename, job)
 
-def send_webhook_request(prompt):
-    webhook_url = os.environ.get("SCRIPT_GENERATION_WEBHOOK_URL")
-    if not webhook_url:
-        raise ValueError("SCRIPT_GENERATION_WEBHOOK_URL environment variable is not set")
-    
-    payload = {"prompt": prompt}
-    response = requests.post(webhook_url, json=payload)
-    
-    if response.status_code == 200:
-        try:
-            json_response = response.json()
-            if 'content' in json_response:
-                return json_response['content']
-            else:
-                raise ValueError("Unexpected JSON structure in webhook response: 'content' key not found")
-        except ValueError as e:
-            raise Exception(f"Error parsing JSON from webhook response: {str(e)}")
-    else:
-        raise Exception(f"Webhook request failed with status code {response.status_code}")
+@app.route('/record_voice/uploads', methods=['POST'])
+@login_required
+def start_voice_upload():
+    data = request.get_json(silent=True) or request.form
+    upload_id, meta = voice_upload.create(data.get('script_id'), current_user.id, data.get('size'))
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'size': meta['size'],
+                    'chunk_size': app.config['VOICE_UPLOAD_CHUNK_BYTES'],
+                    'upload_url': url_for('voice_upload_chunk', upload_id=upload_id)}), 201
+
+@app.route('/record_voice/uploads/<upload_id>', methods=['GET'])
+@login_required
+def voice_upload_status(upload_id):
+    return jsonify(voice_upload.status(upload_id, current_user.id))
+
+@app.route('/record_voice/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def voice_upload_chunk(upload_id):
+    offset = request.headers.get('Upload-Offset', request.args.get('offset', ''))
+    if not offset.isdigit():
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    offset, finished = voice_upload.append(upload_id, current_user.id, int(offset), request.stream)
+    if finished is None:
+        return jsonify({'upload_id': upload_id, 'offset': offset, 'complete': False})
+    return _voice_job_response(*finished)
 
 @app.route('/generate_script', methods=['GET', 'POST'])
 @login_required
 def generate_script():
     form = ScriptGenerationForm()
     if form.validate_on_submit():
-        prompt = f"Generate a {form.duration.data}-minute guided manifestation instruction for {form.goal.data}. Focus on {form.focus.data}. Use a {form.tone.data} tone, incorporate {form.visualization.data} visualization, and use {form.affirmation_style.data} affirmations. Make sure the result is conversation, add '...' between sentences where you think the reader should pause or talk slowly. Make sure the result is something that I can send directly to a TTS program and it will read it out loud for the user."
-        
+        rate_limit.admit('llm', current_user.id)
         try:
-            script_content = send_webhook_request(prompt)
-            if not script_content:
-                raise ValueError("Empty script content received from webhook")
-            
-            script = Script(content=script_content, user_id=current_user.id)
-            db.session.add(script)
-            db.session.commit()
-            
-            return redirect(url_for('view_script', script_id=script.id))
+            job = jobs.enqueue('generate_script', form_params(form), user_id=current_user.id)
+            return redirect(url_for('job_status', job_id=job.id))
         except Exception as e:
             flash(f"Error generating script: {str(e)}", "error")
             return redirect(url_for('generate_script'))
     return render_template('generate_script.html', title='Generate Script', form=form)
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def start_streamed_generation():
+    # Shared with the ASGI entry point. Returns (job_id, params), or an error
+    # response when the form does not validate.
+    form = ScriptGenerationForm()
+    if not form.validate_on_submit():
+        response = jsonify({'success': False, 'errors': form.errors})
+        response.status_code = 400
+        return response
+    rate_limit.admit('llm', current_user.id)
+    params = form_params(form)
+    return jobs.begin('generate_script', params, user_id=current_user.id).id, params
+
+@app.route('/generate_script/stream', methods=['POST'])
+@login_required
+def generate_script_stream():
+    started = start_streamed_generation()
+    if isinstance(started, Response):
+        return started
+    job_id, params = started
+    stream = stream_script(job_id, params)
+
+    def events():
+        try:
+            for text in stream:
+                yield sse_event('token', {'text': text})
+            result = jobs.job_result(db.session.get(Job, job_id))
+            yield sse_event('done', {'script_id': result['script_id'],
+                                     'redirect': url_for('view_script', script_id=result['script_id'])})
+        except Exception as e:
+            yield sse_event('error', {'error': f"Error generating script: {str(e)}"})
+        finally:
+            stream.close()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+def _job_for_current_user(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        abort(404)
+    return job
+
+def _job_redirect_url(job):
+    result = jobs.job_result(job)
+    if job.status == 'done' and result and 'script_id' in result:
+        return url_for('view_script', script_id=result['script_id'])
+    return None
+
+@app.route('/job_status/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = _job_for_current_user(job_id)
+    redirect_url = _job_redirect_url(job)
+    if redirect_url:
+        return redirect(redirect_url)
+    return render_template('job_status.html', title='Generating Script', job=job)
+
+@app.route('/job_progress/<int:job_id>')
+@login_required
+def job_progress(job_id):
+    job = _job_for_current_user(job_id)
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'queue_depth': job.queue_depth,
+        'redirect': _job_redirect_url(job),
+    })
+
+def _require_token(config_key):
+    # For endpoints that authenticate with a bearer token from the config
+    # rather than a session; without the token configured they are not
+    # served at all. Compared in constant time.
+    token = app.config[config_key]
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(supplied, f"Bearer {token}".encode('utf-8')):
+        abort(401)
+
+@app.route('/render_cache/stats')
+def render_cache_stats():
+    _require_token('METRICS_TOKEN')
+    return jsonify(render_cache.get_stats())
+
+@app.route('/prompt_cache/stats')
+def prompt_cache_stats():
+    _require_token('METRICS_TOKEN')
+    return jsonify(prompt_cache.get_stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    _require_token('METRICS_TOKEN')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/generate_script/batch', methods=['POST'])
+@csrf.exempt
+def generate_script_batch():
+    # The batch API is for schedulers acting on behalf of many users, so it
+    # authenticates with BATCH_API_TOKEN rather than a session.
+    _require_token('BATCH_API_TOKEN')
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': "Expected a non-empty 'items' list"}), 400
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'success': False, 'error': f"A batch can have at most {app.config['BATCH_MAX_ITEMS']} items"}), 400
+    backend = payload.get('backend')
+    if backend is not None and backend not in batch_generation.BACKENDS:
+        return jsonify({'success': False, 'error': f"Unknown backend '{backend}'"}), 400
+    job = jobs.enqueue('generate_batch', {'items': items, 'backend': backend})
+    return jsonify({'success': True, 'job_id': job.id,
+                    'status_url': url_for('generate_script_batch_status', job_id=job.id)}), 202
+
+@app.route('/generate_script/batch/<int:job_id>')
+def generate_script_batch_status(job_id):
+    _require_token('BATCH_API_TOKEN')
+    job = Job.query.filter_by(id=job_id, kind='generate_batch').first_or_404()
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'report': jobs.job_result(job),
+    })
+
+@app.route('/webhook_client/stats')
+def webhook_client_stats():
+    _require_token('METRICS_TOKEN')
+    return jsonify(webhook_client.get_client().stats())
+
+def _active_job(kind, user_id, **fields):
+    # The user's newest live job of this kind whose payload has these fields.
+    pending = (Job.query.filter_by(kind=kind, user_id=user_id).filter(Job.status.in_(jobs.ACTIVE_STATUSES), jobs.is_alive())
+               .order_by(Job.id.desc()).all())
+    for job in pending:
+        payload = jobs.job_payload(job)
+        if all(payload.get(name) == value for name, value in fields.items()):
+            return job
+    return None
+
+def _active_render_job(script):
+    return _active_job('render_audio', script.user_id, script_id=script.id)
+
 @app.route('/view_script/<int:script_id>', methods=['GET', 'POST'])
 @login_required
 def view_script(script_id):
@@ -163,36 +348,31 @@ def view_script(script_id):
     if request.method == 'POST':
         if 'generate_audio' in request.form:
             try:
-                audio_filename = f"audio_{script.id}.mp3"
-                audio_path = os.path.join(app.config['UPLOAD_FOLDER'], audio_filename)
-                
-                user_voice_filename = request.form.get('user_voice_filename')
-                if user_voice_filename:
-                    user_voice_path = os.path.join(app.config['UPLOAD_FOLDER'], user_voice_filename)
-                    audio_response = openai_client.audio.speech.create(
-                        model="tts-1",
-                        voice="alloy",
-                        input=script.content,
-                        voice_file=user_voice_path
-                    )
+                # Hashing the voice sample reads it from storage; don't hold a connection meanwhile.
+                release_connection(db.session)
+                user_voice_filename = transcode.resolve_voice_upload(request.form.get('user_voice_filename'))
+                audio_key = audio_store.render_key(script.content, app.config['TTS_MODEL'], app.config['TTS_VOICE'], user_voice_filename)
+                blob = audio_store.lookup(audio_key)
+                if blob is not None:
+                    audio_store.attach(script, blob)
+                    db.session.commit()
+                    flash('Audio generated successfully!', 'success')
                 else:
-                    audio_response = openai_client.audio.speech.create(
-                        model="tts-1",
-                        voice="alloy",
-                        input=script.content
-                    )
-                
-                with open(audio_path, "wb") as audio_file:
-                    audio_file.write(audio_response.content)
-                
-                script.audio_file = audio_filename
-                db.session.commit()
-                
-                flash('Audio generated successfully!', 'success')
+                    rate_limit.admit('tts', current_user.id)
+                    payload = {'script_id': script.id, 'user_voice_filename': user_voice_filename, 'audio_key': audio_key}
+                    jobs.enqueue('render_audio', payload, user_id=current_user.id)
+                    flash('Audio generation started. This page will update when it is ready.', 'success')
+            except rate_limit.RateLimitExceeded:
+                raise
             except Exception as e:
                 flash(f"Error generating audio: {str(e)}", "error")
-    
-    return render_template('view_script.html', title='View Script', script=script)
+        return redirect(url_for('view_script', script_id=script.id))
+
+    render_job = _active_render_job(script)
+    if render_job is not None:
+        return render_template('view_script.html', title='View Script', script=script, render_job=render_job)
+    return render_cache.page('view_script', 'view_script.html', (script.id, render_cache.fresh_user().content_version),
+                             lambda: {'title': 'View Script', 'script': script, 'render_job': None}, scope='user')
 
 @app.route('/get_audio/<int:script_id>')
 @login_required
@@ -202,9 +382,9 @@ def get_audio(script_id):
         flash('You do not have permission to access this audio.', 'error')
         return redirect(url_for('profile'))
     if script.audio_file:
-        audio_path = os.path.join(app.config['UPLOAD_FOLDER'], script.audio_file)
-        if os.path.exists(audio_path):
-            return send_file(audio_path, as_attachment=True)
+        if storage.get_storage().exists(script.audio_file):
+            versioned = script.audio_blob_key is not None and request.args.get('v') == script.audio_blob_key
+            return file_serving.send_stored(script.audio_file, immutable=versioned)
         else:
             flash('Audio file not found.', 'error')
             return redirect(url_for('view_script', script_id=script_id))
@@ -212,11 +392,32 @@ def get_audio(script_id):
         flash('No audio file available for this script.', 'error')
         return redirect(url_for('view_script', script_id=script_id))
 
+@app.route('/stream_audio/<int:script_id>')
+@login_required
+def stream_audio(script_id):
+    script = Script.query.get_or_404(script_id)
+    if script.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    render_job = _active_render_job(script)
+    if render_job is None:
+        return redirect(url_for('get_audio', script_id=script_id))
+
+    job_id = render_job.id
+    chunk_count = len(tts.split_script(script.content, app.config['TTS_CHUNK_CHARS']))
+    fallback_paths = tts.stream_fallback_paths(script.id, jobs.job_payload(render_job)['audio_key'])
+
+    def is_active():
+        return db.session.get(Job, job_id, populate_existing=True).status in ('queued', 'running')
+
+    stream = tts.stream_render(script.id, chunk_count, fallback_paths, is_active)
+    return Response(stream_with_context(stream), mimetype='audio/mpeg', headers={'Cache-Control': 'no-store'})
+
 @app.route('/community', methods=['GET', 'POST'])
 @login_required
+@query_budget(app.config['COMMUNITY_QUERY_BUDGET'])
+@read_replica
 def community():
     form = PostForm()
-    comment_form = CommentForm()
     if form.validate_on_submit():
         post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id)
         db.session.add(post)
@@ -224,8 +425,43 @@ def community():
         flash('Your post has been created!', 'success')
         return redirect(url_for('community'))
     
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    return render_template('community.html', title='Community', form=form, comment_form=comment_form, posts=posts)
+    try:
+        posts, next_cursor = community_feed.load_posts(request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    def load_contexts(post_ids):
+        # A blank form: the shared fragment must not echo what this request posted.
+        blank_form = CommentForm(formdata=None)
+        comments_by_post = community_feed.load_comments(post_ids)
+        return {post.id: {'post': post, 'comments': comments_by_post[post.id], 'comment_form': blank_form}
+                for post in posts if post.id in comments_by_post}
+    post_html = render_cache.render_many('community_post', '_community_post.html',
+                                         {post.id: (post.id, post.version) for post in posts}, load_contexts)
+    return render_template('community.html', title='Community', form=form, posts=posts, post_html=post_html,
+                           next_cursor=next_cursor)
+
+@app.route('/community/feed')
+@login_required
+@query_budget(app.config['COMMUNITY_QUERY_BUDGET'])
+@read_replica
+def community_feed_page():
+    try:
+        posts, comments_by_post, comment_counts, next_cursor = community_feed.load_page(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'posts': [community_feed.serialize_post(post, comments_by_post[post.id], comment_counts.get(post.id, 0)) for post in posts],
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/community/posts/<int:post_id>/comments')
+@login_required
+@read_replica
+def post_comments(post_id):
+    Post.query.get_or_404(post_id)
+    comments = Comment.query.options(joinedload(Comment.author)).filter_by(post_id=post_id).order_by(Comment.created_at.asc(), Comment.id.asc()).all()
+    return jsonify({'comments': [community_feed.serialize_comment(comment) for comment in comments]})
 
 @app.route('/create_post', methods=['POST'])
 @login_required
@@ -251,9 +487,31 @@ def add_comment(post_id):
 
 @app.route('/my_audio_files')
 @login_required
+@read_replica
 def my_audio_files():
-    scripts_with_audio = Script.query.filter_by(user_id=current_user.id).filter(Script.audio_file.isnot(None)).order_by(Script.created_at.desc()).all()
-    return render_template('my_audio_files.html', title='My Audio Files', scripts=scripts_with_audio)
+    user = render_cache.fresh_user()
+    page, pages, per_page = _page(user.audio_count)
+
+    def load_context():
+        scripts_with_audio = (Script.query.filter_by(user_id=current_user.id).filter(Script.audio_file.isnot(None))
+                              .order_by(Script.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all())
+        return {'title': 'My Audio Files', 'counts': user, 'scripts': scripts_with_audio, 'page': page, 'pages': pages}
+    return render_cache.page('my_audio_files', 'my_audio_files.html', (user.content_version, page, per_page),
+                             load_context, scope='user')
+
+def _prepare_mix(script):
+    key = audio_mixer.mix_key(script, script.background_music, script.volume, script.background_volume, script.playback_speed)
+    mix = {'mix_url': url_for('mixed_audio', script_id=script.id, key=key)}
+    if not storage.get_storage().exists(audio_mixer.mix_filename(key)):
+        # A mix already on its way is followed rather than started again.
+        job = _active_job('mix_audio', current_user.id, key=key)
+        if job is None:
+            rate_limit.admit('mix', current_user.id)
+            payload = {'script_id': script.id, 'key': key, 'background_music': script.background_music, 'volume': script.volume,
+                       'background_volume': script.background_volume, 'playback_speed': script.playback_speed}
+            job = jobs.enqueue('mix_audio', payload, user_id=current_user.id)
+        mix['progress_url'] = url_for('job_progress', job_id=job.id)
+    return mix
 
 @app.route('/manifestation_session', methods=['GET', 'POST'])
 @login_required
@@ -271,6 +529,7 @@ def manifestation_session():
     if form.playback_speed.data is None:
         form.playback_speed.data = 1.0
     
+    wants_json = request.accept_mimetypes.best == 'application/json'
     if form.validate_on_submit():
         script_id = int(form.script.data)
         script = Script.query.get(script_id)
@@ -280,27 +539,39 @@ def manifestation_session():
             script.background_volume = form.background_volume.data
             script.playback_speed = form.playback_speed.data
             db.session.commit()
+            mix = _prepare_mix(script)
+            if wants_json:
+                return jsonify(mix)
             flash('Audio customization applied successfully!', 'success')
         else:
+            if wants_json:
+                return jsonify({'error': 'Invalid script selection'}), 403
             flash('Invalid script selection.', 'error')
         return redirect(url_for('manifestation_session'))
+    if request.method == 'POST' and wants_json:
+        return jsonify({'error': 'Invalid customization', 'errors': form.errors}), 400
     
     return render_template('manifestation_session.html', title='Manifestation Session', form=form, scripts=scripts_with_audio)
 
+@app.route('/mixed_audio/<int:script_id>/<key>')
+@login_required
+def mixed_audio(script_id, key):
+    script = Script.query.get_or_404(script_id)
+    if script.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    filename = audio_mixer.mix_filename(key)
+    current_key = audio_mixer.mix_key(script, script.background_music, script.volume, script.background_volume, script.playback_speed)
+    if key != current_key or not storage.get_storage().exists(filename):
+        return jsonify({'error': 'File not found'}), 404
+    return file_serving.send_stored(filename, immutable=True, as_attachment=False, mimetype=audio_mixer.mix_mimetype())
+
 @app.route('/get_background_music/<filename>')
 @login_required
 def get_background_music(filename):
-    audio_folder = os.path.join(current_app.static_folder, 'audio')
-    file_path = os.path.join(audio_folder, filename)
-    
-    # Remove duplicate .mp3 extension if present
-    if file_path.endswith('.mp3.mp3'):
-        file_path = file_path[:-4]
-    
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
-    else:
+    track = music_catalog.get_catalog().get(filename)
+    if track is None:
         return jsonify({'error': 'File not found'}), 404
+    return file_serving.send_audio(track.path, max_age=app.config['BACKGROUND_MUSIC_MAX_AGE'])
 
 @app.route('/delete_script/<int:script_id>', methods=['POST'])
 @login_required
@@ -310,10 +581,10 @@ def delete_script(script_id):
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     
     try:
-        if script.audio_file:
-            audio_path = os.path.join(current_app.config['UPLOAD_FOLDER'], script.audio_file)
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
+        if script.audio_blob_key:
+            audio_store.release(script)
+        elif script.audio_file:
+            audio_store.delete_file(script.audio_file)
         
         db.session.delete(script)
         db.session.commit()
@@ -0,0 +1,128 @@
+import logging
+from flask import current_app
+from app import db
+from db_engine import release_connection
+from models import Script, Job
+import jobs
+import prompt_cache
+import webhook_client
+import metrics
+
+PROMPT_FIELDS = ('goal', 'focus', 'duration', 'tone', 'visualization', 'affirmation_style')
+STREAM_CLOSED = "Stream closed before the script was complete"
+
+
+def form_params(form):
+    params = {field: getattr(form, field).data for field in PROMPT_FIELDS}
+    params['fresh_variation'] = bool(form.fresh_variation.data)
+    return params
+
+
+def build_prompt(params):
+    return f"Generate a {params['duration']}-minute guided manifestation instruction for {params['goal']}. Focus on {params['focus']}. Use a {params['tone']} tone, incorporate {params['visualization']} visualization, and use {params['affirmation_style']} affirmations. Make sure the result is conversation, add '...' between sentences where you think the reader should pause or talk slowly. Make sure the result is something that I can send directly to a TTS program and it will read it out loud for the user."
+
+
+def send_webhook_request(prompt):
+    with metrics.timed('webhook'):
+        response = webhook_client.get_client().post_json({"prompt": prompt})
+    return parse_webhook_response(response)
+
+
+def parse_webhook_response(response):
+    try:
+        json_response = response.json()
+        if 'content' in json_response:
+            return json_response['content']
+        else:
+            raise ValueError("Unexpected JSON structure in webhook response: 'content' key not found")
+    except ValueError as e:
+        raise Exception(f"Error parsing JSON from webhook response: {str(e)}")
+
+
+def generate_content(prompt):
+    # The model can take minutes; give the connection back to the pool first.
+    release_connection(db.session)
+    if current_app.config['SCRIPT_GENERATION_BACKEND'] == 'openai':
+        from chat_request import send_openai_request
+        return send_openai_request(prompt)
+    return send_webhook_request(prompt)
+
+
+def stream_webhook_request(prompt):
+    # A webhook that supports streaming answers with a chunked text body,
+    # which is relayed as it arrives; a plain JSON reply is a single piece.
+    with metrics.timed('webhook'):
+        response = webhook_client.get_client().post_json({"prompt": prompt, "stream": True}, stream=True)
+    with response:
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            yield parse_webhook_response(response)
+            return
+        if 'charset' not in content_type:
+            response.encoding = 'utf-8'
+        for text in response.iter_content(chunk_size=None, decode_unicode=True):
+            if text:
+                yield text
+
+
+def stream_content(prompt):
+    # Nothing is read from the database until the stream ends, so don't hold
+    # a pooled connection while waiting on the model.
+    release_connection(db.session)
+    if current_app.config['SCRIPT_GENERATION_BACKEND'] == 'openai':
+        from chat_request import stream_openai_request
+        return stream_openai_request(prompt)
+    return stream_webhook_request(prompt)
+
+
+def finish_stream(job_id, script_content):
+    if not script_content.strip():
+        raise ValueError("Empty script content received from webhook")
+    job = db.session.get(Job, job_id)
+    script = Script(content=script_content, user_id=job.user_id)
+    db.session.add(script)
+    db.session.flush()
+    jobs.complete(job, {'script_id': script.id})
+    return script.id
+
+
+def fail_stream(job_id, error):
+    db.session.rollback()
+    job = db.session.get(Job, job_id)
+    if job.status == 'running':
+        logging.error(f"Streamed generation for job {job_id} failed: {error}")
+        jobs.complete(job, error=error)
+
+
+def stream_script(job_id, params):
+    # Yields the script as it is generated and saves it once the stream is
+    # complete, recording the outcome on the job started for the request.
+    pieces = []
+    try:
+        for piece in prompt_cache.stream_or_generate(params, PROMPT_FIELDS, lambda: stream_content(build_prompt(params)),
+                                                     fresh=params.get('fresh_variation', False)):
+            pieces.append(piece)
+            yield piece
+        finish_stream(job_id, ''.join(pieces))
+    except GeneratorExit:
+        fail_stream(job_id, STREAM_CLOSED)
+        raise
+    except Exception as e:
+        fail_stream(job_id, str(e))
+        raise
+
+
+@jobs.job_handler('generate_script')
+def run_generation_job(job, params):
+    script_content = prompt_cache.get_or_generate(
+        params, PROMPT_FIELDS,
+        lambda: generate_content(build_prompt(params)),
+        fresh=params.get('fresh_variation', False),
+    )
+    if not script_content:
+        raise ValueError("Empty script content received from webhook")
+
+    script = Script(content=script_content, user_id=job.user_id)
+    db.session.add(script)
+    db.session.commit()
+    return {'script_id': script.id}
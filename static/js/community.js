@@ -1,6 +1,8 @@
 document.addEventListener('DOMContentLoaded', function() {
     const postForm = document.getElementById('post-form');
-    const commentForms = document.querySelectorAll('.comment-form');
+    const postsContainer = document.getElementById('posts-container');
+    const sentinel = document.getElementById('feed-sentinel');
+    let loadingFeed = false;
 
     if (postForm) {
         postForm.addEventListener('submit', function(e) {
@@ -20,22 +22,119 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    commentForms.forEach(form => {
-        form.addEventListener('submit', function(e) {
-            e.preventDefault();
-            const formData = new FormData(form);
-            const postId = form.getAttribute('data-post-id');
-            fetch(`/add_comment/${postId}`, {
-                method: 'POST',
-                body: formData
-            }).then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    location.reload();
-                } else {
-                    alert('Error adding comment');
-                }
-            });
+    if (!postsContainer) {
+        return;
+    }
+
+    postsContainer.addEventListener('submit', function(e) {
+        const form = e.target.closest('.comment-form');
+        if (!form) {
+            return;
+        }
+        e.preventDefault();
+        const formData = new FormData(form);
+        const postId = form.getAttribute('data-post-id');
+        fetch(`/add_comment/${postId}`, {
+            method: 'POST',
+            body: formData
+        }).then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                location.reload();
+            } else {
+                alert('Error adding comment');
+            }
         });
     });
+
+    postsContainer.addEventListener('click', function(e) {
+        const button = e.target.closest('.show-all-comments');
+        if (!button) {
+            return;
+        }
+        fetch(button.dataset.url)
+            .then(response => response.json())
+            .then(data => {
+                const list = button.closest('.comments').querySelector('.comment-list');
+                list.replaceChildren(...data.comments.map(renderComment));
+                button.remove();
+            })
+            .catch(error => console.error('Error loading comments:', error));
+    });
+
+    function element(tag, className, text) {
+        const el = document.createElement(tag);
+        if (className) {
+            el.className = className;
+        }
+        if (text !== undefined) {
+            el.textContent = text;
+        }
+        return el;
+    }
+
+    function renderComment(comment) {
+        const div = element('div', 'comment');
+        div.appendChild(element('p', null, comment.content));
+        div.appendChild(element('small', null, `Commented by ${comment.author} on ${comment.created_at}`));
+        return div;
+    }
+
+    function renderPost(post) {
+        const div = element('div', 'community-post');
+        div.dataset.postId = post.id;
+        div.appendChild(element('h3', null, post.title));
+        div.appendChild(element('p', null, post.content));
+        div.appendChild(element('small', null, `Posted by ${post.author} on ${post.created_at}`));
+
+        const comments = element('div', 'comments mt-3');
+        comments.appendChild(element('h4', null, 'Comments'));
+        const list = element('div', 'comment-list');
+        post.comments.forEach(comment => list.appendChild(renderComment(comment)));
+        comments.appendChild(list);
+        if (post.comment_count > post.comments.length) {
+            const button = element('button', 'btn btn-link p-0 show-all-comments', `Show all ${post.comment_count} comments`);
+            button.type = 'button';
+            button.dataset.url = `/community/posts/${post.id}/comments`;
+            comments.appendChild(button);
+        }
+        div.appendChild(comments);
+
+        // Reuse the server-rendered comment form (with its CSRF token) as a template.
+        const template = postsContainer.querySelector('.comment-form');
+        if (template) {
+            const form = template.cloneNode(true);
+            form.dataset.postId = post.id;
+            form.action = `/add_comment/${post.id}`;
+            form.querySelector('textarea').value = '';
+            div.appendChild(form);
+        }
+        return div;
+    }
+
+    function loadMore() {
+        const cursor = sentinel.dataset.nextCursor;
+        if (loadingFeed || !cursor) {
+            return;
+        }
+        loadingFeed = true;
+        fetch(`${sentinel.dataset.feedUrl}?cursor=${encodeURIComponent(cursor)}`)
+            .then(response => response.json())
+            .then(data => {
+                data.posts.forEach(post => postsContainer.appendChild(renderPost(post)));
+                sentinel.dataset.nextCursor = data.next_cursor || '';
+            })
+            .catch(error => console.error('Error loading posts:', error))
+            .finally(() => {
+                loadingFeed = false;
+            });
+    }
+
+    if (sentinel && 'IntersectionObserver' in window) {
+        new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMore();
+            }
+        }, { rootMargin: '400px' }).observe(sentinel);
+    }
 });
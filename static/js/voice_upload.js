@@ -0,0 +1,62 @@
+// Resumable upload of a voice recording. The blob is sent in chunks to
+// /record_voice/uploads/<id>; after a failed chunk the offset the server
+// holds is fetched again and the upload carries on from there.
+function uploadVoiceRecording(blob, scriptId, csrfToken, onProgress) {
+    const headers = { 'X-CSRFToken': csrfToken };
+    const maxRetries = 5;
+
+    const json = response => response.json().then(data => {
+        if (!response.ok && response.status !== 409) {
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        }
+        return data;
+    });
+    const wait = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+    return fetch('/record_voice/uploads', {
+        method: 'POST',
+        headers: { ...headers, 'Content-Type': 'application/json' },
+        body: JSON.stringify({ script_id: scriptId, size: blob.size })
+    }).then(json).then(session => {
+        let retries = 0;
+
+        const sendFrom = offset => {
+            onProgress(offset / blob.size);
+            return fetch(session.upload_url, {
+                method: 'PUT',
+                headers: { ...headers, 'Upload-Offset': String(offset) },
+                body: blob.slice(offset, offset + session.chunk_size)
+            }).then(json).then(data => {
+                retries = 0;
+                if (data.job_id) {
+                    return data;
+                }
+                return sendFrom(data.offset);
+            }, error => {
+                if (++retries > maxRetries || error.message.startsWith('Recording')) {
+                    throw error;
+                }
+                return wait(1000 * 2 ** retries)
+                    .then(() => fetch(session.upload_url).then(json))
+                    .then(status => sendFrom(status.offset), () => sendFrom(offset));
+            });
+        };
+        return sendFrom(0);
+    });
+}
+
+function waitForVoiceProcessing(statusUrl, onProgress) {
+    return fetch(statusUrl)
+        .then(response => response.json())
+        .then(data => {
+            onProgress(data.progress || 0);
+            if (data.status === 'done') {
+                return data;
+            }
+            if (data.status === 'failed') {
+                throw new Error(data.error || 'Unknown error occurred');
+            }
+            return new Promise(resolve => setTimeout(resolve, 1500))
+                .then(() => waitForVoiceProcessing(statusUrl, onProgress));
+        });
+}
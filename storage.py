@@ -0,0 +1,209 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import current_app
+
+# Blob storage for everything under UPLOAD_FOLDER. Keys are flat file names
+# (what the models already store in audio_file / profile_photo); backends
+# decide where the bytes live. Routes never build upload paths themselves.
+
+
+def _check_key(key):
+    if not key or os.path.basename(key) != key or key in ('.', '..'):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+
+class LocalStorage:
+    # Files are sharded two levels deep by a hash of the key so no directory
+    # grows past a few thousand entries. Files written before sharding still
+    # resolve from the flat root.
+    def __init__(self, root, chunk_size):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def _sharded_path(self, key):
+        digest = hashlib.md5(_check_key(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], key)
+
+    def path(self, key):
+        sharded = self._sharded_path(key)
+        if os.path.exists(sharded):
+            return sharded
+        legacy = os.path.join(self.root, key)
+        if os.path.isfile(legacy):
+            return legacy
+        return sharded
+
+    def url(self, key, expires=None):
+        return None
+
+    def save(self, key, stream):
+        path = self._sharded_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.upload"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return os.path.getsize(path)
+
+    def save_file(self, key, local_path):
+        # Takes ownership of local_path.
+        path = self._sharded_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(local_path, path)
+        return os.path.getsize(path)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    @contextmanager
+    def local_copy(self, key):
+        yield self.path(key)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, prefix=''):
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(prefix) and not filename.endswith(('.upload', '.tmp', '.part', '.seg')):
+                    yield filename
+
+
+class S3Storage:
+    # Any S3-compatible service (AWS, MinIO, moto's server mode) via boto3.
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, chunk_size=8 * 1024 * 1024):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client_error = ClientError
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size)
+
+    def _object_key(self, key):
+        return f"{self.prefix}{_check_key(key)}"
+
+    def path(self, key):
+        return None
+
+    def url(self, key, expires=3600):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+                                                  ExpiresIn=expires)
+
+    def save(self, key, stream):
+        # upload_fileobj reads the stream in multipart_chunksize parts, so the
+        # upload is never buffered whole in memory.
+        counter = _CountingReader(stream)
+        self.client.upload_fileobj(counter, self.bucket, self._object_key(key), Config=self.transfer_config)
+        return counter.count
+
+    def save_file(self, key, local_path):
+        size = os.path.getsize(local_path)
+        self.client.upload_file(local_path, self.bucket, self._object_key(key), Config=self.transfer_config)
+        os.remove(local_path)
+        return size
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._client_error:
+            return False
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))['ContentLength']
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body']
+
+    @contextmanager
+    def local_copy(self, key):
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), path, Config=self.transfer_config)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def keys(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{prefix}"):
+            for entry in page.get('Contents', []):
+                yield entry['Key'][len(self.prefix):]
+
+
+class _CountingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+_storage = None
+_storage_lock = threading.Lock()
+_deleter = ThreadPoolExecutor(max_workers=2, thread_name_prefix='storage-delete')
+
+
+def get_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            config = current_app.config
+            if config['STORAGE_BACKEND'] == 's3':
+                _storage = S3Storage(config['S3_BUCKET'], prefix=config['S3_PREFIX'], endpoint_url=config['S3_ENDPOINT_URL'],
+                                     region=config['S3_REGION'], chunk_size=config['S3_MULTIPART_CHUNK_SIZE'])
+            else:
+                _storage = LocalStorage(config['UPLOAD_FOLDER'], config['STORAGE_CHUNK_SIZE'])
+        return _storage
+
+
+def scratch_path(filename):
+    # Local working space for renders and transcodes before they are saved.
+    directory = os.path.join(current_app.config['UPLOAD_FOLDER'], 'rendering')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def delete_async(key):
+    backend = get_storage()
+
+    def delete():
+        try:
+            backend.delete(key)
+        except Exception as e:
+            logging.error(f"Failed to delete {key} from storage: {str(e)}")
+
+    return _deleter.submit(delete)
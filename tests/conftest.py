@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import pytest
+
+# One throwaway SQLite database, built by the Alembic migrations, for the
+# whole run; every test starts from empty tables and empty caches.
+_workdir = tempfile.mkdtemp(prefix='manifestation_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ['JOB_EAGER'] = 'true'
+
+from app import create_app, db
+
+
+@pytest.fixture(scope='session')
+def app():
+    import flask_migrate
+    flask_app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'UPLOAD_FOLDER': os.path.join(_workdir, 'uploads'),
+    })
+    os.makedirs(flask_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with flask_app.app_context():
+        flask_migrate.upgrade()
+    yield flask_app
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def clean(app):
+    import prompt_cache
+    import rate_limit
+    import render_cache
+    import user_cache
+    for module in (prompt_cache, rate_limit, render_cache, user_cache):
+        module._backend = None
+    yield
+    with app.app_context():
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        db.session.remove()
+
+
+@pytest.fixture
+def user(app):
+    from models import User
+    with app.app_context():
+        account = User(username='tester', email='tester@example.com', profile_photo='default.jpg')
+        account.set_password('secret')
+        db.session.add(account)
+        db.session.commit()
+        return account.id
+
+
+@pytest.fixture
+def client(app, user):
+    test_client = app.test_client()
+    response = test_client.post('/login', data={'username': 'tester', 'password': 'secret'})
+    assert response.status_code == 302
+    return test_client
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app import db
+from models import Job, Script
+import tts
+
+CONTENT = 'Breathe in... Breathe out... You are calm.'
+
+
+class FreshThreadExecutor:
+    # Runs every call on a thread of its own, so no two steps of a response
+    # share a thread (or anything a thread left behind).
+    def __init__(self):
+        self.executors = []
+
+    def submit(self, func, *args):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.executors.append(executor)
+        return executor.submit(func, *args)
+
+    def shutdown(self, wait=True, **kwargs):
+        for executor in self.executors:
+            executor.shutdown(wait=wait)
+
+
+@pytest.fixture
+def asgi(app, monkeypatch):
+    import asgi as asgi_module
+    executor = FreshThreadExecutor()
+    monkeypatch.setattr(asgi_module, '_executor', executor)
+    yield asgi_module
+    executor.shutdown()
+
+
+def _get(application, path, cookie):
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+             'root_path': '', 'query_string': b'', 'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+             'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode('latin1'))]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return messages
+
+
+def test_streamed_render_keeps_its_context_across_threads(app, client, user, asgi, monkeypatch):
+    monkeypatch.setitem(app.config, 'TTS_CHUNK_CHARS', 15)
+    monkeypatch.setitem(app.config, 'TTS_STREAM_CHUNK_BYTES', 4)
+    with app.app_context():
+        script = Script(content=CONTENT, user_id=user)
+        db.session.add(script)
+        db.session.commit()
+        script_id = script.id
+        db.session.add(Job(kind='render_audio', status='running', user_id=user,
+                           payload=json.dumps({'script_id': script_id, 'audio_key': 'k' * 64})))
+        db.session.commit()
+        chunks = tts.split_script(CONTENT, 15)
+        expected = b''
+        for index in range(len(chunks)):
+            data = f"segment {index};".encode()
+            with open(f"{tts.segment_path(script_id, index, 'audio')}.seg", 'wb') as f:
+                f.write(data)
+            expected += data
+
+    try:
+        messages = _get(asgi.application, f"/stream_audio/{script_id}",
+                        f"session={client.get_cookie('session').value}")
+    finally:
+        with app.app_context():
+            tts.clear_segments(script_id)
+    assert messages[0]['status'] == 200
+    assert b''.join(message.get('body', b'') for message in messages[1:]) == expected
@@ -0,0 +1,80 @@
+import io
+import json
+from datetime import datetime
+import pytest
+from app import db
+from models import Job, Script
+import audio_mixer
+import storage
+
+FORM = {'background_music': 'none', 'volume': '0.5', 'background_volume': '0.5', 'playback_speed': '1.0'}
+
+
+@pytest.fixture
+def script_id(app, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {
+        'mix': {'user': '10/60', 'global': '100/60', 'user_concurrency': 1, 'global_concurrency': 10},
+    })
+    with app.app_context():
+        storage.get_storage().save('audio_mix_test.mp3', io.BytesIO(b'voice'))
+        script = Script(content='Breathe in...', user_id=user, audio_file='audio_mix_test.mp3')
+        db.session.add(script)
+        db.session.commit()
+        yield script.id
+        storage.get_storage().delete('audio_mix_test.mp3')
+
+
+def _mix_job(user, script_id, key):
+    now = datetime.utcnow()
+    job = Job(kind='mix_audio', status='running', user_id=user, enqueued_at=now, heartbeat_at=now,
+              payload=json.dumps({'script_id': script_id, 'key': key}))
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def _customize(client, script_id, **overrides):
+    return client.post('/manifestation_session', data=dict(FORM, script=str(script_id), **overrides),
+                       headers={'Accept': 'application/json'})
+
+
+def test_mix_in_progress_is_followed_not_started_again(app, client, user, script_id):
+    with app.app_context():
+        script = db.session.get(Script, script_id)
+        key = audio_mixer.mix_key(script, 'none', 0.5, 0.5, 1.0)
+        job_id = _mix_job(user, script_id, key)
+    response = _customize(client, script_id)
+    assert response.status_code == 200
+    assert response.get_json()['progress_url'].endswith(f"/{job_id}")
+    with app.app_context():
+        assert Job.query.filter_by(kind='mix_audio').count() == 1
+
+
+def test_one_mix_at_a_time_per_user(app, client, user, script_id):
+    with app.app_context():
+        _mix_job(user, script_id, 'another key')
+    response = _customize(client, script_id)
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+
+
+def test_each_job_mixes_into_its_own_scratch_file(app, user, script_id, monkeypatch):
+    out_paths = []
+
+    def render_mix(voice_path, bg_path, volume, background_volume, speed, out_path):
+        out_paths.append(out_path)
+        with open(out_path, 'wb') as f:
+            f.write(b'mix')
+
+    monkeypatch.setattr(audio_mixer, 'render_mix', render_mix)
+    with app.app_context():
+        # Both jobs find the mix missing, as when they run at the same time.
+        monkeypatch.setattr(storage.get_storage(), 'exists', lambda key: False)
+        payload = {'script_id': script_id, 'key': 'k' * 64, 'background_music': 'none', 'volume': 0.5,
+                   'background_volume': 0.5, 'playback_speed': 1.0}
+        for job_id in (1, 2):
+            audio_mixer.run_mix_job(Job(id=job_id), payload)
+        monkeypatch.undo()
+        storage.get_storage().delete(audio_mixer.mix_filename('k' * 64))
+    assert len(set(out_paths)) == 2
@@ -0,0 +1,104 @@
+import io
+import time
+import pytest
+from app import db
+from models import AudioBlob, Script
+import audio_store
+import storage
+
+
+def _wait_for_delete(filename):
+    deadline = time.monotonic() + 5
+    while storage.get_storage().exists(filename) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return not storage.get_storage().exists(filename)
+
+
+@pytest.fixture
+def blob_script(app, user):
+    # A script holding the only reference to a stored blob.
+    with app.app_context():
+        key = 'k' * 64
+        filename = audio_store.blob_filename(key)
+        storage.get_storage().save(filename, io.BytesIO(b'audio'))
+        blob = audio_store.store(key, filename)
+        script = Script(content='Breathe in...', user_id=user)
+        db.session.add(script)
+        audio_store.attach(script, blob)
+        db.session.commit()
+        yield script.id, key, filename
+        if storage.get_storage().exists(filename):
+            storage.get_storage().delete(filename)
+
+
+def test_rolled_back_release_keeps_the_file(app, blob_script):
+    script_id, key, filename = blob_script
+    with app.app_context():
+        audio_store.release(db.session.get(Script, script_id))
+        db.session.rollback()
+        assert db.session.get(AudioBlob, key).ref_count == 1
+        assert db.session.get(Script, script_id).audio_blob_key == key
+        time.sleep(0.1)
+        assert storage.get_storage().exists(filename)
+
+
+def test_committed_release_deletes_the_blob(app, blob_script):
+    script_id, key, filename = blob_script
+    with app.app_context():
+        script = db.session.get(Script, script_id)
+        audio_store.release(script)
+        db.session.delete(script)
+        db.session.commit()
+        assert db.session.get(AudioBlob, key) is None
+        assert _wait_for_delete(filename)
+
+
+def test_collect_spares_a_blob_that_was_attached_again(app, blob_script):
+    _, key, filename = blob_script
+    with app.app_context():
+        assert audio_store.collect([key]) == []
+        assert db.session.get(AudioBlob, key) is not None
+        assert storage.get_storage().exists(filename)
+
+
+def test_attach_fails_once_the_blob_is_gone(app, user, blob_script):
+    # Another worker looked the blob up just before it was collected.
+    script_id, key, filename = blob_script
+    with app.app_context():
+        audio_store.release(db.session.get(Script, script_id))
+        db.session.commit()
+        other = Script(content='Breathe out...', user_id=user)
+        db.session.add(other)
+        with pytest.raises(ValueError):
+            audio_store.attach(other, AudioBlob(key=key, filename=filename))
+
+
+def test_losing_a_concurrent_store_keeps_the_callers_changes(app, user, monkeypatch):
+    # Another render stores the same key between our lookup and our insert.
+    key = 'r' * 64
+    filename = audio_store.blob_filename(key)
+    with app.app_context():
+        storage.get_storage().save(filename, io.BytesIO(b'audio'))
+        db.session.add(AudioBlob(key=key, filename=filename, size=5, ref_count=0))
+        db.session.commit()
+        db.session.expunge_all()
+        script = Script(content='Breathe in...', user_id=user)
+        db.session.add(script)
+        real_get = db.session.get
+        missed = []
+
+        def get(model, ident, **kw):
+            if model is AudioBlob and not missed:
+                missed.append(ident)
+                return None
+            return real_get(model, ident, **kw)
+
+        monkeypatch.setattr(db.session, 'get', get)
+        blob = audio_store.store(key, filename)
+        monkeypatch.undo()
+
+        audio_store.attach(script, blob)
+        db.session.commit()
+        assert db.session.get(Script, script.id).audio_blob_key == key
+        assert db.session.get(AudioBlob, key).ref_count == 1
+        storage.get_storage().delete(filename)
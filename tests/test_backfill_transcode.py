@@ -0,0 +1,59 @@
+import io
+import shutil
+import subprocess
+import pytest
+from app import db
+from models import AudioBlob, Script
+import audio_store
+import backfill_transcode
+import storage
+
+
+@pytest.fixture
+def legacy_render(app, user):
+    # Two scripts sharing a render from before blobs, plus a voice upload.
+    with app.app_context():
+        scripts = [Script(content='Breathe in...', user_id=user, audio_file='audio_6.mp3') for _ in range(2)]
+        voice = Script(content='My voice', user_id=user, audio_file='user_voice_1_1.ogg')
+        db.session.add_all([*scripts, voice])
+        db.session.commit()
+        storage.get_storage().save('audio_6.mp3', io.BytesIO(b'legacy audio'))
+        yield [script.id for script in scripts], voice.id
+
+
+def test_legacy_render_in_current_format_is_attached_in_place(app, legacy_render):
+    script_ids, voice_id = legacy_render
+    with app.app_context():
+        backfill_transcode.backfill_legacy_renders(dry_run=False)
+        blob = AudioBlob.query.one()
+        assert blob.filename == 'audio_6.mp3'
+        assert blob.ref_count == 2
+        for script_id in script_ids:
+            assert db.session.get(Script, script_id).audio_blob_key == blob.key
+        assert db.session.get(Script, voice_id).audio_blob_key is None
+        assert storage.get_storage().exists('audio_6.mp3')
+        storage.get_storage().delete('audio_6.mp3')
+
+
+def test_dry_run_changes_nothing(app, legacy_render):
+    with app.app_context():
+        backfill_transcode.backfill_legacy_renders(dry_run=True)
+        assert AudioBlob.query.count() == 0
+        storage.get_storage().delete('audio_6.mp3')
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+def test_legacy_render_is_transcoded_into_a_blob(app, legacy_render, monkeypatch):
+    script_ids, _ = legacy_render
+    monkeypatch.setitem(app.config, 'TTS_OUTPUT_FORMAT', 'opus')
+    monkeypatch.setitem(app.config, 'FFMPEG_BINARY', shutil.which('ffmpeg'))
+    with app.app_context():
+        path = storage.scratch_path('tone.mp3')
+        subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=duration=1',
+                        path], check=True)
+        storage.get_storage().save_file('audio_6.mp3', path)
+        backfill_transcode.backfill_legacy_renders(dry_run=False)
+        blob = AudioBlob.query.one()
+        assert blob.filename == audio_store.blob_filename(blob.key, 'ogg')
+        assert db.session.get(Script, script_ids[0]).audio_file == blob.filename
+        storage.get_storage().delete(blob.filename)
@@ -0,0 +1,130 @@
+import pytest
+from app import db
+from models import BatchScript, Script
+import batch_generation
+
+ITEM = {'goal': 'Run a marathon', 'focus': 'health', 'duration': '5', 'tone': 'calm', 'visualization': 'guided',
+        'affirmation_style': 'present'}
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    # Prompts sent to the (stubbed) generation backend.
+    prompts = []
+
+    def generate_content(prompt):
+        prompts.append(prompt)
+        return f"Script {len(prompts)}"
+
+    monkeypatch.setattr(batch_generation, 'generate_content', generate_content)
+    return prompts
+
+
+def test_duplicates_share_one_generation(app, user, generated):
+    items = [dict(ITEM, user_id=user), dict(ITEM, user_id=user), dict(ITEM, user_id=user, fresh_variation=True),
+             dict(ITEM, user_id=user, focus='nonsense'), dict(ITEM, user_id=user + 1)]
+    with app.app_context():
+        report = batch_generation.run_batch(items, backend='concurrent')
+        assert [item['status'] for item in report['items']] == ['created', 'duplicate', 'created', 'invalid',
+                                                                'invalid']
+        assert report['items'][1]['duplicate_of'] == 0
+        assert len(generated) == 2
+        assert Script.query.count() == 2
+
+
+def test_resumed_batch_only_generates_what_failed(app, user, generated, tmp_path, monkeypatch):
+    items = [dict(ITEM, user_id=user), dict(ITEM, user_id=user, tone='energetic')]
+    checkpoint = str(tmp_path / 'items.checkpoint')
+    real = batch_generation.generate_content
+
+    def flaky(prompt):
+        if 'energetic' in prompt:
+            raise RuntimeError('upstream timeout')
+        return real(prompt)
+
+    with app.app_context():
+        monkeypatch.setattr(batch_generation, 'generate_content', flaky)
+        first = batch_generation.run_batch(items, backend='concurrent', checkpoint_path=checkpoint)
+        assert [item['status'] for item in first['items']] == ['created', 'failed']
+        monkeypatch.setattr(batch_generation, 'generate_content', real)
+        second = batch_generation.run_batch(items, backend='concurrent', checkpoint_path=checkpoint)
+        assert [item['status'] for item in second['items']] == ['created', 'created']
+        assert second['items'][0]['script_id'] == first['items'][0]['script_id']
+        assert len(generated) == 2
+        assert Script.query.count() == 2
+
+
+def _commit_then(monkeypatch, nth, action):
+    # Wraps the session's commit so that its nth call runs `action`, which
+    # receives the real commit.
+    real_commit = db.session.commit
+    commits = []
+
+    def commit():
+        commits.append(1)
+        if len(commits) == nth:
+            return action(real_commit)
+        real_commit()
+
+    monkeypatch.setattr(db.session, 'commit', commit)
+
+
+def test_crash_after_saving_does_not_save_again(app, user, generated, tmp_path, monkeypatch):
+    items = [dict(ITEM, user_id=user)]
+    checkpoint = str(tmp_path / 'items.checkpoint')
+
+    def commit_and_die(real_commit):
+        real_commit()
+        raise SystemExit()
+
+    with app.app_context():
+        _commit_then(monkeypatch, 2, commit_and_die)
+        with pytest.raises(SystemExit):
+            batch_generation.run_batch(items, backend='concurrent', checkpoint_path=checkpoint)
+        monkeypatch.undo()
+        report = batch_generation.run_batch(items, backend='concurrent', checkpoint_path=checkpoint)
+        assert report['items'][0]['status'] == 'created'
+        assert Script.query.count() == 1
+
+
+def test_failed_insert_records_nothing(app, user, generated, tmp_path, monkeypatch):
+    items = [dict(ITEM, user_id=user)]
+    checkpoint = str(tmp_path / 'items.checkpoint')
+
+    def lose_connection(real_commit):
+        db.session.rollback()
+        raise RuntimeError('connection lost')
+
+    with app.app_context():
+        _commit_then(monkeypatch, 2, lose_connection)
+        with pytest.raises(RuntimeError):
+            batch_generation.run_batch(items, backend='concurrent', checkpoint_path=checkpoint)
+        monkeypatch.undo()
+        assert Script.query.count() == 0
+        assert BatchScript.query.count() == 0
+        report = batch_generation.run_batch(items, backend='concurrent', checkpoint_path=checkpoint)
+        assert report['items'][0]['status'] == 'created'
+        assert report['stats']['from_checkpoint'] == 1
+        assert Script.query.count() == 1
+
+
+def test_stub_batch_backend(app, user, generated):
+    items = [dict(ITEM, user_id=user), dict(ITEM, user_id=user, goal='Learn French')]
+    with app.app_context():
+        report = batch_generation.run_batch(items, backend='stub_batch')
+        assert report['counts'] == {'created': 2}
+        assert len(generated) == 2
+
+
+def test_batch_api_requires_its_token(app, user, generated, monkeypatch):
+    client = app.test_client()
+    monkeypatch.setitem(app.config, 'BATCH_API_TOKEN', None)
+    assert client.post('/generate_script/batch', json={'items': [ITEM]}).status_code == 404
+    monkeypatch.setitem(app.config, 'BATCH_API_TOKEN', 'schedule-me')
+    assert client.post('/generate_script/batch', json={'items': [ITEM]},
+                       headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.post('/generate_script/batch', json={'items': [dict(ITEM, user_id=user)]},
+                           headers={'Authorization': 'Bearer schedule-me'})
+    assert response.status_code == 202
+    status = client.get(response.get_json()['status_url'], headers={'Authorization': 'Bearer schedule-me'})
+    assert status.get_json()['status'] == 'done'
@@ -0,0 +1,65 @@
+import json
+from datetime import datetime, timedelta
+from app import db
+from models import Job
+import jobs
+
+
+@jobs.job_handler('test_echo')
+def run_test_echo_job(job, payload):
+    return payload
+
+
+def _job(status, heartbeat_age, kind='test_echo'):
+    heartbeat_at = datetime.utcnow() - timedelta(seconds=heartbeat_age)
+    job = Job(kind=kind, status=status, payload=json.dumps({'value': 1}), enqueued_at=heartbeat_at,
+              started_at=heartbeat_at if status == 'running' else None, heartbeat_at=heartbeat_at)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_stale_queued_job_is_run_again(app):
+    with app.app_context():
+        job_id = _job('queued', app.config['JOB_STALE_AFTER'] + 60)
+        requeued, failed = jobs.recover_stale()
+        job = db.session.get(Job, job_id, populate_existing=True)
+        assert (requeued, failed) == ([job_id], [])
+        assert job.status == 'done'
+        assert jobs.job_result(job) == {'value': 1}
+
+
+def test_stale_running_job_is_failed(app):
+    with app.app_context():
+        job_id = _job('running', app.config['JOB_STALE_AFTER'] + 60)
+        assert jobs.recover_stale() == ([], [job_id])
+        job = db.session.get(Job, job_id, populate_existing=True)
+        assert job.status == 'failed'
+        assert job.error == jobs.INTERRUPTED
+
+
+def test_stale_job_of_unknown_kind_is_failed(app):
+    with app.app_context():
+        job_id = _job('queued', app.config['JOB_STALE_AFTER'] + 60, kind='removed_kind')
+        assert jobs.recover_stale() == ([], [job_id])
+
+
+def test_live_jobs_are_left_alone(app):
+    with app.app_context():
+        queued = _job('queued', 1)
+        running = _job('running', 1)
+        assert jobs.recover_stale() == ([], [])
+        assert db.session.get(Job, queued).status == 'queued'
+        assert db.session.get(Job, running).status == 'running'
+
+
+def test_heartbeat_keeps_held_jobs_alive(app):
+    with app.app_context():
+        job_id = _job('running', app.config['JOB_STALE_AFTER'] + 60)
+        jobs._hold(job_id)
+        try:
+            jobs.beat()
+        finally:
+            jobs._release(job_id)
+        assert jobs.recover_stale() == ([], [])
+        assert Job.query.filter(Job.id == job_id, jobs.is_alive()).count() == 1
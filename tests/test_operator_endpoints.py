@@ -0,0 +1,18 @@
+import pytest
+
+ENDPOINTS = ['/metrics', '/render_cache/stats', '/prompt_cache/stats', '/webhook_client/stats']
+
+
+@pytest.mark.parametrize('path', ENDPOINTS)
+def test_hidden_without_a_token(app, client, monkeypatch, path):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', None)
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize('path', ENDPOINTS)
+def test_require_the_token(app, client, monkeypatch, path):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-me')
+    monkeypatch.setitem(app.config, 'SCRIPT_GENERATION_WEBHOOK_URL', 'http://127.0.0.1:9/webhook')
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer scrape-me'}).status_code == 200
@@ -0,0 +1,45 @@
+from datetime import datetime
+from app import db
+from models import PromptCacheEntry
+import prompt_cache
+
+FIELDS = ('goal', 'tone')
+PARAMS = {'goal': 'A  new JOB', 'tone': 'Calm'}
+
+
+def test_normalized_params_share_a_key():
+    assert prompt_cache.cache_key(PARAMS, FIELDS) == prompt_cache.cache_key({'goal': 'a new job', 'tone': 'calm'}, FIELDS)
+    assert prompt_cache.cache_key(PARAMS, FIELDS) != prompt_cache.cache_key({'goal': 'a new car', 'tone': 'calm'}, FIELDS)
+
+
+def test_second_request_is_served_from_the_cache(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROMPT_CACHE_BACKEND', 'database')
+    calls = []
+    with app.app_context():
+        generate = lambda: calls.append(1) or 'Breathe in...'
+        assert prompt_cache.get_or_generate(PARAMS, FIELDS, generate) == 'Breathe in...'
+        assert prompt_cache.get_or_generate(PARAMS, FIELDS, generate) == 'Breathe in...'
+        assert prompt_cache.get_or_generate(PARAMS, FIELDS, generate, fresh=True) == 'Breathe in...'
+        assert len(calls) == 2
+        assert db.session.get(PromptCacheEntry, prompt_cache.cache_key(PARAMS, FIELDS)).hit_count == 1
+
+
+def test_losing_a_concurrent_insert_keeps_the_winner(app, monkeypatch):
+    # Another worker inserts the key between our lookup and our insert.
+    with app.app_context():
+        key = prompt_cache.cache_key(PARAMS, FIELDS)
+        now = datetime.utcnow()
+        db.session.add(PromptCacheEntry(key=key, content='theirs', latency_ms=5, hit_count=0, created_at=now,
+                                        last_used_at=now))
+        db.session.commit()
+        db.session.expunge_all()
+        real_get = db.session.get
+        monkeypatch.setattr(db.session, 'get', lambda model, ident, **kw: None if model is PromptCacheEntry
+                            else real_get(model, ident, **kw))
+
+        backend = prompt_cache.DatabaseBackend(100, 3600)
+        backend.set(key, 'ours', 7)
+        monkeypatch.undo()
+
+        assert backend.get(key) == ('theirs', 5)
+        assert len(backend) == 1
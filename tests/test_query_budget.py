@@ -0,0 +1,48 @@
+import pytest
+from app import db
+from models import Comment, Post, User
+from query_budget import track_queries
+import counters
+import render_cache
+
+
+def _seed(app, posts, comments_per_post):
+    # Every post and comment has its own author, so loading authors one at a
+    # time would show up as extra queries.
+    with app.app_context():
+        offset = User.query.count()
+        authors = [User(username=f'author{offset + i}', email=f'author{offset + i}@example.com',
+                        profile_photo='default.jpg', password_hash='x')
+                   for i in range(posts * (comments_per_post + 1))]
+        db.session.add_all(authors)
+        db.session.flush()
+        authors = iter(authors)
+        for i in range(posts):
+            post = Post(title=f'Post {i}', content='It happened!', user_id=next(authors).id)
+            db.session.add(post)
+            db.session.flush()
+            db.session.add_all([Comment(content='Congrats!', user_id=next(authors).id, post_id=post.id)
+                                for _ in range(comments_per_post)])
+        db.session.commit()
+        counters.reconcile()
+
+
+def _queries(app, client, path):
+    # Warm the logged-in user cache, but start with no rendered fragments so
+    # every post on the page is loaded.
+    client.get(path)
+    render_cache._backend = None
+    with app.app_context(), track_queries() as counter:
+        response = client.get(path)
+    assert response.status_code == 200
+    return counter['count']
+
+
+@pytest.mark.parametrize('path', ['/community', '/community/feed'])
+def test_community_queries_do_not_grow_with_posts(app, client, path):
+    _seed(app, posts=2, comments_per_post=2)
+    few = _queries(app, client, path)
+    _seed(app, posts=30, comments_per_post=8)
+    many = _queries(app, client, path)
+    assert many == few
+    assert many <= app.config['COMMUNITY_QUERY_BUDGET']
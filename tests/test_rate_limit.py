@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from models import Job, Post, RateLimitBucket
+import rate_limit
+
+
+@pytest.fixture
+def limits(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {
+        'tts': {'user': '2/60', 'global': '100/60', 'user_concurrency': 1, 'global_concurrency': 10},
+    })
+
+
+def _render_job(user, heartbeat_age):
+    heartbeat_at = datetime.utcnow() - timedelta(seconds=heartbeat_age)
+    db.session.add(Job(kind='render_audio', status='running', user_id=user, enqueued_at=heartbeat_at,
+                       started_at=heartbeat_at, heartbeat_at=heartbeat_at))
+    db.session.commit()
+
+
+def test_token_bucket_runs_out_and_reports_the_wait():
+    backend = rate_limit.MemoryBackend()
+    assert backend.take('k', 2, 60) == 0
+    assert backend.take('k', 2, 60) == 0
+    assert 29 < backend.take('k', 2, 60) <= 30
+    backend.refund('k', 2, 60)
+    assert backend.take('k', 2, 60) == 0
+
+
+def test_live_job_counts_towards_concurrency(app, user, limits):
+    with app.app_context():
+        _render_job(user, 1)
+        with pytest.raises(rate_limit.RateLimitExceeded):
+            rate_limit.admit('tts', user)
+
+
+def test_job_orphaned_by_a_restart_does_not_count(app, user, limits):
+    with app.app_context():
+        _render_job(user, app.config['JOB_STALE_AFTER'] + 60)
+        rate_limit.admit('tts', user)
+
+
+def test_database_backend_leaves_the_request_session_alone(app, user, limits, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_BACKEND', 'database')
+    with app.app_context():
+        db.session.add(Post(title='Unsaved', content='x', user_id=user))
+        with db.session.no_autoflush:
+            rate_limit.admit('tts', user)
+            rate_limit.admit('tts', user)
+            with pytest.raises(rate_limit.RateLimitExceeded):
+                rate_limit.admit('tts', user)
+        db.session.rollback()
+        assert Post.query.count() == 0
+        assert db.session.get(RateLimitBucket, f'tts:user:{user}').tokens < 1
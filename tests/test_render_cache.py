@@ -0,0 +1,33 @@
+from app import db
+from models import Script
+import render_cache
+import user_cache
+
+
+def _write_from_another_worker(app, user, content):
+    # Adds a script, then puts back the user cache entry from before it, as
+    # a worker that didn't make the change would still have.
+    with app.app_context():
+        stale = user_cache._load_columns(user)
+        db.session.add(Script(content=content, user_id=user))
+        db.session.commit()
+        user_cache.get_backend().set(user, stale)
+
+
+def test_profile_is_cached_per_content_version(app, client, user):
+    assert b'Breathe in' not in client.get('/profile').data
+    hits = render_cache.stats['profile']['hits']
+    client.get('/profile')
+    assert render_cache.stats['profile']['hits'] == hits + 1
+    with app.app_context():
+        db.session.add(Script(content='Breathe in...', user_id=user))
+        db.session.commit()
+    assert b'Breathe in' in client.get('/profile').data
+
+
+def test_write_in_another_worker_shows_at_once(app, client, user):
+    client.get('/profile')
+    _write_from_another_worker(app, user, 'Breathe out...')
+    page = client.get('/profile').data
+    assert b'Breathe out' in page
+    assert b'Your Generated Scripts (1)' in page
@@ -0,0 +1,69 @@
+import glob
+import os
+import pytest
+from app import db
+from models import Job, Script
+import jobs
+import storage
+import tts
+
+CONTENT = 'Breathe in... Breathe out... You are calm.'
+
+
+@pytest.fixture
+def script_id(app, user, monkeypatch):
+    for name, value in {'TTS_CHUNK_CHARS': 15, 'TTS_OUTPUT_FORMAT': 'mp3', 'TTS_ASYNC': False}.items():
+        monkeypatch.setitem(app.config, name, value)
+    with app.app_context():
+        script = Script(content=CONTENT, user_id=user)
+        db.session.add(script)
+        db.session.commit()
+        yield script.id
+        tts.clear_segments(script.id)
+
+
+def _render(script_id, user):
+    job = jobs.enqueue('render_audio', {'script_id': script_id, 'user_voice_filename': None,
+                                        'audio_key': f"test{script_id}"}, user_id=user)
+    return db.session.get(Job, job.id, populate_existing=True)
+
+
+def _segments(script_id):
+    return glob.glob(storage.scratch_path(f"audio_{script_id}.*.audio.*"))
+
+
+def test_split_script_prefers_pauses(app):
+    assert tts.split_script(CONTENT, 15) == ['Breathe in...', 'Breathe out...', 'You are calm.']
+
+
+def test_failed_render_leaves_no_segments(app, user, script_id, monkeypatch):
+    def synthesize_chunk(text, path, user_voice_path=None):
+        if text.startswith('You'):
+            with open(f"{path}.part", 'wb') as f:
+                f.write(b'half')
+            raise RuntimeError('speech API failed')
+        with open(f"{path}.seg", 'wb') as f:
+            f.write(text.encode())
+
+    monkeypatch.setattr(tts, 'synthesize_chunk', synthesize_chunk)
+    job = _render(script_id, user)
+    assert job.status == 'failed'
+    assert _segments(script_id) == []
+
+
+def test_render_ignores_segments_from_an_earlier_attempt(app, user, script_id, monkeypatch):
+    with open(tts.segment_path(script_id, 2, 'audio.seg'), 'wb') as f:
+        f.write(b'stale')
+
+    def synthesize_chunk(text, path, user_voice_path=None):
+        assert not os.path.exists(f"{path}.seg")
+        with open(f"{path}.seg", 'wb') as f:
+            f.write(text.encode())
+
+    monkeypatch.setattr(tts, 'synthesize_chunk', synthesize_chunk)
+    job = _render(script_id, user)
+    assert job.status == 'done'
+    script = db.session.get(Script, script_id, populate_existing=True)
+    with storage.get_storage().open(script.audio_file) as f:
+        assert f.read() == b'Breathe in...Breathe out...You are calm.'
+    assert _segments(script_id) == []
@@ -0,0 +1,67 @@
+import io
+import threading
+import pytest
+from app import db
+from models import Script
+import voice_upload
+
+
+class SlowStream:
+    # Hands out its bytes only once `release` is set.
+    def __init__(self, data, started, release):
+        self.data = io.BytesIO(data)
+        self.started = started
+        self.release = release
+
+    def read(self, size=-1):
+        self.started.set()
+        self.release.wait(5)
+        return self.data.read(size)
+
+
+@pytest.fixture
+def upload_id(app, user):
+    with app.app_context():
+        script = Script(content='Breathe in...', user_id=user)
+        db.session.add(script)
+        db.session.commit()
+        upload_id, _ = voice_upload.create(script.id, user, 10)
+        return upload_id
+
+
+def test_concurrent_pieces_at_one_offset_are_written_once(app, user, upload_id):
+    started, release = threading.Event(), threading.Event()
+    results = {}
+
+    def put(name, stream):
+        with app.app_context():
+            try:
+                results[name] = voice_upload.append(upload_id, user, 0, stream)
+            except voice_upload.VoiceUploadError as e:
+                results[name] = e
+
+    first = threading.Thread(target=put, args=('first', SlowStream(b'aaaaa', started, release)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=put, args=('second', io.BytesIO(b'bbbbb')))
+    second.start()
+    second.join(0.2)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert results['first'] == (5, None)
+    assert results['second'].status == 409
+    assert results['second'].details == {'offset': 5}
+    with app.app_context():
+        part_path, _ = voice_upload._paths(upload_id)
+        with open(part_path, 'rb') as f:
+            assert f.read() == b'aaaaa'
+        assert voice_upload.status(upload_id, user)['offset'] == 5
+
+
+def test_unknown_upload(app, user):
+    with app.app_context():
+        with pytest.raises(voice_upload.VoiceUploadError) as e:
+            voice_upload.append('0' * 32, user, 0, io.BytesIO(b'x'))
+    assert e.value.status == 404
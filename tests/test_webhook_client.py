@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import webhook_client
+from webhook_client import CircuitBreaker, CircuitOpenError, WebhookClient, WebhookError
+
+
+class TruncatedBody(BaseHTTPRequestHandler):
+    # Promises a chunked body and hangs up half way through it.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.write(b'40\r\n{"content": "Breathe')
+        self.wfile.flush()
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def truncating_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TruncatedBody)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/webhook'
+    server.shutdown()
+
+
+def test_breaker_opens_after_consecutive_failures_and_allows_one_trial():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    for _ in range(2):
+        assert breaker.before_call() is False
+        breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    threading.Event().wait(0.06)
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_truncated_body_counts_as_a_failure(truncating_url):
+    client = WebhookClient(truncating_url, max_attempts=2, backoff_base=0, failure_threshold=1, reset_timeout=0)
+    with pytest.raises(WebhookError):
+        client.post_json({'prompt': 'x'})
+    assert client.breaker.failures == 1
+    # Half-open straight away: the next call is the trial, and failing it
+    # must free the slot for the one after.
+    for _ in range(2):
+        with pytest.raises(WebhookError):
+            client.post_json({'prompt': 'x'})
+    assert client.breaker.failures == 3
+
+
+def test_unexpected_error_frees_the_trial(monkeypatch):
+    client = WebhookClient('http://127.0.0.1:9/webhook', failure_threshold=1, reset_timeout=0)
+    client.breaker.record_failure()
+
+    def explode(*args, **kwargs):
+        raise RuntimeError('bug')
+
+    monkeypatch.setattr(client.session, 'post', explode)
+    with pytest.raises(RuntimeError):
+        client.post_json({'prompt': 'x'})
+    assert client.breaker.before_call() is True
+
+
+def test_async_client_handles_every_httpx_error():
+    import httpx
+
+    def handler(request):
+        raise httpx.DecodingError('truncated body', request=request)
+
+    client = WebhookClient('http://webhook.test/', max_attempts=1, failure_threshold=1, reset_timeout=0)
+    async_client = webhook_client.AsyncWebhookClient(client, pool_size=1)
+    async_client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def call():
+        async with async_client.stream_json({'prompt': 'x'}):
+            pass
+
+    for expected_failures in (1, 2):
+        with pytest.raises(WebhookError):
+            asyncio.run(call())
+        assert client.breaker.failures == expected_failures
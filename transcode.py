@@ -0,0 +1,74 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+import storage
+
+# Encoder settings per compact format. Transcodes run in a process pool so
+# ffmpeg supervision never competes with request handling for the GIL, and
+# each one reports its byte savings and speed.
+FORMATS = {
+    'opus': {'extension': 'ogg', 'args': ['-c:a', 'libopus', '-application', 'voip', '-f', 'ogg']},
+    'aac': {'extension': 'm4a', 'args': ['-c:a', 'aac', '-movflags', '+faststart', '-f', 'mp4']},
+    'mp3': {'extension': 'mp3', 'args': ['-c:a', 'libmp3lame', '-f', 'mp3']},
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def transcoded_filename(filename, fmt):
+    return f"{os.path.splitext(filename)[0]}.{FORMATS[fmt]['extension']}"
+
+
+def transcode_file(ffmpeg, src, dst, fmt, bitrate, mono=False):
+    # Runs inside a pool process, so it must not touch the app or database.
+    started = time.monotonic()
+    tmp = f"{dst}.tmp"
+    args = [ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-i', src, '-vn']
+    if mono:
+        args += ['-ac', '1']
+    args += [*FORMATS[fmt]['args'], '-b:a', bitrate, tmp]
+    try:
+        subprocess.run(args, check=True, capture_output=True)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {
+        'bytes_in': os.path.getsize(src),
+        'bytes_out': os.path.getsize(dst),
+        'seconds': time.monotonic() - started,
+    }
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['TRANSCODE_WORKERS'])
+        return _pool
+
+
+def transcode(src, dst, fmt, bitrate, mono=False):
+    stats = get_pool().submit(transcode_file, current_app.config['FFMPEG_BINARY'], src, dst, fmt, bitrate, mono).result()
+    saved = stats['bytes_in'] - stats['bytes_out']
+    throughput = stats['bytes_in'] / stats['seconds'] / 1e6 if stats['seconds'] else 0
+    logging.info(f"Transcoded {os.path.basename(src)} to {fmt}: saved {saved} bytes "
+                 f"({stats['bytes_out']}/{stats['bytes_in']}) at {throughput:.1f} MB/s")
+    return stats
+
+
+def resolve_voice_upload(filename):
+    # A recording may have been transcoded since the browser learned its name.
+    backend = storage.get_storage()
+    if filename and not backend.exists(filename):
+        for fmt in FORMATS:
+            candidate = transcoded_filename(filename, fmt)
+            if backend.exists(candidate):
+                return candidate
+    return filename
+
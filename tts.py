@@ -0,0 +1,239 @@
+import asyncio
+import glob
+import os
+import re
+import shutil
+import time
+import logging
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from app import db
+from db_engine import release_connection
+from models import Script
+import jobs
+import audio_store
+import transcode
+import storage
+import metrics
+import chat_request
+
+# Scripts are written with '...' where the reader should pause, so those are
+# the preferred places to cut; sentence ends are the fallback.
+_PAUSE_RE = re.compile(r'(?<=\.\.\.)\s*')
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+
+def _pieces(text, max_chars):
+    for part in _PAUSE_RE.split(text):
+        if len(part) <= max_chars:
+            yield part
+            continue
+        for sentence in _SENTENCE_RE.split(part):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(' ', 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                yield sentence[:cut]
+                sentence = sentence[cut:].lstrip()
+            yield sentence
+
+
+def split_script(text, max_chars):
+    chunks = []
+    current = ''
+    for piece in _pieces(text.strip(), max_chars):
+        piece = piece.strip()
+        if not piece:
+            continue
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def segment_path(script_id, index, suffix):
+    return storage.scratch_path(f"audio_{script_id}.{index}.{suffix}")
+
+
+def clear_segments(script_id):
+    # Drops a script's '.part' and '.seg' files, so a render never mixes in
+    # (and a listener never streams) segments left by an earlier attempt.
+    for path in glob.glob(glob.escape(storage.scratch_path(f"audio_{script_id}.")) + '*.audio.*'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def speech_options(text, user_voice_path=None):
+    options = dict(model=current_app.config['TTS_MODEL'], voice=current_app.config['TTS_VOICE'], input=text)
+    if user_voice_path:
+        options['voice_file'] = user_voice_path
+    return options
+
+
+def synthesize_chunk(text, path, user_voice_path=None):
+    # Stream the response body to a '.part' file and rename it to '.seg' once
+    # complete, so listeners can tail it and never see a half-written segment
+    # as finished.
+    options = speech_options(text, user_voice_path)
+    part_path = f"{path}.part"
+    with metrics.timed('openai_tts'), chat_request.get_client().audio.speech.with_streaming_response.create(**options) as audio_response:
+        with open(part_path, "wb") as part_file:
+            for data in audio_response.iter_bytes(current_app.config['TTS_STREAM_CHUNK_BYTES']):
+                part_file.write(data)
+                part_file.flush()
+    os.replace(part_path, f"{path}.seg")
+
+
+def render_chunks(script_id, chunks, user_voice_path=None, on_progress=None):
+    if current_app.config['TTS_ASYNC']:
+        import async_generation
+        return asyncio.run(async_generation.render_chunks(script_id, chunks, user_voice_path, on_progress))
+    app = current_app._get_current_object()
+
+    def synthesize(index, text):
+        with app.app_context():
+            synthesize_chunk(text, segment_path(script_id, index, 'audio'), user_voice_path)
+
+    with ThreadPoolExecutor(max_workers=app.config['TTS_MAX_CONCURRENCY']) as executor:
+        futures = [executor.submit(synthesize, index, chunk) for index, chunk in enumerate(chunks)]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            if on_progress:
+                on_progress(done / len(chunks))
+    return [segment_path(script_id, index, 'audio.seg') for index in range(len(chunks))]
+
+
+def stitch_segments(segment_paths, audio_path):
+    # MP3 frames are self-delimiting, so segments can be stitched by plain
+    # concatenation in script order.
+    tmp_path = f"{audio_path}.tmp"
+    with open(tmp_path, "wb") as audio_file:
+        for path in segment_paths:
+            with open(path, "rb") as segment:
+                shutil.copyfileobj(segment, audio_file)
+    os.replace(tmp_path, audio_path)
+    for path in segment_paths:
+        os.remove(path)
+
+
+# Yields a script's audio while it is still being rendered. Segments are read
+# in order as they are written; once the render has been stitched, the rest
+# comes from the final file at the same offset, since that file is the
+# concatenation of the segments.
+def stream_render(script_id, chunk_count, fallback_paths, is_active):
+    buffer_size = current_app.config['TTS_STREAM_CHUNK_BYTES']
+    poll_interval = current_app.config['TTS_STREAM_POLL_INTERVAL']
+    sent = 0
+    for index in range(chunk_count):
+        base = segment_path(script_id, index, 'audio')
+        segment = None
+        while segment is None:
+            for path in (f"{base}.seg", f"{base}.part"):
+                try:
+                    segment = open(path, "rb")
+                    break
+                except FileNotFoundError:
+                    continue
+            if segment is not None:
+                break
+            for audio_path in fallback_paths:
+                try:
+                    audio_file = open(audio_path, "rb")
+                except FileNotFoundError:
+                    continue
+                with audio_file:
+                    audio_file.seek(sent)
+                    yield from iter(lambda: audio_file.read(buffer_size), b'')
+                return
+            if not is_active():
+                return
+            time.sleep(poll_interval)
+
+        with segment:
+            while True:
+                data = segment.read(buffer_size)
+                if data:
+                    sent += len(data)
+                    yield data
+                elif os.path.exists(f"{base}.seg") or not os.path.exists(f"{base}.part"):
+                    # Renamed (or stitched away) after our last read: drain what is left.
+                    for data in iter(lambda: segment.read(buffer_size), b''):
+                        sent += len(data)
+                        yield data
+                    break
+                elif not is_active():
+                    return
+                else:
+                    time.sleep(poll_interval)
+
+
+def stitched_path(script_id):
+    return storage.scratch_path(f"audio_{script_id}.stitched.mp3")
+
+
+def stream_fallback_paths(script_id, key):
+    # Where the stitched MP3 can be read once the segments are gone: the
+    # scratch copy kept until the blob is attached, then the blob itself when
+    # it is an MP3 on local storage.
+    paths = [stitched_path(script_id)]
+    if current_app.config['TTS_OUTPUT_FORMAT'] == 'mp3':
+        blob_path = storage.get_storage().path(audio_store.blob_filename(key))
+        if blob_path:
+            paths.append(blob_path)
+    return paths
+
+
+@jobs.job_handler('render_audio')
+def run_render_job(job, payload):
+    script = db.session.get(Script, payload['script_id'])
+    if script is None:
+        raise ValueError(f"Script {payload['script_id']} no longer exists")
+
+    user_voice_filename = transcode.resolve_voice_upload(payload.get('user_voice_filename'))
+    backend = storage.get_storage()
+
+    key = payload['audio_key']
+    blob = audio_store.lookup(key)
+    chunks = []
+    scratch_paths = []
+    try:
+        if blob is None:
+            clear_segments(script.id)
+            chunks = split_script(script.content, current_app.config['TTS_CHUNK_CHARS'])
+            logging.info(f"Rendering audio for script {script.id} in {len(chunks)} chunks")
+            # Synthesis takes a while; progress updates check connections out as needed.
+            release_connection(db.session)
+            voice_copy = backend.local_copy(user_voice_filename) if user_voice_filename else nullcontext()
+            with voice_copy as user_voice_path:
+                segment_paths = render_chunks(script.id, chunks, user_voice_path,
+                                              on_progress=lambda p: jobs.set_progress(job, p * 0.9))
+            fmt = current_app.config['TTS_OUTPUT_FORMAT']
+            filename = audio_store.blob_filename(key, transcode.FORMATS[fmt]['extension'])
+            output_path = stitched_path(script.id)
+            scratch_paths.append(output_path)
+            stitch_segments(segment_paths, output_path)
+            if fmt != 'mp3':
+                output_path = storage.scratch_path(filename)
+                scratch_paths.append(output_path)
+                transcode.transcode(scratch_paths[0], output_path, fmt, current_app.config['TTS_OUTPUT_BITRATE'])
+            # Streamed rather than moved so listeners still tailing the
+            # stitched file can finish reading it.
+            with open(output_path, "rb") as f:
+                backend.save(filename, f)
+            blob = audio_store.store(key, filename)
+
+        audio_store.attach(script, blob)
+        db.session.commit()
+    finally:
+        if chunks:
+            clear_segments(script.id)
+        for path in scratch_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return {'script_id': script.id, 'chunks': len(chunks)}
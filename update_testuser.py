@@ -1,8 +1,8 @@
-from app import app, db
+from app import create_app, db
 from models import User
 
 def update_testuser():
-    with app.app_context():
+    with create_app().app_context():
         user = User.query.filter_by(username='testuser').first()
         if user:
             user.is_paid = False
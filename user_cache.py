@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from app import db
+import metrics
+from models import User, Script
+
+# Short-lived cache of the logged-in user, so the user_loader doesn't query
+# the database on every request; file-serving and polling routes then need
+# no query at all unless they look something up themselves.
+#
+# Only the columns pages read are cached (never the password hash). Entries
+# are dropped after any commit that changed the user row or their scripts
+# (whose counters and content_version live on the row), so profile and
+# password changes take effect on the next request. With the memory backend
+# that only reaches the worker that made the change; the others catch up
+# within USER_CACHE_TTL seconds. The redis backend shares entries, and their
+# invalidation, between workers.
+
+COLUMNS = ('id', 'username', 'email', 'profile_photo', 'scripts_generated', 'script_count', 'audio_count',
+           'content_version')
+
+
+class CachedUser(UserMixin):
+    # Stands in for models.User as current_user. Anything beyond the cached
+    # columns (relationships, check_password, ...) loads the full row.
+    def __init__(self, columns):
+        self.__dict__.update(columns)
+        self._model = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._model is None:
+            self._model = db.session.get(User, self.id)
+        return getattr(self._model, name)
+
+    def __repr__(self):
+        return f"<CachedUser {self.id}>"
+
+
+class MemoryBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            columns, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return columns
+
+    def set(self, user_id, columns):
+        with self._lock:
+            self._entries[user_id] = (columns, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    # Shared between workers; Redis expires and evicts the entries itself.
+    def __init__(self, max_entries, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("USER_CACHE_BACKEND=redis requires the redis package (pip install redis)")
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(current_app.config['USER_CACHE_REDIS_URL'])
+
+    def _key(self, user_id):
+        return f"user_cache:{user_id}"
+
+    def get(self, user_id):
+        value = self.client.get(self._key(user_id))
+        return json.loads(value) if value is not None else None
+
+    def set(self, user_id, columns):
+        self.client.set(self._key(user_id), json.dumps(columns), ex=max(1, int(self.ttl)))
+
+    def delete(self, user_ids):
+        if user_ids:
+            self.client.delete(*[self._key(user_id) for user_id in user_ids])
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self._key('*')))
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'redis': RedisBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    name = current_app.config['USER_CACHE_BACKEND']
+    if name == 'none':
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[name](current_app.config['USER_CACHE_MAX_ENTRIES'],
+                                      current_app.config['USER_CACHE_TTL'])
+        return _backend
+
+
+def _load_columns(user_id):
+    row = db.session.execute(select(*[User.__table__.c[name] for name in COLUMNS])
+                             .where(User.id == user_id)).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def load_user(user_id):
+    user_id = int(user_id)
+    backend = get_backend()
+    columns = backend.get(user_id) if backend is not None else None
+    if columns is not None:
+        metrics.user_cache_lookups.inc(('hit',))
+        return CachedUser(columns)
+    columns = _load_columns(user_id)
+    if columns is None:
+        return None
+    if backend is not None:
+        backend.set(user_id, columns)
+        metrics.user_cache_lookups.inc(('miss',))
+    return CachedUser(columns)
+
+
+def invalidate(*user_ids):
+    backend = get_backend()
+    if backend is not None:
+        backend.delete(user_ids)
+
+
+def _after_flush(session, flush_context):
+    changed = session.info.setdefault('user_cache_changed', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+        elif isinstance(obj, Script):
+            changed.add(obj.user_id)
+
+
+def _after_commit(session):
+    # After the commit, so a concurrent request can't cache the old row again.
+    changed = session.info.pop('user_cache_changed', None)
+    if changed:
+        invalidate(*changed)
+
+
+def _after_rollback(session):
+    session.info.pop('user_cache_changed', None)
+
+
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_rollback', _after_rollback)
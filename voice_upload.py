@@ -0,0 +1,304 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import struct
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app import db
+from models import Script
+import audio_store
+import jobs
+import storage
+import transcode
+from music_catalog import probe_duration
+
+# Voice recordings arrive either as one multipart POST to /record_voice or,
+# from the browser recorder, as a resumable upload: the client opens a
+# session with the total size, then PUTs the bytes in pieces at an explicit
+# offset and can ask for the offset to resume from after a dropped
+# connection. Either way the bytes are written to a .part file in fixed-size
+# chunks, the size limit is enforced before anything is written and the
+# duration limit as soon as a WAV header is seen, and the request returns
+# once the bytes are on disk. The process_voice job then checks the audio
+# decodes and is within the limits, measures its loudness, normalizes it and
+# encodes it to VOICE_UPLOAD_FORMAT before attaching it to the script.
+
+WAV_FORMAT = {'extension': 'wav', 'args': ['-c:a', 'pcm_s16le', '-f', 'wav']}
+_LOUDNORM_RE = re.compile(r'\{[^{}]*"input_i"[^{}]*\}')
+_ready_dirs = set()
+
+
+def _seconds_text(seconds):
+    return f"{seconds // 60} minute" if seconds % 60 == 0 else f"{seconds} second"
+
+
+class VoiceUploadError(Exception):
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def _upload_dir():
+    directory = os.path.join(current_app.config['UPLOAD_FOLDER'], 'voice_uploads')
+    if directory not in _ready_dirs:
+        os.makedirs(directory, exist_ok=True)
+        _ready_dirs.add(directory)
+    return directory
+
+
+def _paths(upload_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+        raise VoiceUploadError('Upload not found', 404)
+    base = os.path.join(_upload_dir(), upload_id)
+    return f"{base}.part", f"{base}.json"
+
+
+def check_size(size):
+    limit = current_app.config['VOICE_UPLOAD_MAX_BYTES']
+    if size is not None and size > limit:
+        raise VoiceUploadError(f'Recording is larger than the {limit / (1024 * 1024):.3g} MB limit', 413)
+
+
+def wav_seconds(header, total_size):
+    # Duration implied by a WAV header and the total upload size, or None if
+    # the header isn't one we can read (the background job checks those).
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    position = 12
+    while position + 8 <= len(header):
+        chunk_id, chunk_size = header[position:position + 4], struct.unpack('<I', header[position + 4:position + 8])[0]
+        if chunk_id == b'fmt ' and position + 20 <= len(header):
+            byte_rate = struct.unpack('<I', header[position + 16:position + 20])[0]
+            return total_size / byte_rate if byte_rate else None
+        position += 8 + chunk_size + chunk_size % 2
+    return None
+
+
+def check_duration(header, total_size):
+    seconds = wav_seconds(header, total_size)
+    limit = current_app.config['VOICE_UPLOAD_MAX_SECONDS']
+    if seconds is not None and seconds > limit:
+        raise VoiceUploadError(f'Recording is longer than the {_seconds_text(limit)} limit', 413)
+
+
+def write_chunks(stream, f, limit, offset=0, total_size=None):
+    # Copies stream into f in STORAGE_CHUNK_SIZE pieces, failing as soon as
+    # more than `limit` bytes arrive. Returns the number of bytes written.
+    chunk_size = current_app.config['STORAGE_CHUNK_SIZE']
+    written = 0
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        if written + len(chunk) > limit:
+            raise VoiceUploadError('Upload is larger than declared', 413)
+        if offset == 0 and written == 0 and total_size:
+            check_duration(chunk, total_size)
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def final_filename(user_id, script_id):
+    fmt = current_app.config['VOICE_UPLOAD_FORMAT']
+    extension = transcode.FORMATS.get(fmt, WAV_FORMAT)['extension']
+    return secure_filename(f"user_voice_{user_id}_{script_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{extension}")
+
+
+def _owned_script(script_id, user_id):
+    script = db.session.get(Script, int(script_id)) if str(script_id or '').isdigit() else None
+    if script is None or script.user_id != user_id:
+        raise VoiceUploadError('Invalid script or unauthorized access', 403)
+    return script
+
+
+def _process(upload_id, meta):
+    filename = final_filename(meta['user_id'], meta['script_id'])
+    job = jobs.enqueue('process_voice', {'upload_id': upload_id, 'script_id': meta['script_id'], 'filename': filename},
+                       user_id=meta['user_id'])
+    return filename, job
+
+
+def save_single(stream, content_length, script_id, user_id):
+    # The one-request path. Returns (filename, job).
+    check_size(content_length)
+    _owned_script(script_id, user_id)
+    upload_id = uuid.uuid4().hex
+    part_path, _ = _paths(upload_id)
+    try:
+        with open(part_path, 'wb') as f:
+            size = write_chunks(stream, f, current_app.config['VOICE_UPLOAD_MAX_BYTES'], total_size=content_length)
+    except Exception:
+        os.remove(part_path)
+        raise
+    if not size:
+        os.remove(part_path)
+        raise VoiceUploadError('No audio data received')
+    logging.info(f"Received voice recording for script {script_id} ({size} bytes)")
+    return _process(upload_id, {'user_id': user_id, 'script_id': int(script_id)})
+
+
+def create(script_id, user_id, size):
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise VoiceUploadError('size must be the total number of bytes')
+    if size <= 0:
+        raise VoiceUploadError('size must be the total number of bytes')
+    check_size(size)
+    _owned_script(script_id, user_id)
+    expire_stale()
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _paths(upload_id)
+    meta = {'user_id': user_id, 'script_id': int(script_id), 'size': size, 'created': time.time()}
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return upload_id, meta
+
+
+def _load(upload_id, user_id):
+    part_path, meta_path = _paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        offset = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise VoiceUploadError('Upload not found', 404)
+    if meta['user_id'] != user_id:
+        raise VoiceUploadError('Upload not found', 404)
+    return meta, offset, part_path, meta_path
+
+
+def status(upload_id, user_id):
+    meta, offset, _, _ = _load(upload_id, user_id)
+    return {'upload_id': upload_id, 'offset': offset, 'size': meta['size']}
+
+
+@contextmanager
+def _locked(upload_id):
+    # An exclusive lock on the upload's meta file, so two PUTs for the same
+    # upload can't both pass the offset check or both complete it.
+    _, meta_path = _paths(upload_id)
+    try:
+        f = open(meta_path)
+    except FileNotFoundError:
+        raise VoiceUploadError('Upload not found', 404)
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if os.fstat(f.fileno()).st_nlink == 0:
+            # Completed or expired while we waited.
+            raise VoiceUploadError('Upload not found', 404)
+        yield
+
+
+def append(upload_id, user_id, offset, stream):
+    # Writes one piece at `offset`. Returns (offset, None) while bytes are
+    # still missing and (offset, (filename, job)) once the upload is whole.
+    with _locked(upload_id):
+        meta, current, part_path, meta_path = _load(upload_id, user_id)
+        if offset != current:
+            raise VoiceUploadError('Offset does not match the bytes received so far', 409, offset=current)
+        with open(part_path, 'ab') as f:
+            current += write_chunks(stream, f, meta['size'] - current, offset=current, total_size=meta['size'])
+        if current < meta['size']:
+            return current, None
+        os.remove(meta_path)
+        return current, _process(upload_id, meta)
+
+
+def expire_stale():
+    # Drops sessions nobody has written to for VOICE_UPLOAD_EXPIRY seconds.
+    cutoff = time.time() - current_app.config['VOICE_UPLOAD_EXPIRY']
+    for entry in os.scandir(_upload_dir()):
+        if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+            part_path = entry.path[:-len('.json')] + '.part'
+            if os.path.exists(part_path) and os.path.getmtime(part_path) >= cutoff:
+                continue
+            for path in (entry.path, part_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def _loudnorm_filter(target, measured=None):
+    settings = f"loudnorm=I={target}:TP=-1.5:LRA=11"
+    if measured is None:
+        return f"{settings}:print_format=json"
+    return (f"{settings}:measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true")
+
+
+def process_file(ffmpeg, src, dst, fmt, bitrate, max_seconds, target):
+    # Runs inside a pool process, so it must not touch the app or database.
+    # Raises ValueError for recordings that can't be used.
+    started = time.monotonic()
+    duration = probe_duration(ffmpeg, src)
+    if duration is None:
+        raise ValueError('Recording is not a readable audio file')
+    if duration > max_seconds:
+        raise ValueError(f'Recording is longer than the {_seconds_text(max_seconds)} limit')
+
+    analysis = subprocess.run([ffmpeg, '-nostdin', '-hide_banner', '-i', src, '-vn', '-af', _loudnorm_filter(target),
+                               '-f', 'null', '-'], capture_output=True, text=True)
+    match = _LOUDNORM_RE.search(analysis.stderr)
+    if analysis.returncode != 0 or not match:
+        raise ValueError('Recording could not be analysed')
+    measured = json.loads(match.group(0))
+    if measured['input_i'] in ('-inf', 'inf') or float(measured['input_i']) < -70:
+        raise ValueError('Recording is silent')
+
+    encoding = transcode.FORMATS.get(fmt, WAV_FORMAT)
+    tmp = f"{dst}.tmp"
+    args = [ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-i', src, '-vn', '-af', _loudnorm_filter(target, measured),
+            '-ac', '1', *encoding['args']]
+    if encoding is not WAV_FORMAT:
+        args += ['-b:a', bitrate]
+    try:
+        subprocess.run(args + [tmp], check=True, capture_output=True)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {
+        'duration': duration,
+        'loudness_lufs': float(measured['input_i']),
+        'true_peak_dbtp': float(measured['input_tp']),
+        'loudness_range_lu': float(measured['input_lra']),
+        'target_lufs': target,
+        'bytes_in': os.path.getsize(src),
+        'bytes_out': os.path.getsize(dst),
+        'seconds': time.monotonic() - started,
+    }
+
+
+@jobs.job_handler('process_voice')
+def run_process_voice_job(job, payload):
+    part_path, _ = _paths(payload['upload_id'])
+    filename = payload['filename']
+    scratch_path = storage.scratch_path(filename)
+    config = current_app.config
+    try:
+        stats = transcode.get_pool().submit(process_file, config['FFMPEG_BINARY'], part_path, scratch_path,
+                                            config['VOICE_UPLOAD_FORMAT'], config['VOICE_UPLOAD_BITRATE'],
+                                            config['VOICE_UPLOAD_MAX_SECONDS'], config['VOICE_LOUDNESS_TARGET']).result()
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    jobs.set_progress(job, 0.8)
+    script = db.session.get(Script, payload['script_id'])
+    if script is None:
+        os.remove(scratch_path)
+        raise ValueError('Script was deleted before the recording was processed')
+    storage.get_storage().save_file(filename, scratch_path)
+    audio_store.release(script)
+    script.audio_file = filename
+    db.session.commit()
+    logging.info(f"Attached voice recording {filename} to script {script.id}: {stats['duration']:.1f}s, "
+                 f"{stats['loudness_lufs']:.1f} LUFS normalized to {stats['target_lufs']} LUFS")
+    return {'script_id': script.id, 'filename': filename, **stats}
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from metrics import LatencyHistogram
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class WebhookError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and fails fast for
+    # `reset_timeout` seconds, then lets a single trial call through.
+    # before_call() returns True for that trial; its caller must end_trial()
+    # whatever happens, or the circuit would stay open for good.
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half_open' and self._trial_in_flight):
+                raise CircuitOpenError("Script generation service is unavailable, please try again shortly")
+            if state == 'half_open':
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def end_trial(self):
+        # Frees the trial slot when the trial ended without recording a result.
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class WebhookClient:
+    def __init__(self, url, connect_timeout=3.05, read_timeout=120, max_attempts=3, backoff_base=0.5,
+                 backoff_max=8, failure_threshold=5, reset_timeout=30, pool_size=10):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyHistogram(LATENCY_BUCKETS)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        # Full jitter: uniform over [0, base * 2^attempt], capped.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post_json(self, payload, stream=False):
+        # With stream=True the body is left unread; the caller must close the response.
+        trial = self.breaker.before_call()
+        try:
+            return self._post_json(payload, stream)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    def _post_json(self, payload, stream):
+        last_error = None
+        for attempt in range(self.max_attempts):
+            started = time.monotonic()
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout, stream=stream)
+            except requests.Timeout as e:
+                self.latency.observe('timeout', time.monotonic() - started)
+                last_error = WebhookError(f"Webhook request timed out: {str(e)}")
+            except requests.ConnectionError as e:
+                self.latency.observe('connection_error', time.monotonic() - started)
+                last_error = WebhookError(f"Could not connect to webhook: {str(e)}")
+            except requests.RequestException as e:
+                # e.g. ChunkedEncodingError from a truncated body.
+                self.latency.observe('request_error', time.monotonic() - started)
+                last_error = WebhookError(f"Webhook request failed: {str(e)}")
+            else:
+                if response.status_code == 200:
+                    self.latency.observe('success', time.monotonic() - started)
+                    self.breaker.record_success()
+                    return response
+                response.close()
+                self.latency.observe(f"http_{response.status_code // 100}xx", time.monotonic() - started)
+                last_error = WebhookError(f"Webhook request failed with status code {response.status_code}")
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    raise last_error
+                if response.headers.get('Retry-After', '').isdigit():
+                    retry_after = int(response.headers['Retry-After'])
+
+            if attempt + 1 < self.max_attempts:
+                delay = self._backoff(attempt, retry_after)
+                logging.warning(f"Webhook attempt {attempt + 1} failed ({last_error}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+        self.breaker.record_failure()
+        raise last_error
+
+    def stats(self):
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'latency_seconds': self.latency.snapshot(),
+        }
+
+
+class AsyncWebhookClient:
+    # httpx-based twin of WebhookClient for the ASGI entry point. It shares
+    # the sync client's circuit breaker and latency histogram, so both modes
+    # see the same circuit state.
+    def __init__(self, client, pool_size):
+        import httpx
+        self.client = client
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(client.timeout[1], connect=client.timeout[0]),
+                                      limits=httpx.Limits(max_connections=pool_size))
+
+    @asynccontextmanager
+    async def stream_json(self, payload):
+        client = self.client
+        trial = client.breaker.before_call()
+        try:
+            async with self._stream_json(payload) as response:
+                yield response
+        finally:
+            if trial:
+                client.breaker.end_trial()
+
+    @asynccontextmanager
+    async def _stream_json(self, payload):
+        import httpx
+        client = self.client
+        last_error = None
+        for attempt in range(client.max_attempts):
+            started = time.monotonic()
+            retry_after = None
+            try:
+                response = await self.http.send(self.http.build_request('POST', client.url, json=payload), stream=True)
+            except httpx.TimeoutException as e:
+                client.latency.observe('timeout', time.monotonic() - started)
+                last_error = WebhookError(f"Webhook request timed out: {str(e)}")
+            except httpx.TransportError as e:
+                client.latency.observe('connection_error', time.monotonic() - started)
+                last_error = WebhookError(f"Could not connect to webhook: {str(e)}")
+            except httpx.HTTPError as e:
+                client.latency.observe('request_error', time.monotonic() - started)
+                last_error = WebhookError(f"Webhook request failed: {str(e)}")
+            else:
+                if response.status_code == 200:
+                    client.latency.observe('success', time.monotonic() - started)
+                    client.breaker.record_success()
+                    try:
+                        yield response
+                    finally:
+                        await response.aclose()
+                    return
+                await response.aclose()
+                client.latency.observe(f"http_{response.status_code // 100}xx", time.monotonic() - started)
+                last_error = WebhookError(f"Webhook request failed with status code {response.status_code}")
+                if response.status_code not in RETRYABLE_STATUS:
+                    client.breaker.record_success()
+                    raise last_error
+                if response.headers.get('Retry-After', '').isdigit():
+                    retry_after = int(response.headers['Retry-After'])
+
+            if attempt + 1 < client.max_attempts:
+                delay = client._backoff(attempt, retry_after)
+                logging.warning(f"Webhook attempt {attempt + 1} failed ({last_error}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        client.breaker.record_failure()
+        raise last_error
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def get_client():
+    global _client
+    url = current_app.config['SCRIPT_GENERATION_WEBHOOK_URL']
+    if not url:
+        raise ValueError("SCRIPT_GENERATION_WEBHOOK_URL environment variable is not set")
+    with _client_lock:
+        if _client is None or _client.url != url:
+            config = current_app.config
+            _client = WebhookClient(
+                url,
+                connect_timeout=config['WEBHOOK_CONNECT_TIMEOUT'],
+                read_timeout=config['WEBHOOK_READ_TIMEOUT'],
+                max_attempts=config['WEBHOOK_MAX_ATTEMPTS'],
+                backoff_base=config['WEBHOOK_BACKOFF_BASE'],
+                backoff_max=config['WEBHOOK_BACKOFF_MAX'],
+                failure_threshold=config['WEBHOOK_CIRCUIT_FAILURE_THRESHOLD'],
+                reset_timeout=config['WEBHOOK_CIRCUIT_RESET_TIMEOUT'],
+                pool_size=config['WEBHOOK_POOL_SIZE'],
+            )
+        return _client
+
+
+def get_async_client():
+    # One per process; the ASGI server runs a single event loop.
+    global _async_client
+    client = get_client()
+    if _async_client is None or _async_client.client is not client:
+        _async_client = AsyncWebhookClient(client, current_app.config['WEBHOOK_POOL_SIZE'])
+    return _async_client